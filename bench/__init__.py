@@ -0,0 +1,12 @@
+"""
+Нагрузочные сценарии и бенчмарки без реальных токенов и расходов.
+
+Обработчики бота прогоняются через локальные заглушки Telegram Bot API,
+OpenAI и ElevenLabs с настраиваемыми задержками, ошибками и ответами 429.
+Запуск из корня проекта (нужен ffmpeg):
+
+    python -m bench                      # все сценарии
+    python -m bench voice_burst --save-baseline
+    python -m bench startup              # холодный запуск bot.py
+    python -m bench --fail-on-regression
+"""
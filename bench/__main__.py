@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from bench.scenarios import SCENARIOS
+
+# Имена бенчмарков холодного запуска (bench/startup.py) и масштабирования
+# на несколько процессов (bench/workers.py) среди сценариев
+STARTUP = "startup"
+WORKERS = "workers"
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Сравниваемые с базовой линией показатели: (ключ, True если больше — лучше)
+COMPARED_METRICS = (
+    ("latency_p50", False),
+    ("latency_p95", False),
+    ("latency_p99", False),
+    ("throughput_messages", True),
+    ("peak_rss_mb", False),
+    ("loop_lag_p99", False),
+    ("error_replies", False),
+    ("telegram_calls_per_message", False),
+)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_in_subprocess(name, seed, verbose):
+    """
+    Прогоняет сценарий в отдельном процессе
+
+    У каждого сценария свой процесс: состояние бота (кэш, выключатели провайдеров)
+    не переходит между сценариями, а пиковый RSS относится только к одному прогону.
+    """
+    command = [sys.executable, "-m", "bench", "--worker", name, "--seed", str(seed)]
+    if verbose:
+        command.append("--verbose")
+    completed = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Сценарий {name} завершился с кодом {completed.returncode}")
+    # Результат — последняя строка stdout, выше могут быть сообщения config
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def load_baseline(name):
+    try:
+        with open(baseline_path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(result):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(result["scenario"]), "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+
+
+def _format(value):
+    if value is None:
+        return "—"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+
+def compare(result, baseline, tolerance, metrics=COMPARED_METRICS):
+    """
+    Печатает показатели прогона рядом с базовой линией
+
+    :param metrics: сравниваемые показатели: кортежи (ключ, True если больше — лучше)
+    :return: список показателей, ухудшившихся больше чем на tolerance (доля)
+    """
+    regressions = []
+    print(f"  {'показатель':<30}{'сейчас':>12}{'база':>12}{'изменение':>12}")
+    for key, higher_is_better in metrics:
+        value = result.get(key)
+        reference = baseline.get(key) if baseline else None
+        change = ""
+        if value is not None and reference:
+            delta = (value - reference) / reference
+            change = f"{delta:+.0%}"
+            worse = -delta if higher_is_better else delta
+            if worse > tolerance:
+                regressions.append(key)
+                change += " !"
+        print(f"  {key:<30}{_format(value):>12}{_format(reference):>12}{change:>12}")
+    return regressions
+
+
+def print_result(result):
+    print(f"\n== {result['scenario']}: {result['description']}")
+    print(
+        f"  сообщений: {result['messages']}, аудио: {result['audio_seconds']} с, "
+        f"время: {result['elapsed']:.1f} с, {result['throughput_audio_seconds']:.1f} с аудио/с"
+    )
+    print(f"  ответов с ошибкой: {result['error_replies']}, упавших обновлений: {result['failed_updates']}")
+    for provider, stats in result["providers"].items():
+        print(
+            f"  {provider}: запросов {stats['requests']}, ошибок {stats['errors']}, "
+            f"429: {stats['rate_limited']}, пик параллельных {stats['peak_in_flight']}"
+        )
+    for provider, stats in result.get("rate_limit", {}).items():
+        if stats["delayed"] or stats["rejected"] or stats["rate_limited"]:
+            print(
+                f"  лимиты {provider}: ожиданий {stats['delayed']}, отказов {stats['rejected']}, "
+                f"429 получено {stats['rate_limited']}, повторов {stats['retries']}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m bench",
+        description="Нагрузочные сценарии бота на локальных заглушках Telegram, OpenAI и ElevenLabs",
+    )
+    parser.add_argument(
+        "scenarios", nargs="*", help=f"сценарии (по умолчанию все): {', '.join((STARTUP, *SCENARIOS, WORKERS))}"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed генератора нагрузки")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как базовую линию")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение относительно базы (доля)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="код возврата 1 при ухудшении")
+    parser.add_argument("--repeats", type=int, default=5, help="число запусков для медианы времени импорта")
+    parser.add_argument("--verbose", action="store_true", help="не приглушать логи бота")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        from bench.runner import main_worker
+        main_worker(args.worker, args.seed, args.verbose)
+        return
+
+    names = args.scenarios or [STARTUP, *SCENARIOS, WORKERS]
+    unknown = [name for name in names if name not in (STARTUP, WORKERS) and name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    revision = git_revision()
+    regressions = {}
+    for name in names:
+        if name == STARTUP:
+            # Бенчмарк запуска сам запускает бота и интерпретаторы в отдельных процессах
+            from bench.startup import COMPARED_METRICS as metrics, run_startup, print_startup
+            result = run_startup(args.repeats, args.verbose)
+            print_startup(result)
+        elif name == WORKERS:
+            # Бот запускается целиком, с одним и несколькими процессами-обработчиками
+            from bench.workers import COMPARED_METRICS as metrics, run_workers, print_workers
+            result = run_workers(args.verbose)
+            print_workers(result)
+        else:
+            metrics = COMPARED_METRICS
+            result = run_in_subprocess(name, args.seed, args.verbose)
+            print_result(result)
+        result.update(revision=revision, python=platform.python_version(), recorded_at=time.time())
+        baseline = load_baseline(name)
+        if baseline:
+            print(f"  база: ревизия {baseline.get('revision')}")
+        failed = compare(result, baseline, args.tolerance, metrics)
+        if failed:
+            regressions[name] = failed
+        if args.save_baseline:
+            save_baseline(result)
+            print(f"  сохранено в {baseline_path(name)}")
+
+    if regressions:
+        print("\nУхудшения относительно базовой линии:")
+        for name, keys in regressions.items():
+            print(f"  {name}: {', '.join(keys)}")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import tempfile
+from pydub import AudioSegment
+
+# Синтетическая «речь»: тон с плавающей частотой и шумом, 4 с звука и 1 с тишины,
+# чтобы у нарезки на фрагменты и обрезки тишины были паузы для работы
+SPEECH_EXPRESSION = (
+    "0.4*sin(2*PI*(180+40*sin(2*PI*0.7*t))*t)*lt(mod(t\\,5)\\,4)"
+    "+0.01*(random(0)-0.5)"
+)
+
+# Форматы, в которых Telegram присылает голосовые сообщения и аудиофайлы
+FORMATS = {
+    "voice": ("voice.ogg", ["-c:a", "libopus", "-b:a", "32k", "-f", "ogg"]),
+    "audio": ("audio.mp3", ["-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3"]),
+    "video_note": ("video_note.mp4", [
+        "-c:v", "mpeg4", "-q:v", "8", "-c:a", "aac", "-b:a", "64k",
+        "-movflags", "+faststart", "-shortest", "-f", "mp4",
+    ]),
+}
+
+# Видеоряд для видеосообщений: квадратная тестовая таблица, как у «кружков» Telegram
+VIDEO_SOURCE = "testsrc=s=240x240:r=25:d={duration}"
+
+
+def generate_audio(kind, duration):
+    """
+    Генерирует синтетическое аудио через ffmpeg
+
+    :param kind: "voice" (Opus/OGG 32 кбит/с), "audio" (MP3 128 кбит/с) или "video_note" (MP4 с AAC)
+    :param duration: длительность в секундах
+    :return: кортеж (имя файла, байты)
+    """
+    filename, output_args = FORMATS[kind]
+    inputs = ["-f", "lavfi", "-i", f"aevalsrc={SPEECH_EXPRESSION}:s=16000:d={duration}"]
+    if kind != "video_note":
+        command = [AudioSegment.converter, "-hide_banner", "-loglevel", "error", *inputs, *output_args, "pipe:1"]
+        result = subprocess.run(command, capture_output=True, check=True)
+        return filename, result.stdout
+    # MP4 с индексом в начале файла нельзя записать в канал, поэтому пишем во временный файл
+    inputs = ["-f", "lavfi", "-i", VIDEO_SOURCE.format(duration=duration), *inputs]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, filename)
+        command = [AudioSegment.converter, "-hide_banner", "-loglevel", "error", *inputs, *output_args, path]
+        subprocess.run(command, capture_output=True, check=True)
+        with open(path, "rb") as f:
+            return filename, f.read()
+
+
+class AudioLibrary:
+    """Кэш сгенерированных файлов: одинаковые (тип, длительность) генерируются один раз"""
+
+    def __init__(self):
+        self._files = {}
+
+    def get(self, kind, duration, tag=None):
+        """
+        Возвращает (имя файла, байты) нужного типа и длительности
+
+        :param tag: метка, дописываемая в конец файла: разные метки дают разное
+            содержимое (и хэш) без повторной генерации, декодеры хвост игнорируют
+        """
+        key = (kind, duration)
+        if key not in self._files:
+            self._files[key] = generate_audio(kind, duration)
+        filename, data = self._files[key]
+        if tag is not None:
+            data = data + f"\0{tag}\0".encode() * 4
+        return filename, data
@@ -0,0 +1,240 @@
+import asyncio
+import itertools
+import math
+import random
+import time
+from aiohttp import web
+
+
+class FaultConfig:
+    """
+    Поведение заглушки провайдера: задержка ответа и доля ошибок
+
+    Параметры можно менять во время прогона (например, имитировать отказ провайдера).
+    """
+
+    def __init__(self, latency=0.3, latency_per_mb=0.5, jitter=0.2, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, outage=False, requests_per_minute=0):
+        """
+        :param latency: базовая задержка ответа в секундах
+        :param latency_per_mb: дополнительная задержка на каждый мегабайт загруженного аудио
+        :param jitter: относительный разброс задержки (0.2 — ±20%)
+        :param error_rate: доля ответов 500
+        :param rate_limit_rate: доля ответов 429 с заголовком Retry-After
+        :param retry_after: значение Retry-After в секундах
+        :param outage: если True, все запросы получают 503
+        :param requests_per_minute: квота провайдера в скользящем окне минуты (0 — без квоты);
+            запросы сверх квоты получают 429 с Retry-After до освобождения места
+        """
+        self.latency = latency
+        self.latency_per_mb = latency_per_mb
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.outage = outage
+        self.requests_per_minute = requests_per_minute
+        self._accepted = []
+
+    def update(self, **changes):
+        for name, value in changes.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Неизвестный параметр заглушки: {name}")
+            setattr(self, name, value)
+
+    def delay(self, size):
+        base = self.latency + self.latency_per_mb * size / (1024 * 1024)
+        return max(0.0, base * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def fault(self):
+        """Возвращает ответ с ошибкой, если запрос должен завершиться ошибкой, иначе None"""
+        if self.outage:
+            return web.json_response({"error": {"message": "service unavailable"}}, status=503)
+        if self.requests_per_minute:
+            now = time.monotonic()
+            self._accepted = [at for at in self._accepted if now - at < 60]
+            if len(self._accepted) >= self.requests_per_minute:
+                return web.json_response(
+                    {"error": {"message": "quota exceeded"}},
+                    status=429,
+                    headers={"Retry-After": str(math.ceil(60 - (now - self._accepted[0])))},
+                )
+            self._accepted.append(now)
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return web.json_response(
+                {"error": {"message": "rate limit exceeded"}},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            return web.json_response({"error": {"message": "internal error"}}, status=500)
+        return None
+
+
+class ProviderStats:
+    """Счетчики запросов к заглушке провайдера"""
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+async def _read_upload(request):
+    """Читает multipart-запрос целиком и возвращает размер загруженного файла"""
+    size = 0
+    reader = await request.multipart()
+    async for part in reader:
+        while True:
+            chunk = await part.read_chunk()
+            if not chunk:
+                break
+            if part.filename:
+                size += len(chunk)
+    return size
+
+
+def _provider_handler(fault_config, stats, make_response):
+    """Создает обработчик заглушки распознавания с задержкой и ошибками по fault_config"""
+    async def handler(request):
+        stats.requests += 1
+        stats.in_flight += 1
+        stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+        try:
+            size = await _read_upload(request)
+            stats.bytes_received += size
+            await asyncio.sleep(fault_config.delay(size))
+            response = fault_config.fault()
+            if response is not None:
+                if response.status == 429:
+                    stats.rate_limited += 1
+                else:
+                    stats.errors += 1
+                return response
+            stats.successes += 1
+            return make_response(f"Синтетическая расшифровка {size} байт аудио.")
+        finally:
+            stats.in_flight -= 1
+    return handler
+
+
+def create_openai_app(fault_config, stats):
+    """Заглушка OpenAI: POST /v1/audio/transcriptions (response_format=text)"""
+    app = web.Application(client_max_size=100 * 1024 * 1024)
+    app.router.add_post(
+        "/v1/audio/transcriptions",
+        _provider_handler(fault_config, stats, lambda text: web.Response(text=text, content_type="text/plain")),
+    )
+    return app
+
+
+def create_elevenlabs_app(fault_config, stats):
+    """Заглушка ElevenLabs: POST /v1/speech-to-text"""
+    def respond(text):
+        return web.json_response({
+            "language_code": "rus",
+            "language_probability": 1.0,
+            "text": text,
+            "words": [],
+        })
+
+    app = web.Application(client_max_size=100 * 1024 * 1024)
+    app.router.add_post("/v1/speech-to-text", _provider_handler(fault_config, stats, respond))
+    return app
+
+
+class FakeTelegram:
+    """
+    Заглушка Telegram Bot API: отдает файлы и принимает отправку, правку и удаление сообщений
+
+    Файлы регистрируются через add_file. Текст, который в итоге показан в каждом
+    сообщении бота (с учетом правок и удалений), хранится в texts, чтобы после
+    прогона посчитать ответы с ошибками, а все вызовы с отметкой времени — в log,
+    чтобы замерить время до первого ответа.
+    """
+
+    def __init__(self, fault_config=None):
+        self.fault_config = fault_config or FaultConfig(latency=0.02, latency_per_mb=0.05, jitter=0.5)
+        self.files = {}
+        # (chat_id, message_id) -> текст, показанный в сообщении сейчас
+        self.texts = {}
+        self.calls = {}
+        # (time.perf_counter(), метод, текст) для каждого вызова
+        self.log = []
+        self._message_ids = itertools.count(1000)
+
+    def add_file(self, file_id, data):
+        self.files[file_id] = data
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        return app
+
+    async def _params(self, request):
+        if request.method == "GET":
+            return dict(request.query)
+        return dict(await request.post())
+
+    def _message(self, chat_id, text, message_id=None):
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": text,
+        }
+
+    async def _method(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await self._params(request)
+        self.log.append((time.perf_counter(), method, params.get("text", "")))
+        await asyncio.sleep(self.fault_config.delay(0))
+
+        if method == "getFile":
+            file_id = params["file_id"]
+            result = {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_size": len(self.files.get(file_id, b"")),
+                "file_path": f"voice/{file_id}",
+            }
+        elif method == "sendMessage":
+            result = self._message(params.get("chat_id", 0), params.get("text", ""))
+            self.texts[(result["chat"]["id"], result["message_id"])] = result["text"]
+        elif method == "editMessageText":
+            result = self._message(params.get("chat_id", 0), params.get("text", ""), int(params["message_id"]))
+            self.texts[(result["chat"]["id"], result["message_id"])] = result["text"]
+        else:
+            if method == "deleteMessage":
+                self.texts.pop((int(params.get("chat_id", 0)), int(params.get("message_id", 0))), None)
+            # deleteMessage, setMyCommands и прочие методы, которым достаточно True
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _download(self, request):
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        data = self.files.get(file_id)
+        if data is None:
+            return web.Response(status=404)
+        await asyncio.sleep(self.fault_config.delay(len(data)))
+        return web.Response(body=data, content_type="application/octet-stream")
+
+
+async def start_app(app, host="127.0.0.1"):
+    """Запускает приложение aiohttp на свободном порту и возвращает (runner, базовый URL)"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from bench.fakes import FaultConfig, ProviderStats, FakeTelegram, create_openai_app, create_elevenlabs_app, start_app
+from bench.audio_samples import AudioLibrary
+from bench.scenarios import SCENARIOS, build_messages
+
+BENCH_TOKEN = "123456:BENCH"
+
+# Отметки в тексте ответа, по которым он считается неуспешной обработкой. Ищутся
+# по всему тексту: в общем ответе на пакет ошибка одного сообщения стоит в середине
+FAILED_CHUNK_TEXT = "[фрагмент не распознан]"
+ERROR_MARKERS = ("❌", "⚠️", FAILED_CHUNK_TEXT)
+
+
+def percentile(values, percentile):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (Linux), иначе пиковый RSS из getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss в килобайтах на Linux и в байтах на macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopMonitor:
+    """Замеряет задержку цикла событий и пиковый RSS, просыпаясь каждые interval секунд"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self.peak_rss = current_rss()
+        self._task = None
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - expected))
+            if len(self.lags) % 10 == 0:
+                self.peak_rss = max(self.peak_rss, current_rss())
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+
+def make_update(update_id, message, file_id, file_size):
+    """Собирает сырое обновление Telegram с голосовым сообщением, аудиофайлом или видеосообщением"""
+    media = {
+        "file_id": file_id,
+        "file_unique_id": message["file_key"],
+        "duration": message["duration"],
+        "file_size": file_size,
+    }
+    if message["kind"] == "voice":
+        media["mime_type"] = "audio/ogg"
+    elif message["kind"] == "video_note":
+        media["length"] = 240
+    else:
+        media.update(mime_type="audio/mpeg", file_name="audio.mp3")
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": message["chat_id"], "type": "private"},
+            "from": {"id": message["chat_id"], "is_bot": False, "first_name": "Bench"},
+            message["kind"]: media,
+        },
+    }
+
+
+async def run_scenario(name, seed=0, verbose=False):
+    """
+    Прогоняет сценарий через обработчики бота с локальными заглушками вместо внешних API
+
+    Бот импортируется только после запуска заглушек, потому что config и клиенты
+    провайдеров читают адреса и ключи из окружения при импорте.
+
+    :return: словарь с результатами прогона
+    """
+    scenario = SCENARIOS[name]
+    provider_configs = {
+        provider: FaultConfig(**scenario.get("providers", {}).get(provider, {}))
+        for provider in ("whisper", "elevenlabs")
+    }
+    provider_stats = {provider: ProviderStats() for provider in provider_configs}
+    telegram = FakeTelegram()
+
+    runners = []
+    runner, openai_url = await start_app(create_openai_app(provider_configs["whisper"], provider_stats["whisper"]))
+    runners.append(runner)
+    runner, elevenlabs_url = await start_app(
+        create_elevenlabs_app(provider_configs["elevenlabs"], provider_stats["elevenlabs"])
+    )
+    runners.append(runner)
+    runner, telegram_url = await start_app(telegram.create_app())
+    runners.append(runner)
+
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "OPENAI_API_KEY": "sk-bench-openai-key",
+        "ELEVENLABS_API_KEY": "bench-elevenlabs-key",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "ELEVENLABS_BASE_URL": elevenlabs_url,
+        "TRANSCRIPT_CACHE_PATH": "",
+        "ROUTER_WEIGHTS": "whisper:1,elevenlabs:0",
+    })
+    os.environ.update(scenario.get("env", {}))
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from handlers.audio_handler import router, speech_converter, transcript_cache, job_scheduler, message_coalescer
+    from utils.metrics import REGISTRY
+
+    if not verbose:
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    # Файлы генерируются заранее, чтобы ffmpeg генератора не попадал в замеры
+    library = AudioLibrary()
+    messages = build_messages(scenario, seed)
+    updates = []
+    for index, message in enumerate(messages):
+        file_id = f"file_{message['file_key']}"
+        _, data = library.get(message["kind"], message["duration"], tag=message["file_key"])
+        telegram.add_file(file_id, data)
+        updates.append((message, make_update(index + 1, message, file_id, len(data))))
+    audio_seconds = sum(message["duration"] for message in messages)
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_url))
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+
+    # Клиенты SDK загружаются, как в bot.py при запуске, до начала нагрузки: иначе их импорт
+    # (несколько секунд) задерживает первые запросы за события сценария вроде отказа на 2-й секунде
+    await speech_converter.warm_up()
+
+    monitor = LoopMonitor()
+    failures = 0
+    started = time.perf_counter()
+    # Время поступления и время, когда расшифровка попала в ответ, по (chat_id, message_id).
+    # Сообщения, объединенные в пакет, отвечаются обработчиком владельца пакета,
+    # поэтому задержка считается по доставке ответа, а не по завершению своего обработчика
+    arrivals = {}
+    handled = {}
+    delivered = {}
+    message_coalescer.on_delivered(
+        lambda msg: delivered.setdefault((msg.chat.id, msg.message_id), time.perf_counter())
+    )
+
+    async def deliver(message, update):
+        nonlocal failures
+        await asyncio.sleep(max(0.0, started + message["at"] - time.perf_counter()))
+        key = (message["chat_id"], update["message"]["message_id"])
+        arrivals[key] = time.perf_counter()
+        try:
+            await dispatcher.feed_raw_update(bot, update)
+        except Exception as e:
+            failures += 1
+            logging.error(f"Обновление {update['update_id']} завершилось ошибкой: {e}")
+        handled[key] = time.perf_counter()
+
+    async def apply_events():
+        for at, provider, changes in scenario.get("events", []):
+            await asyncio.sleep(max(0.0, started + at - time.perf_counter()))
+            provider_configs[provider].update(**changes)
+
+    rss_before = current_rss()
+    monitor.start()
+    events_task = asyncio.create_task(apply_events())
+    await asyncio.gather(*(deliver(message, update) for message, update in updates))
+    elapsed = time.perf_counter() - started
+    events_task.cancel()
+    await monitor.stop()
+
+    latencies = [delivered.get(key, handled[key]) - arrived for key, arrived in arrivals.items()]
+    # Считается итоговый текст каждого сообщения бота: ошибка может появиться
+    # и при отправке, и при правке сообщения о статусе или потокового ответа
+    error_replies = sum(
+        1 for text in telegram.texts.values()
+        if any(marker in text for marker in ERROR_MARKERS)
+    )
+    result = {
+        "scenario": name,
+        "description": scenario["description"],
+        "seed": seed,
+        "messages": len(messages),
+        "audio_seconds": audio_seconds,
+        "elapsed": elapsed,
+        "throughput_messages": len(messages) / elapsed,
+        "throughput_audio_seconds": audio_seconds / elapsed,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        "error_replies": error_replies,
+        "failed_updates": failures,
+        "rss_before_mb": rss_before / 2 ** 20,
+        "peak_rss_mb": monitor.peak_rss / 2 ** 20,
+        "loop_lag_p50": percentile(monitor.lags, 50),
+        "loop_lag_p99": percentile(monitor.lags, 99),
+        "loop_lag_max": max(monitor.lags) if monitor.lags else None,
+        "providers": {provider: stats.as_dict() for provider, stats in provider_stats.items()},
+        "telegram_calls": telegram.calls,
+        "telegram_calls_per_message": sum(telegram.calls.values()) / len(messages),
+        "queue": job_scheduler.stats(),
+        "cache": transcript_cache.stats(),
+        "router": speech_converter.router_stats(),
+        "rate_limit": speech_converter.rate_limit_stats(),
+    }
+
+    if verbose:
+        logging.info(REGISTRY.render())
+    await speech_converter.close()
+    transcript_cache.close()
+    await bot.session.close()
+    for runner in runners:
+        await runner.cleanup()
+    return result
+
+
+def main_worker(name, seed, verbose):
+    """Точка входа дочернего процесса: печатает результат одной строкой JSON в stdout"""
+    result = asyncio.run(run_scenario(name, seed, verbose))
+    print(json.dumps(result, ensure_ascii=False, default=str))
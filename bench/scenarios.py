@@ -0,0 +1,142 @@
+import random
+
+# Сценарии нагрузки. Каждый описывает:
+#   traffic — группы сообщений: число, число чатов, тип файла, длительности (с), интервал поступления (с)
+#   providers — параметры заглушек провайдеров (см. FaultConfig)
+#   events — изменения заглушек во время прогона: (секунда, провайдер, параметры)
+#   duplicates — доля сообщений с уже отправленным ранее файлом (пересылки)
+#   env — переменные окружения бота на время сценария
+SCENARIOS = {
+    "voice_burst": {
+        "description": "Всплеск из 200 коротких голосовых сообщений из 20 чатов за секунду",
+        "traffic": [
+            {"count": 200, "chats": 20, "kind": "voice", "durations": (5, 15, 30, 60), "spread": 1.0},
+        ],
+        "providers": {
+            "whisper": {"latency": 0.4, "latency_per_mb": 1.0},
+            "elevenlabs": {"latency": 0.6, "latency_per_mb": 1.0},
+        },
+    },
+    "long_files": {
+        "description": "Несколько длинных MP3 (10–20 минут): нарезка на фрагменты и параллельное распознавание",
+        "traffic": [
+            {"count": 4, "chats": 4, "kind": "audio", "durations": (600, 1200), "spread": 2.0},
+        ],
+        "providers": {
+            "whisper": {"latency": 1.0, "latency_per_mb": 2.0},
+            "elevenlabs": {"latency": 1.5, "latency_per_mb": 2.0},
+        },
+    },
+    "provider_outage": {
+        "description": "Whisper полностью недоступен с 2-й по 8-ю секунду, нагрузка идет равномерно",
+        "traffic": [
+            {"count": 120, "chats": 30, "kind": "voice", "durations": (5, 15, 30), "spread": 12.0},
+        ],
+        "providers": {
+            "whisper": {"latency": 0.3},
+            "elevenlabs": {"latency": 0.5},
+        },
+        "events": [
+            (2.0, "whisper", {"outage": True}),
+            (8.0, "whisper", {"outage": False}),
+        ],
+    },
+    "rate_limited": {
+        "description": "Треть запросов к Whisper получает 429 с Retry-After",
+        "traffic": [
+            {"count": 100, "chats": 10, "kind": "voice", "durations": (5, 15, 30), "spread": 2.0},
+        ],
+        "providers": {
+            "whisper": {"latency": 0.3, "rate_limit_rate": 0.33, "retry_after": 1},
+            "elevenlabs": {"latency": 0.5},
+        },
+    },
+    "quota": {
+        "description": "Квота Whisper 40 запросов в минуту, неизвестная боту: ответы 429 и резервный провайдер",
+        "traffic": [
+            {"count": 80, "chats": 20, "kind": "voice", "durations": (5, 15), "spread": 10.0},
+        ],
+        "providers": {
+            "whisper": {"latency": 0.3, "requests_per_minute": 40},
+            "elevenlabs": {"latency": 0.5},
+        },
+    },
+    "forwarded": {
+        "description": "Пересылки: 70% сообщений повторяют уже распознанные файлы (работа кэша)",
+        "traffic": [
+            {"count": 150, "chats": 15, "kind": "voice", "durations": (5, 15, 30), "spread": 5.0},
+        ],
+        "duplicates": 0.7,
+        "providers": {
+            "whisper": {"latency": 0.4},
+            "elevenlabs": {"latency": 0.6},
+        },
+    },
+    "forwarded_batch": {
+        "description": "Пачки из 12 пересланных голосовых в 5 чатах, каждая приходит за полсекунды",
+        "traffic": [
+            {"count": 60, "chats": 5, "kind": "voice", "durations": (5, 15, 30), "spread": 0.5},
+        ],
+        "providers": {
+            "whisper": {"latency": 0.4},
+            "elevenlabs": {"latency": 0.6},
+        },
+    },
+    "video_notes": {
+        "description": "Видеосообщения до минуты: звук извлекается из видео потоково через ffmpeg",
+        "traffic": [
+            {"count": 40, "chats": 20, "kind": "video_note", "durations": (10, 30, 60), "spread": 5.0},
+        ],
+        # Видео одной длительности дают одинаковую дорожку и нашлись бы в кэше по хэшу аудио;
+        # кэш отключен, чтобы замерять извлечение звука и распознавание
+        "env": {"TRANSCRIPT_CACHE_MEMORY_ENTRIES": "0"},
+        "providers": {
+            "whisper": {"latency": 0.4, "latency_per_mb": 1.0},
+            "elevenlabs": {"latency": 0.6, "latency_per_mb": 1.0},
+        },
+    },
+    "mixed_steady": {
+        "description": "Равномерный поток голосовых и аудиофайлов около 5 сообщений в секунду",
+        "traffic": [
+            {"count": 80, "chats": 25, "kind": "voice", "durations": (5, 15, 30, 60), "spread": 20.0},
+            {"count": 20, "chats": 10, "kind": "audio", "durations": (60, 180, 300), "spread": 20.0},
+        ],
+        "providers": {
+            "whisper": {"latency": 0.5, "latency_per_mb": 1.0},
+            "elevenlabs": {"latency": 0.7, "latency_per_mb": 1.0},
+        },
+    },
+}
+
+
+def build_messages(scenario, seed=0):
+    """
+    Разворачивает сценарий в список сообщений, отсортированный по времени поступления
+
+    :return: список словарей с полями at, chat_id, kind, duration, file_key
+    """
+    rng = random.Random(seed)
+    messages = []
+    chat_offset = 0
+    for group in scenario["traffic"]:
+        for _ in range(group["count"]):
+            messages.append({
+                "at": rng.uniform(0, group["spread"]),
+                "chat_id": 100000 + chat_offset + rng.randrange(group["chats"]),
+                "kind": group["kind"],
+                "duration": rng.choice(group["durations"]),
+            })
+        chat_offset += group["chats"]
+    messages.sort(key=lambda m: m["at"])
+
+    # Пересланное сообщение повторяет файл одного из более ранних сообщений того же типа
+    duplicates = scenario.get("duplicates", 0.0)
+    for index, message in enumerate(messages):
+        earlier = [m for m in messages[:index] if m["kind"] == message["kind"]]
+        if earlier and rng.random() < duplicates:
+            original = rng.choice(earlier)
+            message["duration"] = original["duration"]
+            message["file_key"] = original["file_key"]
+        else:
+            message["file_key"] = f"bench_{index}"
+    return messages
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from bench.fakes import FaultConfig, ProviderStats, FakeTelegram, create_openai_app, create_elevenlabs_app, start_app
+from bench.audio_samples import AudioLibrary
+from bench.runner import BENCH_TOKEN, make_update
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, время импорта которых замеряется по отдельности (каждый в чистом процессе)
+IMPORT_MODULES = ("config", "utils.speech_to_text", "handlers.audio_handler", "bot")
+
+# Сравниваемые с базовой линией показатели запуска: (ключ, True если больше — лучше)
+COMPARED_METRICS = (
+    ("listen_seconds", False),
+    ("ready_seconds", False),
+    ("first_reply_seconds", False),
+    ("import_bot", False),
+    ("import_handlers.audio_handler", False),
+)
+
+# Текст, который заглушка провайдера возвращает в расшифровке
+TRANSCRIPT_MARKER = "Синтетическая расшифровка"
+
+
+def measure_import(module, repeats, env=None):
+    """
+    Замеряет время импорта модуля в свежем интерпретаторе
+
+    :param env: окружение процесса (обработчикам при импорте нужны ключи API)
+    :return: медиана по repeats запускам, в секундах
+    """
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - started)"
+    )
+    timings = []
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        timings.append(float(completed.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(condition, timeout, interval=0.01):
+    """Опрашивает асинхронное условие до истинного значения; возвращает момент успеха"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if await condition():
+            return time.perf_counter()
+        await asyncio.sleep(interval)
+    raise TimeoutError("Бот не ответил вовремя")
+
+
+async def measure_cold_start(timeout=60.0, verbose=False):
+    """
+    Запускает bot.py в режиме вебхука против локальных заглушек и замеряет этапы запуска
+
+    Время отсчитывается от запуска процесса: до первого ответа /health (порт открыт),
+    до /ready (обработчики загружены) и до первой расшифровки голосового сообщения,
+    отправленного на вебхук сразу после открытия порта.
+
+    :return: словарь с длительностями этапов в секундах
+    """
+    telegram = FakeTelegram()
+    runners = []
+    runner, openai_url = await start_app(create_openai_app(FaultConfig(), ProviderStats()))
+    runners.append(runner)
+    runner, elevenlabs_url = await start_app(create_elevenlabs_app(FaultConfig(), ProviderStats()))
+    runners.append(runner)
+    runner, telegram_url = await start_app(telegram.create_app())
+    runners.append(runner)
+
+    _, data = AudioLibrary().get("voice", 3, tag="startup")
+    telegram.add_file("file_startup", data)
+    message = {"kind": "voice", "file_key": "startup", "duration": 3, "chat_id": 1}
+    update = make_update(1, message, "file_startup", len(data))
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    state_dir = tempfile.TemporaryDirectory()
+    env = dict(
+        os.environ,
+        RENDER="1",
+        PORT=str(port),
+        BOT_TOKEN=BENCH_TOKEN,
+        OPENAI_API_KEY="sk-bench-openai-key",
+        ELEVENLABS_API_KEY="bench-elevenlabs-key",
+        TELEGRAM_API_URL=telegram_url,
+        OPENAI_BASE_URL=f"{openai_url}/v1",
+        ELEVENLABS_BASE_URL=elevenlabs_url,
+        TRANSCRIPT_CACHE_PATH=os.path.join(state_dir.name, "transcripts.sqlite3"),
+        ROUTER_WEIGHTS="whisper:1,elevenlabs:0",
+        WEB_WORKERS="1",
+    )
+    output = None if verbose else subprocess.DEVNULL
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "bot.py"], cwd=ROOT_DIR, env=env, stdout=output, stderr=output
+    )
+    result = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def responds(path, method="GET", **kwargs):
+                if process.poll() is not None:
+                    raise RuntimeError(f"bot.py завершился с кодом {process.returncode}")
+                try:
+                    async with session.request(method, base_url + path, **kwargs) as response:
+                        return response.status == 200
+                except aiohttp.ClientError:
+                    return False
+
+            async def replied():
+                return any(TRANSCRIPT_MARKER in text for _, _, text in telegram.log)
+
+            listening = await wait_for(lambda: responds("/health"), timeout)
+            result["listen_seconds"] = listening - started
+            # Обновление отправляется сразу после открытия порта, как при повторной
+            # доставке Telegram во время перезапуска; 503 означает «бот еще загружается»
+            await wait_for(lambda: responds(f"/webhook/{BENCH_TOKEN}", "POST", json=update), timeout)
+            result["webhook_accepted_seconds"] = time.perf_counter() - started
+            ready = await wait_for(lambda: responds("/ready"), timeout)
+            result["ready_seconds"] = ready - started
+            replied_at = await wait_for(replied, timeout)
+            result["first_reply_seconds"] = replied_at - started
+    finally:
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            # Ждем в потоке: заглушка Telegram в этом цикле событий должна отвечать боту до конца
+            await asyncio.to_thread(process.wait, 30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        result["shutdown_seconds"] = time.perf_counter() - stopping
+        for runner in runners:
+            await runner.cleanup()
+        state_dir.cleanup()
+    return result
+
+
+def run_startup(repeats=5, verbose=False):
+    """
+    Бенчмарк холодного запуска: время импорта ключевых модулей и запуск бота целиком
+
+    :param repeats: число запусков для медианы времени импорта
+    :return: словарь с результатами в формате сценариев нагрузки
+    """
+    result = {
+        "scenario": "startup",
+        "description": "холодный запуск: импорт модулей и время до первого ответа",
+        "repeats": repeats,
+    }
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BENCH_TOKEN,
+        OPENAI_API_KEY="sk-bench-openai-key",
+        ELEVENLABS_API_KEY="bench-elevenlabs-key",
+        TRANSCRIPT_CACHE_PATH="",
+    )
+    for module in IMPORT_MODULES:
+        result[f"import_{module}"] = measure_import(module, repeats, env)
+    result.update(asyncio.run(measure_cold_start(verbose=verbose)))
+    return result
+
+
+def print_startup(result):
+    print(f"\n== {result['scenario']}: {result['description']}")
+    imports = ", ".join(f"{module} {result[f'import_{module}']:.3f} с" for module in IMPORT_MODULES)
+    print(f"  импорт (медиана из {result['repeats']}): {imports}")
+    print(
+        f"  порт открыт: {result['listen_seconds']:.2f} с, вебхук принят: {result['webhook_accepted_seconds']:.2f} с, "
+        f"готов: {result['ready_seconds']:.2f} с, первая расшифровка: {result['first_reply_seconds']:.2f} с, "
+        f"остановка: {result['shutdown_seconds']:.2f} с"
+    )
@@ -0,0 +1,224 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from bench.fakes import FaultConfig, ProviderStats, FakeTelegram, create_openai_app, create_elevenlabs_app, start_app
+from bench.audio_samples import AudioLibrary
+from bench.runner import BENCH_TOKEN, make_update
+from bench.startup import ROOT_DIR, TRANSCRIPT_MARKER, free_port, wait_for
+
+# Сколько процессов-обработчиков сравнивается: один процесс и несколько на одном порту
+WORKER_COUNTS = (1, 4)
+
+# Нагрузка: всплеск голосовых сообщений, каждое из своего чата (без объединения в пакеты).
+# Перед замером каждому запуску дается разогревочная волна, чтобы все процессы
+# загрузили клиентов SDK и открыли соединения
+MESSAGES = 160
+WARM_UP_MESSAGES_PER_WORKER = 8
+DURATIONS = (5, 15, 30)
+
+# Нагрузка на CPU: длинные MP3 128 кбит/с (4-7 МБ), которые бот декодирует, обрезает
+# по тишине, кодирует в Opus и режет на фрагменты. Здесь упор в процессоры, а не в
+# задержку провайдера, и ускорение от процессов ограничено их числом
+HEAVY_MESSAGES = 8
+HEAVY_DURATIONS = (240, 420)
+
+# Заглушки провайдеров: задержка ответа ограничивает число сообщений, которое
+# один процесс успевает распознать при своем MAX_CONCURRENT_TRANSCRIPTIONS
+PROVIDERS = {
+    "whisper": {"latency": 1.0, "latency_per_mb": 1.0},
+    "elevenlabs": {"latency": 1.2, "latency_per_mb": 1.0},
+}
+
+# Сравниваемые с базовой линией показатели: (ключ, True если больше — лучше)
+COMPARED_METRICS = tuple(
+    (f"{key}_{workers}", True) for key in ("throughput_messages", "throughput_heavy") for workers in WORKER_COUNTS
+) + (("scaling", True), ("scaling_heavy", True))
+
+
+def build_updates(library, telegram, prefix, count, first_update_id, first_chat_id, kind="voice", durations=DURATIONS):
+    """Регистрирует файлы в заглушке Telegram и собирает обновления с голосовыми сообщениями или аудиофайлами"""
+    updates = []
+    for index in range(count):
+        key = f"{prefix}_{index}"
+        message = {
+            "kind": kind,
+            "file_key": key,
+            "duration": durations[index % len(durations)],
+            "chat_id": first_chat_id + index,
+        }
+        _, data = library.get(kind, message["duration"], tag=key)
+        telegram.add_file(f"file_{key}", data)
+        updates.append(make_update(first_update_id + index, message, f"file_{key}", len(data)))
+    return updates
+
+
+def replied_chats(telegram, chat_ids):
+    """Число чатов из chat_ids, в которых показана расшифровка"""
+    return len({
+        chat_id for (chat_id, _), text in telegram.texts.items()
+        if chat_id in chat_ids and TRANSCRIPT_MARKER in text
+    })
+
+
+async def measure_workers(workers, library, timeout=600.0, verbose=False):
+    """
+    Запускает bot.py в режиме вебхука с workers процессами и замеряет пропускную способность
+
+    Обновления отправляются на вебхук каждое в новом соединении: так ядро
+    распределяет их между процессами, слушающими порт (SO_REUSEPORT).
+
+    :return: словарь с длительностью всплесков и числом сообщений в секунду
+    """
+    telegram = FakeTelegram()
+    provider_configs = {provider: FaultConfig(**changes) for provider, changes in PROVIDERS.items()}
+    provider_stats = {provider: ProviderStats() for provider in PROVIDERS}
+    runners = []
+    runner, openai_url = await start_app(create_openai_app(provider_configs["whisper"], provider_stats["whisper"]))
+    runners.append(runner)
+    runner, elevenlabs_url = await start_app(
+        create_elevenlabs_app(provider_configs["elevenlabs"], provider_stats["elevenlabs"])
+    )
+    runners.append(runner)
+    runner, telegram_url = await start_app(telegram.create_app())
+    runners.append(runner)
+
+    warm_up_count = WARM_UP_MESSAGES_PER_WORKER * workers
+    warm_up = build_updates(library, telegram, f"warm{workers}", warm_up_count, 1, 1000)
+    burst = build_updates(library, telegram, f"burst{workers}", MESSAGES, 100000, 200000)
+    heavy = build_updates(
+        library, telegram, f"heavy{workers}", HEAVY_MESSAGES, 300000, 400000, kind="audio", durations=HEAVY_DURATIONS
+    )
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    state_dir = tempfile.TemporaryDirectory()
+    # SHARED_STATE_URL не задается: проверяется значение по умолчанию для числа процессов
+    env = dict(
+        os.environ,
+        RENDER="1",
+        PORT=str(port),
+        BOT_TOKEN=BENCH_TOKEN,
+        OPENAI_API_KEY="sk-bench-openai-key",
+        ELEVENLABS_API_KEY="bench-elevenlabs-key",
+        TELEGRAM_API_URL=telegram_url,
+        OPENAI_BASE_URL=f"{openai_url}/v1",
+        ELEVENLABS_BASE_URL=elevenlabs_url,
+        TRANSCRIPT_CACHE_PATH=os.path.join(state_dir.name, "transcripts.sqlite3"),
+        ROUTER_WEIGHTS="whisper:1,elevenlabs:0",
+        WEB_WORKERS=str(workers),
+    )
+    env.pop("SHARED_STATE_URL", None)
+    output = None if verbose else subprocess.DEVNULL
+
+    process = subprocess.Popen(
+        [sys.executable, "bot.py"], cwd=ROOT_DIR, env=env, stdout=output, stderr=output
+    )
+    result = {}
+    try:
+        # Без keep-alive каждый запрос открывает новое соединение и попадает в случайный процесс
+        connector = aiohttp.TCPConnector(force_close=True)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            async def responds(path, method="GET", **kwargs):
+                if process.poll() is not None:
+                    raise RuntimeError(f"bot.py завершился с кодом {process.returncode}")
+                try:
+                    async with session.request(method, base_url + path, **kwargs) as response:
+                        return response.status == 200
+                except aiohttp.ClientError:
+                    return False
+
+            async def all_ready():
+                # Готовность отвечает случайный процесс: ждем подряд несколько ответов на каждый
+                for _ in range(workers * 3):
+                    if not await responds("/ready"):
+                        return False
+                return True
+
+            async def send(updates):
+                await asyncio.gather(*(
+                    wait_for(lambda update=update: responds(f"/webhook/{BENCH_TOKEN}", "POST", json=update), timeout)
+                    for update in updates
+                ))
+
+            async def wait_replies(updates):
+                chat_ids = {update["message"]["chat"]["id"] for update in updates}
+
+                async def done():
+                    return replied_chats(telegram, chat_ids) == len(chat_ids)
+                return await wait_for(done, timeout, interval=0.05)
+
+            await wait_for(all_ready, timeout)
+            await send(warm_up)
+            await wait_replies(warm_up)
+
+            started = time.perf_counter()
+            await send(burst)
+            finished = await wait_replies(burst)
+            result["elapsed"] = finished - started
+            result["throughput_messages"] = MESSAGES / result["elapsed"]
+            result["peak_provider_requests"] = provider_stats["whisper"].peak_in_flight
+
+            started = time.perf_counter()
+            await send(heavy)
+            finished = await wait_replies(heavy)
+            result["elapsed_heavy"] = finished - started
+            result["throughput_heavy"] = HEAVY_MESSAGES / result["elapsed_heavy"]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.to_thread(process.wait, 60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        for runner in runners:
+            await runner.cleanup()
+        state_dir.cleanup()
+    return result
+
+
+def run_workers(verbose=False):
+    """
+    Бенчмарк масштабирования: один и тот же всплеск сообщений на одном и нескольких процессах
+
+    :return: словарь с результатами в формате сценариев нагрузки
+    """
+    result = {
+        "scenario": "workers",
+        "description": (
+            f"всплеск из {MESSAGES} голосовых и {HEAVY_MESSAGES} длинных MP3 на вебхук "
+            f"при WEB_WORKERS={' и '.join(map(str, WORKER_COUNTS))}"
+        ),
+        "messages": MESSAGES,
+        "heavy_messages": HEAVY_MESSAGES,
+        "cpus": os.cpu_count(),
+    }
+    library = AudioLibrary()
+    for workers in WORKER_COUNTS:
+        measured = asyncio.run(measure_workers(workers, library, verbose=verbose))
+        for key, value in measured.items():
+            result[f"{key}_{workers}"] = value
+    first, last = WORKER_COUNTS[0], WORKER_COUNTS[-1]
+    result["scaling"] = result[f"throughput_messages_{last}"] / result[f"throughput_messages_{first}"]
+    result["scaling_heavy"] = result[f"throughput_heavy_{last}"] / result[f"throughput_heavy_{first}"]
+    return result
+
+
+def print_workers(result):
+    print(f"\n== {result['scenario']}: {result['description']}")
+    for workers in WORKER_COUNTS:
+        print(
+            f"  WEB_WORKERS={workers}: {result[f'elapsed_{workers}']:.1f} с, "
+            f"{result[f'throughput_messages_{workers}']:.1f} сообщений/с, "
+            f"пик параллельных запросов к провайдеру {result[f'peak_provider_requests_{workers}']}; "
+            f"длинные MP3: {result[f'elapsed_heavy_{workers}']:.1f} с, "
+            f"{result[f'throughput_heavy_{workers}']:.2f} сообщений/с"
+        )
+    print(
+        f"  ускорение: голосовые {result['scaling']:.2f}×, длинные MP3 {result['scaling_heavy']:.2f}× "
+        f"(процессоров: {result['cpus']})"
+    )
@@ -4,17 +4,22 @@
 import os
 import logging
 import asyncio
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import BotCommand
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import signal
+import socket
+import time
+import multiprocessing
 from aiohttp import web
-from handlers.audio_handler import router as audio_router
-from config import BOT_TOKEN, OPENAI_API_KEY, ELEVENLABS_API_KEY
+from config import get_settings
+from utils.metrics import REGISTRY, IN_FLIGHT, STAGE_SECONDS, metrics_handler, set_snapshot
+
+# Момент запуска процесса: от него считаются задержки открытия порта и готовности бота
+STARTED_AT = time.monotonic()
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+settings = get_settings()
+
 # Определяем, работаем ли мы в режиме вебхука (на Render.com)
 if os.environ.get('RENDER', False):
     WEBHOOK_MODE = True
@@ -29,12 +34,106 @@ logging.info(f"Используется порт: {PORT}")
 
 # Настройка вебхука
 WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', 'https://tentekspeechtotext.onrender.com')
-WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
+WEBHOOK_PATH = f"/webhook/{settings.BOT_TOKEN}"
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 logging.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
 
+# Номер процесса-обработчика при работе в несколько процессов; None в основном процессе
+WORKER_INDEX = None
+
+# Процесс-обработчик N принимает обновления своих чатов от других процессов на 127.0.0.1:WORKER_PORT_BASE+N
+WORKER_PORT_BASE = settings.WORKER_PORT_BASE or PORT + 1
+WORKER_UPDATES_PATH = f"/updates/{settings.BOT_TOKEN}"
+
+# Модуль обработчиков; загружается после открытия порта (см. load_application)
+audio_handler = None
+
+# Фоновые задачи запуска: ссылки держим, чтобы задачи не собрал сборщик мусора
+background_tasks = set()
+
+# Перед каждой выдачей /metrics переносим в метрики текущее состояние компонентов
+def collect_component_state():
+    if audio_handler is None:
+        return
+    from utils.audio_buffer import AudioBuffer
+    speech_converter = audio_handler.speech_converter
+    set_snapshot("transport", speech_converter.transport_stats())
+    set_snapshot("cache", audio_handler.transcript_cache.stats())
+    set_snapshot("queue", audio_handler.job_scheduler.stats())
+    set_snapshot("batches", audio_handler.message_coalescer.stats())
+    set_snapshot("audio_buffer", {
+        "resident_bytes": AudioBuffer.resident_bytes,
+        "peak_resident_bytes": AudioBuffer.peak_resident_bytes,
+    })
+    for provider, stats in speech_converter.router_stats().items():
+        set_snapshot(f"provider_{provider}", dict(stats, circuit_closed=stats["state"] == "closed"))
+    for provider, stats in speech_converter.rate_limit_stats().items():
+        set_snapshot(f"rate_limit_{provider}", stats)
+    # Байты до и после предобработки и ее задержка по типам файлов (ogg, mp3, ...)
+    for file_type, stats in speech_converter.preprocessing_stats().items():
+        set_snapshot(f"preprocess_{file_type}", stats)
+
+REGISTRY.on_collect(collect_component_state)
+
+async def health(request):
+    """Роут для проверки здоровья: отвечает сразу после открытия порта"""
+    return web.Response(text="OK")
+
+async def ready(request):
+    """Роут готовности: 503, пока обработчики бота не загружены"""
+    if audio_handler is None:
+        return web.Response(text="STARTING", status=503)
+    return web.Response(text="READY")
+
+def log_startup(stage, message):
+    """Пишет в лог и в метрики, сколько прошло от запуска процесса до этапа"""
+    elapsed = time.monotonic() - STARTED_AT
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    logging.info(f"{message} через {elapsed:.2f} с после запуска процесса")
+
+def create_bot():
+    """Создает бота; TELEGRAM_API_URL позволяет работать через свой сервер Bot API"""
+    from aiogram import Bot
+    if not settings.TELEGRAM_API_URL:
+        return Bot(token=settings.BOT_TOKEN)
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_URL))
+    return Bot(token=settings.BOT_TOKEN, session=session)
+
+def load_application():
+    """
+    Импортирует aiogram и обработчики и создает бота и диспетчер
+
+    Это самая долгая часть запуска, поэтому она выполняется в отдельном потоке
+    уже после открытия порта. SDK провайдеров здесь не загружаются (см. on_startup).
+
+    :return: кортеж (бот, диспетчер)
+    """
+    global audio_handler
+    started = time.monotonic()
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from handlers import audio_handler as handlers_module
+
+    # Создаем объекты бота и диспетчера
+    bot = create_bot()
+    dp = Dispatcher(storage=MemoryStorage())
+
+    # Регистрируем роутеры
+    dp.include_router(handlers_module.router)
+
+    # Настраиваем хэндлеры запуска/остановки
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    STAGE_SECONDS.observe(time.monotonic() - started, stage="startup_import")
+    audio_handler = handlers_module
+    return bot, dp
+
 # Создаем список команд бота
-async def setup_bot_commands(bot: Bot):
+async def setup_bot_commands(bot):
+    from aiogram.types import BotCommand
     commands = [
         BotCommand(command="start", description="Запустить бота"),
         BotCommand(command="help", description="Получить помощь")
@@ -42,79 +141,256 @@ async def setup_bot_commands(bot: Bot):
     await bot.set_my_commands(commands)
 
 # Настройка при запуске
-async def on_startup(bot: Bot):
+async def on_startup(bot):
+    speech_converter = audio_handler.speech_converter
+    speech_converter.start()
+    # SDK провайдеров загружаются в фоне и не задерживают прием обновлений;
+    # первый запрос к провайдеру при необходимости дождется загрузки
+    task = asyncio.create_task(speech_converter.warm_up())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    # В режиме нескольких процессов команды и вебхук настраивает основной процесс
+    if WORKER_INDEX is not None:
+        return
     await setup_bot_commands(bot)
     if WEBHOOK_MODE:
         await bot.set_webhook(WEBHOOK_URL)
         logging.info(f"Вебхук установлен на {WEBHOOK_URL}")
 
 # Функция при остановке
-async def on_shutdown(bot: Bot):
-    if WEBHOOK_MODE:
+async def on_shutdown(bot):
+    if WEBHOOK_MODE and WORKER_INDEX is None:
         await bot.delete_webhook()
         logging.info("Вебхук удален")
+    speech_converter = audio_handler.speech_converter
+    transcript_cache = audio_handler.transcript_cache
+    # Закрываем общий пул соединений к API распознавания речи
+    logging.info(f"Статистика HTTP-пула: {speech_converter.transport_stats()}")
+    logging.info(f"Статистика предобработки аудио: {speech_converter.preprocessing_stats()}")
+    await speech_converter.close()
+    logging.info(f"Статистика кэша расшифровок: {transcript_cache.stats()}")
+    transcript_cache.close()
+    audio_handler.shared_state.close()
+
+# Отдельный небольшой веб-сервер для /metrics, /health и /ready
+async def start_metrics_server(port):
+    metrics_app = web.Application()
+    metrics_app.router.add_get("/health", health)
+    metrics_app.router.add_get("/ready", ready)
+    metrics_app.router.add_get("/metrics", metrics_handler)
+    metrics_runner = web.AppRunner(metrics_app)
+    await metrics_runner.setup()
+    await web.TCPSite(metrics_runner, host=settings.METRICS_HOST, port=port).start()
+    logging.info(f"Метрики доступны на {settings.METRICS_HOST}:{port}/metrics")
+    return metrics_runner
 
 # Запуск бота
 async def main():
-    # Создаем объекты бота и диспетчера
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    
-    # Регистрируем роутеры
-    dp.include_router(audio_router)
-    
-    # Настраиваем хэндлеры запуска/остановки
-    dp.startup.register(on_startup)
-    dp.shutdown.register(on_shutdown)
-    
-    # Выводим информацию о доступных API
-    if OPENAI_API_KEY:
-        logging.info(f"Используется OpenAI Whisper API (ключ: {OPENAI_API_KEY[:5]}...{OPENAI_API_KEY[-5:]})")
-    if ELEVENLABS_API_KEY:
-        logging.info(f"Используется ElevenLabs API (ключ: {ELEVENLABS_API_KEY[:5]}...{ELEVENLABS_API_KEY[-5:]})")
-    
     # Запускаем бота в соответствующем режиме
     if WEBHOOK_MODE:
         logging.info("Запуск в режиме вебхука")
-        
+
         # Создаем веб-приложение
         app = web.Application()
-        
-        # Добавляем маршрут для вебхука
-        webhook_path = WEBHOOK_PATH
-        
-        # Добавляем роут для проверки здоровья
-        async def health(request):
-            return web.Response(text="OK")
-        
+
+        # Маршруты регистрируются до запуска сервера, а обработчик вебхука появляется
+        # после загрузки бота; до этого Telegram получает 503 и повторит доставку
+        webhook_handler = None
+
+        async def webhook(request):
+            if webhook_handler is None:
+                return web.Response(status=503)
+            return await webhook_handler.handle(request)
+
+        # Добавляем роуты для проверки здоровья, готовности, метрик и вебхука
         app.router.add_get("/", health)
         app.router.add_get("/health", health)
-        
-        # Настраиваем вебхук
-        SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=webhook_path)
-        setup_application(app, dp, bot=bot)
-        
-        # Запускаем веб-сервер
+        app.router.add_get("/ready", ready)
+        app.router.add_get("/metrics", metrics_handler)
+        app.router.add_post(WEBHOOK_PATH, webhook)
+
+        # Запускаем веб-сервер до загрузки бота, чтобы сразу отвечать на проверки здоровья
         logging.info(f"Запуск веб-сервера на порту {PORT}")
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
+        # Процессы-обработчики слушают один порт, ядро распределяет между ними соединения
+        site = web.TCPSite(runner, host="0.0.0.0", port=PORT, reuse_port=WORKER_INDEX is not None)
         await site.start()
-        
+        log_startup("startup_listen", "Порт открыт")
+        # /metrics на общем порту отвечает случайный процесс, поэтому у каждого есть и свой порт метрик
+        metrics_runner = None
+        if WORKER_INDEX is not None and settings.METRICS_PORT:
+            try:
+                metrics_runner = await start_metrics_server(settings.METRICS_PORT + WORKER_INDEX)
+            except OSError as e:
+                # Занятый порт метрик не повод останавливать обработку вебхука
+                logging.warning(f"Не удалось открыть порт метрик {settings.METRICS_PORT + WORKER_INDEX}: {e}")
+
+        # Тяжелые импорты идут в отдельном потоке, цикл событий тем временем отвечает на запросы
+        bot, dp = await asyncio.to_thread(load_application)
+        from utils.webhook import FastAckRequestHandler, UpdateDeduplicator, UpdateRouter
+
+        # Настраиваем вебхук: Telegram получает ответ сразу, обновление обрабатывается в фоне.
+        # В нескольких процессах обновления чата передаются его процессу-владельцу
+        router = None
+        if WORKER_INDEX is not None:
+            router = UpdateRouter(WORKER_INDEX, settings.WEB_WORKERS, WORKER_PORT_BASE, WORKER_UPDATES_PATH)
+        handler = FastAckRequestHandler(
+            dispatcher=dp, bot=bot, deduplicator=UpdateDeduplicator(state=audio_handler.shared_state), router=router
+        )
+        internal_runner = None
+        if router is not None:
+            internal_app = web.Application()
+            internal_app.router.add_post(WORKER_UPDATES_PATH, handler.handle_forwarded)
+            internal_runner = web.AppRunner(internal_app)
+            await internal_runner.setup()
+            await web.TCPSite(internal_runner, host="127.0.0.1", port=WORKER_PORT_BASE + WORKER_INDEX).start()
+        REGISTRY.on_collect(lambda: IN_FLIGHT.set(handler.in_flight, kind="webhook_updates"))
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        webhook_handler = handler
+
         # Удерживаем приложение запущенным
-        logging.info(f"Бот запущен в режиме вебхука на {WEBHOOK_URL}")
-        
-        # Бесконечный цикл для поддержания работы приложения
-        while True:
-            await asyncio.sleep(3600)  # Проверка каждый час
-            logging.info("Бот все еще работает...")
-    
+        log_startup("startup_ready", f"Бот запущен в режиме вебхука на {WEBHOOK_URL}")
+
+        # Работаем до сигнала остановки (Render посылает SIGTERM при перезапуске)
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                # На Windows обработчики сигналов в цикле событий недоступны
+                pass
+
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=3600)  # Проверка каждый час
+            except asyncio.TimeoutError:
+                from utils.telegram_reply import streaming_stats
+                speech_converter = audio_handler.speech_converter
+                logging.info(
+                    f"Бот все еще работает (процесс {WORKER_INDEX or 0})... HTTP-пул: {speech_converter.transport_stats()}, "
+                    f"кэш: {audio_handler.transcript_cache.stats()}, провайдеры: {speech_converter.router_stats()}, "
+                    f"лимиты: {speech_converter.rate_limit_stats()}, "
+                    f"очередь: {audio_handler.job_scheduler.stats()}, в обработке: {handler.in_flight}, "
+                    f"повторов отброшено: {handler.deduplicator.duplicates}, "
+                    f"передано другим процессам: {router.forwarded if router else 0}, "
+                    f"ответы: {streaming_stats()}"
+                )
+
+        # Плавная остановка: дожидаемся начатых заданий, затем вызываются on_shutdown
+        logging.info("Получен сигнал остановки, завершаем работу")
+        await handler.close()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        if internal_runner is not None:
+            await internal_runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await runner.cleanup()
+        await bot.session.close()
+
     else:
         logging.info("Запуск в режиме Long Polling")
-        await dp.start_polling(bot, skip_updates=True)
 
-if __name__ == "__main__":
+        # Отдельный небольшой веб-сервер только для /metrics и /health
+        metrics_runner = None
+        if settings.METRICS_PORT:
+            metrics_runner = await start_metrics_server(settings.METRICS_PORT)
+
+        try:
+            bot, dp = await asyncio.to_thread(load_application)
+            log_startup("startup_ready", "Бот загружен")
+            await dp.start_polling(bot, skip_updates=True)
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+
+# Запуск процесса-обработчика вебхука
+def run_worker(index):
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    # Значения метрик разных процессов различаются меткой worker
+    REGISTRY.set_constant_labels(worker=index)
+    logging.info(f"Процесс-обработчик {index} запущен (pid {os.getpid()})")
     try:
         asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+# Настройка или удаление вебхука основным процессом
+async def configure_webhook(enable):
+    bot = create_bot()
+    try:
+        if enable:
+            await setup_bot_commands(bot)
+            await bot.set_webhook(WEBHOOK_URL)
+            logging.info(f"Вебхук установлен на {WEBHOOK_URL}")
+        else:
+            await bot.delete_webhook()
+            logging.info("Вебхук удален")
+    finally:
+        await bot.session.close()
+
+# Основной процесс: запускает обработчики, перезапускает упавшие и останавливает их по сигналу
+def supervise(workers):
+    logging.info(f"Запуск {workers} процессов-обработчиков вебхука на порту {PORT}")
+    asyncio.run(configure_webhook(True))
+
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def start_worker(index):
+        process = context.Process(target=run_worker, args=(index,), name=f"webhook-worker-{index}")
+        process.start()
+        return process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        processes[index] = start_worker(index)
+
+    while not stopping:
+        for index, process in processes.items():
+            if not process.is_alive():
+                logging.warning(f"Процесс-обработчик {index} завершился с кодом {process.exitcode}, перезапускаем")
+                processes[index] = start_worker(index)
+        time.sleep(1)
+
+    # SIGTERM запускает у обработчиков плавную остановку с ожиданием начатых заданий
+    logging.info("Получен сигнал остановки, останавливаем процессы-обработчики")
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join(settings.WEBHOOK_DRAIN_TIMEOUT + 10)
+        if process.is_alive():
+            logging.warning(f"Процесс {process.name} не завершился вовремя, принудительно останавливаем")
+            process.kill()
+    asyncio.run(configure_webhook(False))
+
+if __name__ == "__main__":
+    # Выводим информацию о найденных ключах и проверяем обязательные
+    settings.log_summary()
+    settings.validate()
+    try:
+        if WEBHOOK_MODE and settings.WEB_WORKERS > 1:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                logging.warning("SO_REUSEPORT недоступен, запускаем один процесс")
+                asyncio.run(main())
+            else:
+                if settings.SHARED_STATE_URL.startswith("memory://"):
+                    logging.warning(
+                        "Общее хранилище не настроено (SHARED_STATE_URL): процессы не будут делить "
+                        "кэш, отметки о повторах и здоровье провайдеров"
+                    )
+                supervise(settings.WEB_WORKERS)
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logging.info("Бот остановлен!")
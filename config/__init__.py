@@ -1,108 +1,262 @@
 import os
 import logging
+from functools import lru_cache
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Импорт модуля не имеет побочных эффектов: переменные окружения читаются
+# при первом обращении к настройкам (get_settings() или from config import ИМЯ),
+# а проверка и вывод ключей в лог выполняются явно при запуске бота.
+
+
+def is_render():
+    """Проверяем, запущены ли мы на Render"""
+    return bool(os.environ.get('RENDER', False))
 
-# Проверяем, запущены ли мы на Render
-is_render = os.environ.get('RENDER', False)
 
 # Загрузка переменных окружения
-def load_env_vars():
-    # Если мы на Render, используем только переменные окружения
-    if is_render:
-        logging.info("Запущено на Render, используем переменные окружения Render")
-        return {
-            'BOT_TOKEN': os.environ.get('BOT_TOKEN'),
-            'ELEVENLABS_API_KEY': os.environ.get('ELEVENLABS_API_KEY'),
-            'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY'),
-            'WEBHOOK_HOST': os.environ.get('WEBHOOK_HOST', 'https://tentekspeechtotext.onrender.com')
-        }
-    
-    # Для локальной разработки пробуем загрузить из .env файла
-    env_vars = {}
+def load_env_file():
+    """Загружает config/.env при локальном запуске; на Render используются только переменные окружения"""
+    if is_render():
+        return
     try:
         # Пытаемся сначала использовать python-dotenv
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        # Если python-dotenv не установлен, читаем .env вручную
         try:
-            from dotenv import load_dotenv
-            load_dotenv()
-            logging.info("Загружены переменные окружения с помощью python-dotenv")
-        except ImportError:
-            logging.warning("python-dotenv не установлен, читаем .env вручную")
-            # Если python-dotenv не установлен, читаем .env вручную
             with open(".env", "r", encoding="utf-8") as f:
                 for line in f:
                     line = line.strip()
                     if not line or line.startswith('#'):
                         continue
                     key, value = line.split('=', 1)
-                    env_vars[key] = value
                     os.environ[key] = value
-                    
-        # В любом случае получаем переменные из окружения
-        return {
-            'BOT_TOKEN': os.environ.get('BOT_TOKEN'),
-            'ELEVENLABS_API_KEY': os.environ.get('ELEVENLABS_API_KEY'),
-            'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY'),
-            'WEBHOOK_HOST': os.environ.get('WEBHOOK_HOST', 'https://tentekspeechtotext.onrender.com')
-        }
-    except Exception as e:
-        logging.error(f"Ошибка при чтении переменных окружения: {e}")
-        # В случае ошибки возвращаем значения из окружения
-        return {
-            'BOT_TOKEN': os.environ.get('BOT_TOKEN'),
-            'ELEVENLABS_API_KEY': os.environ.get('ELEVENLABS_API_KEY'),
-            'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY'),
-            'WEBHOOK_HOST': os.environ.get('WEBHOOK_HOST', 'https://tentekspeechtotext.onrender.com')
-        }
-
-# Загружаем переменные окружения
-env_vars = load_env_vars()
-
-# Получаем ключи из загруженных переменных
-BOT_TOKEN = env_vars.get('BOT_TOKEN')
-ELEVENLABS_API_KEY = env_vars.get('ELEVENLABS_API_KEY')
-OPENAI_API_KEY = env_vars.get('OPENAI_API_KEY')
-
-# Проверяем и логируем значения ключей
-if BOT_TOKEN:
-    logging.info(f"BOT_TOKEN: {BOT_TOKEN[:5]}...{BOT_TOKEN[-5:]} (длина: {len(BOT_TOKEN)})")
-else:
-    logging.warning("BOT_TOKEN не найден")
-    
-if ELEVENLABS_API_KEY:
-    logging.info(f"ELEVENLABS_API_KEY: {ELEVENLABS_API_KEY[:5]}...{ELEVENLABS_API_KEY[-5:]} (длина: {len(ELEVENLABS_API_KEY)})")
-else:
-    logging.warning("ELEVENLABS_API_KEY не найден")
-    
-if OPENAI_API_KEY:
-    if OPENAI_API_KEY.startswith(('sk-', 'sk-prod-', 'sk-org-', 'sk-proj-')):
-        logging.info(f"OPENAI_API_KEY: {OPENAI_API_KEY[:5]}...{OPENAI_API_KEY[-5:]} (длина: {len(OPENAI_API_KEY)})")
-        print(f"Используется OpenAI API ключ: {OPENAI_API_KEY[:5]}...{OPENAI_API_KEY[-5:]}")    
-    else:
-        logging.warning(f"Формат OPENAI_API_KEY не соответствует ожидаемому: {OPENAI_API_KEY[:5]}...")
-        # Используем обычную строку вместо f-строки без плейсхолдеров
-        print("Предупреждение: Некорректный формат OpenAI API ключа. Проверьте значение в .env файле")
-        # Устанавливаем в None, чтобы бот не пытался использовать неверный ключ
-        OPENAI_API_KEY = None
-else:
-    logging.warning("OPENAI_API_KEY не найден")
-    print("Предупреждение: Отсутствует API ключ OpenAI. Будет использоваться только ElevenLabs.")
-
-# Проверка на наличие обязательных ключей
-if not BOT_TOKEN:
-    logging.error("Отсутствует токен бота (BOT_TOKEN). Укажите его в переменных окружения")
-    if not is_render:
-        raise ValueError("Отсутствует токен бота. Укажите BOT_TOKEN в .env файле")
-
-# Проверка API ключей для сервисов распознавания речи
-if not ELEVENLABS_API_KEY and not OPENAI_API_KEY:
-    logging.error("Отсутствуют API ключи для распознавания речи. Укажите хотя бы один: ELEVENLABS_API_KEY или OPENAI_API_KEY")
-    if not is_render:
-        raise ValueError("Отсутствуют API ключи для распознавания речи. Укажите хотя бы один: ELEVENLABS_API_KEY или OPENAI_API_KEY в .env файле")
-
-# Если хотя бы один ключ есть, предупреждаем о недостающем
-if not ELEVENLABS_API_KEY and OPENAI_API_KEY:
-    logging.info("Найден только ключ OpenAI API")
-    # Используем обычную строку вместо f-строки без плейсхолдеров
-    print("Предупреждение: Отсутствует API ключ ElevenLabs. Будет использоваться только OpenAI Whisper.")
+        except OSError as e:
+            logging.warning(f"Не удалось прочитать .env: {e}")
+
+
+class Settings:
+    """Настройки бота, прочитанные из переменных окружения"""
+
+    def __init__(self, env=None):
+        """
+        :param env: словарь переменных окружения (по умолчанию os.environ)
+        """
+        if env is None:
+            env = os.environ
+
+        # Ключи API
+        self.BOT_TOKEN = env.get('BOT_TOKEN')
+        self.ELEVENLABS_API_KEY = env.get('ELEVENLABS_API_KEY')
+        self.OPENAI_API_KEY = env.get('OPENAI_API_KEY')
+        self.WEBHOOK_HOST = env.get('WEBHOOK_HOST', 'https://tentekspeechtotext.onrender.com')
+        # Ключ OpenAI неожиданного формата не используется, чтобы бот не отправлял запросы с неверным ключом
+        self.OPENAI_API_KEY_INVALID = bool(self.OPENAI_API_KEY) and not self.OPENAI_API_KEY.startswith(
+            ('sk-', 'sk-prod-', 'sk-org-', 'sk-proj-')
+        )
+        if self.OPENAI_API_KEY_INVALID:
+            self.OPENAI_API_KEY = None
+        # Адрес собственного сервера Telegram Bot API (по умолчанию — api.telegram.org)
+        self.TELEGRAM_API_URL = env.get('TELEGRAM_API_URL') or None
+
+        # Параметры производительности
+        # Максимальное число одновременных запросов к API распознавания речи
+        self.MAX_CONCURRENT_TRANSCRIPTIONS = int(env.get('MAX_CONCURRENT_TRANSCRIPTIONS', 8))
+
+        # Общий пул HTTP-соединений к API распознавания речи
+        self.HTTP_MAX_CONNECTIONS = int(env.get('HTTP_MAX_CONNECTIONS', 20))
+        self.HTTP_MAX_KEEPALIVE_CONNECTIONS = int(env.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', 10))
+        self.HTTP_KEEPALIVE_EXPIRY = float(env.get('HTTP_KEEPALIVE_EXPIRY', 60))
+        # Таймауты по фазам запроса (в секундах): подключение, отправка аудио, ожидание ответа, ожидание соединения из пула
+        self.HTTP_CONNECT_TIMEOUT = float(env.get('HTTP_CONNECT_TIMEOUT', 10))
+        self.HTTP_WRITE_TIMEOUT = float(env.get('HTTP_WRITE_TIMEOUT', 60))
+        self.HTTP_READ_TIMEOUT = float(env.get('HTTP_READ_TIMEOUT', 240))
+        self.HTTP_POOL_TIMEOUT = float(env.get('HTTP_POOL_TIMEOUT', 30))
+        self.HTTP2_ENABLED = env.get('HTTP2_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+        # Порог (в байтах), после которого скачанное аудио переносится из памяти во временный файл
+        self.AUDIO_SPOOL_MAX_BYTES = int(env.get('AUDIO_SPOOL_MAX_BYTES', 8 * 1024 * 1024))
+
+        # Кэш расшифровок: файл SQLite (пустая строка отключает дисковый уровень), размеры уровней и время жизни записи в секундах
+        self.TRANSCRIPT_CACHE_PATH = env.get('TRANSCRIPT_CACHE_PATH', 'data/transcript_cache.sqlite3')
+        self.TRANSCRIPT_CACHE_MEMORY_ENTRIES = int(env.get('TRANSCRIPT_CACHE_MEMORY_ENTRIES', 1000))
+        self.TRANSCRIPT_CACHE_DISK_ENTRIES = int(env.get('TRANSCRIPT_CACHE_DISK_ENTRIES', 100000))
+        self.TRANSCRIPT_CACHE_MAX_AGE = int(env.get('TRANSCRIPT_CACHE_MAX_AGE', 30 * 24 * 3600))
+
+        # Разбиение длинного аудио на фрагменты по паузам
+        self.CHUNKING_ENABLED = env.get('CHUNKING_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        # Файлы меньше этого размера (в байтах) без известной длительности не декодируются для проверки длины
+        self.CHUNKING_MIN_BYTES = int(env.get('CHUNKING_MIN_BYTES', 2 * 1024 * 1024))
+        self.CHUNK_TARGET_SECONDS = int(env.get('CHUNK_TARGET_SECONDS', 120))
+        self.CHUNK_MAX_SECONDS = int(env.get('CHUNK_MAX_SECONDS', 180))
+        self.CHUNK_OVERLAP_SECONDS = float(env.get('CHUNK_OVERLAP_SECONDS', 1.5))
+        # Сколько фрагментов одного файла распознается одновременно
+        self.CHUNK_FANOUT = int(env.get('CHUNK_FANOUT', 4))
+        # Сколько раз повторять распознавание фрагмента, завершившееся ошибкой
+        self.CHUNK_RETRIES = int(env.get('CHUNK_RETRIES', 2))
+
+        # Предобработка аудио перед отправкой: обрезка тишины, моно, 16 кГц, Opus
+        self.PREPROCESS_ENABLED = env.get('PREPROCESS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        # Файлы меньше этого размера (в байтах) отправляются как есть
+        self.PREPROCESS_MIN_BYTES = int(env.get('PREPROCESS_MIN_BYTES', 256 * 1024))
+        # Файлы с битрейтом не выше этого (бит/с) уже компактны (например, голосовые сообщения Telegram)
+        self.PREPROCESS_COMPACT_BITRATE = int(env.get('PREPROCESS_COMPACT_BITRATE', 64000))
+        # Битрейт Opus для предобработанного аудио и фрагментов
+        self.PREPROCESS_BITRATE = env.get('PREPROCESS_BITRATE', '24k')
+
+        # Сколько процессов ffmpeg одновременно извлекают звук из видео и медиафайлов
+        self.EXTRACT_MAX_PROCESSES = int(env.get('EXTRACT_MAX_PROCESSES', 2))
+        # Предельное время (в секундах) работы ffmpeg при декодировании и кодировании аудио (0 — без ограничения)
+        self.FFMPEG_TIMEOUT = float(env.get('FFMPEG_TIMEOUT', 600))
+
+        # Маршрутизация между провайдерами
+        # Веса провайдеров: провайдер с нулевым весом используется только как резервный
+        self.ROUTER_WEIGHTS = env.get('ROUTER_WEIGHTS', 'whisper:1,elevenlabs:0')
+        # Размер скользящего окна статистики (в запросах)
+        self.ROUTER_WINDOW_SIZE = int(env.get('ROUTER_WINDOW_SIZE', 50))
+        # Выключатель срабатывает при доле ошибок не ниже порога (при минимуме запросов в окне) или после N ошибок подряд
+        self.ROUTER_MIN_SAMPLES = int(env.get('ROUTER_MIN_SAMPLES', 10))
+        self.ROUTER_ERROR_THRESHOLD = float(env.get('ROUTER_ERROR_THRESHOLD', 0.5))
+        self.ROUTER_CONSECUTIVE_FAILURES = int(env.get('ROUTER_CONSECUTIVE_FAILURES', 3))
+        # Через сколько секунд отключенному провайдеру отправляется пробный запрос
+        self.ROUTER_OPEN_SECONDS = float(env.get('ROUTER_OPEN_SECONDS', 30))
+        # Дублирование запроса другому провайдеру, если основной не ответил за свой p95
+        # (в пересчете на длительность аудио); выключено, так как дубль оплачивается дважды
+        self.ROUTER_HEDGING = env.get('ROUTER_HEDGING', 'false').lower() in ('1', 'true', 'yes')
+        self.ROUTER_HEDGE_MIN_SAMPLES = int(env.get('ROUTER_HEDGE_MIN_SAMPLES', 20))
+        self.ROUTER_HEDGE_MIN_DELAY = float(env.get('ROUTER_HEDGE_MIN_DELAY', 2.0))
+
+        # Клиентские лимиты провайдеров ("провайдер:значение"); лимиты задаются на весь бот и делятся
+        # между процессами WEB_WORKERS. Без лимита частота все равно снижается после ответов 429
+        self.RATE_LIMIT_REQUESTS_PER_MINUTE = env.get('RATE_LIMIT_REQUESTS_PER_MINUTE', '')
+        self.RATE_LIMIT_AUDIO_SECONDS_PER_MINUTE = env.get('RATE_LIMIT_AUDIO_SECONDS_PER_MINUTE', '')
+        # Сколько секунд запрос может ждать лимита и повторов, прежде чем перейти к резервному провайдеру
+        self.RATE_LIMIT_BUDGET = float(env.get('RATE_LIMIT_BUDGET', 20))
+        # Повторы после 429 и временных ошибок и базовая пауза между ними (растет вдвое, со случайным разбросом);
+        # после ошибок сервера повторяет только последний провайдер, остальные сразу передают запрос резервному
+        self.RATE_LIMIT_RETRIES = int(env.get('RATE_LIMIT_RETRIES', 2))
+        self.RATE_LIMIT_BACKOFF = float(env.get('RATE_LIMIT_BACKOFF', 1.0))
+        # Через сколько секунд без 429 забывается частота, выученная по ответам провайдера
+        self.RATE_LIMIT_RECOVERY_SECONDS = float(env.get('RATE_LIMIT_RECOVERY_SECONDS', 300))
+
+        # Очередь заданий на распознавание
+        # Одновременно выполняемых заданий: всего и на один чат
+        self.JOB_MAX_CONCURRENT = int(env.get('JOB_MAX_CONCURRENT', 16))
+        self.JOB_MAX_PER_CHAT = int(env.get('JOB_MAX_PER_CHAT', 2))
+        # Максимум ожидающих заданий: всего и от одного чата
+        self.JOB_MAX_QUEUE = int(env.get('JOB_MAX_QUEUE', 200))
+        self.JOB_MAX_QUEUE_PER_CHAT = int(env.get('JOB_MAX_QUEUE_PER_CHAT', 30))
+
+        # Вебхук: время жизни (в секундах) и размер множества полученных update_id для отбрасывания повторов
+        self.WEBHOOK_DEDUP_TTL = int(env.get('WEBHOOK_DEDUP_TTL', 600))
+        self.WEBHOOK_DEDUP_MAX_SIZE = int(env.get('WEBHOOK_DEDUP_MAX_SIZE', 10000))
+        # Сколько секунд при остановке ждать завершения начатых заданий
+        self.WEBHOOK_DRAIN_TIMEOUT = float(env.get('WEBHOOK_DRAIN_TIMEOUT', 25))
+
+        # Постепенный вывод расшифровки: ответ обновляется по мере распознавания фрагментов
+        self.STREAMING_REPLIES = env.get('STREAMING_REPLIES', 'true').lower() in ('1', 'true', 'yes')
+        # Минимальный интервал между правками ответа (в секундах) в личных чатах и в группах
+        self.STREAM_EDIT_INTERVAL = float(env.get('STREAM_EDIT_INTERVAL', 1.5))
+        self.STREAM_GROUP_EDIT_INTERVAL = float(env.get('STREAM_GROUP_EDIT_INTERVAL', 3.0))
+
+        # Объединение сообщений: голосовые и аудио одного чата, пришедшие с интервалом не больше
+        # BATCH_WINDOW секунд (например, пересланная пачка), получают общий ответ
+        self.BATCH_WINDOW = float(env.get('BATCH_WINDOW', 1.0))
+        self.BATCH_MAX_MESSAGES = int(env.get('BATCH_MAX_MESSAGES', 20))
+
+        # Порт для /metrics и /health в режиме Long Polling (0 — не запускать); в режиме вебхука /metrics отдается
+        # на основном порту, а при WEB_WORKERS > 1 процесс N дополнительно отдает свои метрики на METRICS_PORT+N
+        self.METRICS_PORT = int(env.get('METRICS_PORT', 9090))
+        # Адрес, на котором слушает порт метрик; по умолчанию доступен только с этой машины
+        self.METRICS_HOST = env.get('METRICS_HOST', '127.0.0.1')
+
+        # Адреса API распознавания (по умолчанию — официальные); меняются, например, для локальных заглушек бенчмарка
+        self.OPENAI_BASE_URL = env.get('OPENAI_BASE_URL') or None
+        self.ELEVENLABS_BASE_URL = env.get('ELEVENLABS_BASE_URL') or None
+
+        # Число процессов-обработчиков вебхука на одном порту (нужен SO_REUSEPORT, т.е. Linux/BSD)
+        self.WEB_WORKERS = int(env.get('WEB_WORKERS', 1))
+        # Обновления одного чата обрабатывает один процесс (объединение пачек и лимиты на чат живут в его памяти);
+        # процесс N принимает переданные ему обновления на 127.0.0.1:WORKER_PORT_BASE+N (0 — порт вебхука + 1)
+        self.WORKER_PORT_BASE = int(env.get('WORKER_PORT_BASE', 0))
+        # Общее состояние процессов (отбрасывание повторов, здоровье провайдеров, кэш расшифровок):
+        # "sqlite:///путь" — файл SQLite, "memory://" — только память процесса. Одному процессу делить
+        # состояние не с кем, поэтому по умолчанию это память (кэш расшифровок все равно пишется
+        # в TRANSCRIPT_CACHE_PATH), а при нескольких процессах — файл кэша расшифровок
+        shared_default = 'memory://'
+        if self.WEB_WORKERS > 1 and self.TRANSCRIPT_CACHE_PATH:
+            shared_default = f'sqlite:///{self.TRANSCRIPT_CACHE_PATH}'
+        self.SHARED_STATE_URL = env.get('SHARED_STATE_URL', shared_default)
+        # Как часто (в секундах) процессы обмениваются статистикой здоровья провайдеров
+        self.ROUTER_SYNC_INTERVAL = float(env.get('ROUTER_SYNC_INTERVAL', 1.0))
+
+    def log_summary(self):
+        """Выводит в лог, какие ключи найдены (в сокращенном виде)"""
+        if self.BOT_TOKEN:
+            logging.info(f"BOT_TOKEN: {self.BOT_TOKEN[:5]}...{self.BOT_TOKEN[-5:]} (длина: {len(self.BOT_TOKEN)})")
+        else:
+            logging.warning("BOT_TOKEN не найден")
+
+        if self.ELEVENLABS_API_KEY:
+            logging.info(
+                f"ELEVENLABS_API_KEY: {self.ELEVENLABS_API_KEY[:5]}...{self.ELEVENLABS_API_KEY[-5:]} "
+                f"(длина: {len(self.ELEVENLABS_API_KEY)})"
+            )
+        else:
+            logging.warning("ELEVENLABS_API_KEY не найден")
+
+        if self.OPENAI_API_KEY:
+            logging.info(
+                f"OPENAI_API_KEY: {self.OPENAI_API_KEY[:5]}...{self.OPENAI_API_KEY[-5:]} "
+                f"(длина: {len(self.OPENAI_API_KEY)})"
+            )
+        elif self.OPENAI_API_KEY_INVALID:
+            logging.warning("Формат OPENAI_API_KEY не соответствует ожидаемому, ключ не используется")
+        else:
+            logging.warning("OPENAI_API_KEY не найден")
+
+        # Если хотя бы один ключ есть, предупреждаем о недостающем
+        if self.OPENAI_API_KEY and not self.ELEVENLABS_API_KEY:
+            logging.info("Найден только ключ OpenAI API, будет использоваться только OpenAI Whisper")
+        elif self.ELEVENLABS_API_KEY and not self.OPENAI_API_KEY:
+            logging.info("Найден только ключ ElevenLabs API, будет использоваться только ElevenLabs")
+
+    def validate(self):
+        """
+        Проверяет наличие обязательных ключей
+
+        :raises ValueError: если ключей нет при локальном запуске (на Render ошибка только пишется в лог)
+        """
+        if not self.BOT_TOKEN:
+            logging.error("Отсутствует токен бота (BOT_TOKEN). Укажите его в переменных окружения")
+            if not is_render():
+                raise ValueError("Отсутствует токен бота. Укажите BOT_TOKEN в .env файле")
+
+        # Проверка API ключей для сервисов распознавания речи
+        if not self.ELEVENLABS_API_KEY and not self.OPENAI_API_KEY:
+            logging.error(
+                "Отсутствуют API ключи для распознавания речи. "
+                "Укажите хотя бы один: ELEVENLABS_API_KEY или OPENAI_API_KEY"
+            )
+            if not is_render():
+                raise ValueError(
+                    "Отсутствуют API ключи для распознавания речи. "
+                    "Укажите хотя бы один: ELEVENLABS_API_KEY или OPENAI_API_KEY в .env файле"
+                )
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """Возвращает настройки, при первом вызове загружая .env и читая переменные окружения"""
+    load_env_file()
+    return Settings()
+
+
+def __getattr__(name):
+    # Совместимость с "from config import ИМЯ": значение берется из кэшированных настроек
+    if name.isupper():
+        try:
+            return getattr(get_settings(), name)
+        except AttributeError:
+            pass
+    raise AttributeError(f"module 'config' has no attribute {name!r}")
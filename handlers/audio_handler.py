@@ -1,66 +1,266 @@
+import asyncio
+import logging
+import time
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from utils.speech_to_text import SpeechToTextConverter
+from utils.audio_buffer import download_to_buffer
+from utils.media_extract import extract_audio_to_buffer
+from utils.transcript_cache import TranscriptCache, make_cache_key, hash_audio
+from utils.job_queue import TranscriptionScheduler, QueueFullError
+from utils.telegram_reply import StreamingReply
+from utils.message_batch import BatchItem, MessageCoalescer
+from utils.metrics import STAGE_SECONDS
+from utils.shared_state import create_shared_state
+from config import SHARED_STATE_URL
 
 # Создаем роутер для обработки аудио сообщений
 router = Router()
 
+# Общее состояние процессов: здоровье провайдеров, отметки о полученных обновлениях, кэш расшифровок
+shared_state = create_shared_state(SHARED_STATE_URL)
+
 # Инициализируем конвертер речи в текст
-speech_converter = SpeechToTextConverter()
+speech_converter = SpeechToTextConverter(shared_state=shared_state)
+
+# Кэш расшифровок: пересланные и повторно отправленные файлы не распознаются заново.
+# Без общего хранилища дисковый уровень кэша открывается в TRANSCRIPT_CACHE_PATH
+transcript_cache = TranscriptCache(store=shared_state if shared_state.shared else None)
+
+# Очередь заданий: ограничивает параллельную работу и делит ее между чатами по кругу
+job_scheduler = TranscriptionScheduler()
+
+# Пакеты сообщений: пересланные подряд голосовые получают одно сообщение о статусе и общий ответ
+message_coalescer = MessageCoalescer()
+
+QUEUE_FULL_TEXT = "⚠️ Сейчас слишком много сообщений в очереди. Попробуйте отправить позже."
+EMPTY_TEXT = "🔇 Речь не распознана"
+
+async def run_queued(message, processing_msg, func):
+    """
+    Выполняет задание через очередь и сообщает пользователю позицию, если задание ждет
+    
+    :param processing_msg: сообщение о статусе для показа позиции в очереди или None
+    :raises QueueFullError: если очередь переполнена
+    """
+    job = job_scheduler.submit(message.chat.id, func)
+    if not job.started and processing_msg is not None:
+        await processing_msg.edit_text(f"⏳ В очереди, позиция: {job_scheduler.position(job)}")
+    return await job
+
+async def transcribe_telegram_file(bot, file_id, file_unique_id, filename, duration=None, language="ru", on_partial=None,
+                                   fetch=download_to_buffer):
+    """
+    Возвращает расшифровку файла из Telegram, используя кэш
+    
+    Сначала ищем по file_unique_id (до скачивания), затем по хэшу содержимого,
+    и только при двух промахах отправляем аудио в API распознавания.
+    
+    :param on_partial: корутинная функция, которой передаются части расшифровки по мере готовности
+    :param fetch: корутинная функция (bot, file_id, filename), возвращающая AudioBuffer с аудио;
+        для видео — extract_audio_to_buffer, которая скачивает только звуковую дорожку
+    """
+    async def emit(piece):
+        if on_partial is not None and piece:
+            await on_partial(piece)
+    
+    # Расшифровка хранится под провайдером, который ее выполнил: после переключения на
+    # резервного ищем под всеми провайдерами, начиная с предпочтительного
+    scopes = speech_converter.cache_scopes(language)
+    text, _ = await transcript_cache.get_any([make_cache_key("file", file_unique_id, scope) for scope in scopes])
+    if text is not None:
+        logging.info(f"Расшифровка {file_unique_id} найдена в кэше по file_unique_id")
+        await emit(text)
+        return text
+    
+    with await fetch(bot, file_id, filename) as audio_data:
+        with STAGE_SECONDS.time(stage="hash"):
+            digest = await asyncio.to_thread(hash_audio, audio_data)
+        digest_keys = [make_cache_key("sha256", digest, scope) for scope in scopes]
+        text, found_key = await transcript_cache.get_any(digest_keys)
+        if text is not None:
+            logging.info(f"Расшифровка {file_unique_id} найдена в кэше по хэшу аудио")
+            scope = scopes[digest_keys.index(found_key)]
+            await transcript_cache.set([make_cache_key("file", file_unique_id, scope)], text)
+            await emit(text)
+            return text
+        
+        pieces = []
+        providers = set()
+        async for piece, piece_provider in speech_converter.transcribe_stream(audio_data, language, duration):
+            providers.add(piece_provider)
+            if piece:
+                pieces.append(piece)
+                await emit(piece)
+        text = " ".join(pieces)
+        provider = providers.pop() if len(providers) == 1 else None
+    
+    # Кэшируем только успешные расшифровки и под тем провайдером, который их выполнил
+    if provider is not None:
+        scope = speech_converter.cache_scope(language, provider)
+        await transcript_cache.set(
+            [make_cache_key("file", file_unique_id, scope), make_cache_key("sha256", digest, scope)],
+            text
+        )
+    return text
 
 @router.message(Command("start"))
 async def cmd_start(message: Message):
     """Обработчик команды /start"""
     await message.answer(
         "👋 Привет! Я бот для преобразования голосовых сообщений в текст.\n\n"
-        "Отправь мне голосовое сообщение или аудиофайл, и я верну его текстовую расшифровку."
+        "Отправь мне голосовое сообщение, аудиофайл, видео или видеосообщение, и я верну текстовую расшифровку."
     )
 
-@router.message(F.voice)
-async def handle_voice(message: Message):
-    """Обработчик голосовых сообщений"""
-    # Отправляем сообщение о начале обработки
-    processing_msg = await message.answer("🔍 Обрабатываю голосовое сообщение...")
+def render_batch(items):
+    """
+    Собирает текст общего ответа: расшифровки по порядку сообщений
+    
+    Показываются готовые расшифровки и части первой незавершенной; при нескольких
+    сообщениях каждая расшифровка нумеруется.
+    """
+    numbered = len(items) > 1
+    sections = []
+    for index, item in enumerate(items, 1):
+        text = item.text if item.done else " ".join(item.pieces)
+        if text:
+            sections.append(f"{index}. {text}" if numbered else text)
+        if not item.done:
+            break
+    return "\n\n".join(sections)
+
+async def transcribe_item(batch, item, status_msg, file_id, file_unique_id, filename, duration, error_text, fetch):
+    """Распознает сообщение пакета через очередь и сохраняет итоговый текст в item.text"""
+    async def on_partial(piece):
+        item.pieces.append(piece)
+        batch.notify()
     
     try:
-        # Получаем файл голосового сообщения
-        voice_file = await message.bot.get_file(message.voice.file_id)
-        voice_data = await message.bot.download_file(voice_file.file_path)
-        
-        # Преобразуем голосовое сообщение в текст
-        text = await speech_converter.convert_audio_to_text(voice_data.read())
-        
-        # Отправляем результат
-        await message.reply(f"{text}")
-        
+        text = await run_queued(item.message, status_msg, lambda: transcribe_telegram_file(
+            item.message.bot, file_id, file_unique_id, filename, duration, on_partial=on_partial, fetch=fetch
+        ))
+        item.text = text or EMPTY_TEXT
+    except QueueFullError:
+        item.text = QUEUE_FULL_TEXT
     except Exception as e:
-        await message.reply(f"❌ Произошла ошибка при обработке голосового сообщения: {str(e)}")
-    
+        item.text = f"{error_text}: {str(e)}"
     finally:
-        # Удаляем сообщение о обработке
-        await processing_msg.delete()
+        if item.text is None:
+            # Задание отменено: пакет не должен ждать его вечно
+            item.text = ""
+        batch.notify()
 
-@router.message(F.audio)
-async def handle_audio(message: Message):
-    """Обработчик аудиофайлов"""
-    # Отправляем сообщение о начале обработки
-    processing_msg = await message.answer("🔍 Обрабатываю аудиофайл...")
+async def deliver_batch(batch, started_at):
+    """
+    Владелец пакета: обновляет общий ответ по мере готовности расшифровок
     
+    Пакет закрывается для новых сообщений, когда все расшифровки готовы и окно
+    объединения истекло; затем ответ дописывается и сообщение о статусе удаляется.
+    """
+    reply = StreamingReply(batch.items[0].message, started_at)
     try:
-        # Получаем аудиофайл
-        audio_file = await message.bot.get_file(message.audio.file_id)
-        audio_data = await message.bot.download_file(audio_file.file_path)
-        
-        # Преобразуем аудио в текст
-        text = await speech_converter.convert_audio_to_text(audio_data.read())
+        while True:
+            await reply.update(render_batch(batch.items))
+            for item in batch.items:
+                if not item.done:
+                    break
+                if not item.delivered:
+                    item.delivered = True
+                    message_coalescer.delivered(item)
+            timeout = None
+            if batch.done:
+                timeout = message_coalescer.window_remaining(batch)
+                if timeout <= 0:
+                    message_coalescer.close(batch)
+                    break
+            await batch.wait_changed(timeout)
         
-        # Отправляем результат
-        await message.reply(f"{text}")
-        
-    except Exception as e:
-        await message.reply(f"❌ Произошла ошибка при обработке аудиофайла: {str(e)}")
-    
+        # Отправляем итоговый результат
+        await reply.update(render_batch(batch.items))
+        await reply.finish(EMPTY_TEXT)
     finally:
-        # Удаляем сообщение о обработке
-        await processing_msg.delete()
+        message_coalescer.close(batch)
+        for item in batch.items:
+            if item.task is not None and not item.task.done():
+                item.task.cancel()
+        # Удаляем сообщение о обработке; ответ уже отправлен, поэтому ошибка здесь не должна его терять
+        if batch.status is not None:
+            try:
+                await batch.status.delete()
+            except Exception as e:
+                logging.warning(f"Не удалось удалить сообщение о ходе обработки: {e}")
+
+async def handle_media(message, status_text, error_text, file_id, file_unique_id, filename, duration,
+                       fetch=download_to_buffer):
+    """
+    Общий обработчик голосовых и аудио: сообщение присоединяется к пакету своего чата
+    
+    Распознавание начинается сразу; ответ отправляет первое сообщение пакета,
+    остальные обработчики возвращаются, не дожидаясь расшифровки.
+    """
+    started_at = time.monotonic()
+    item = BatchItem(message)
+    batch, owner = message_coalescer.join(message.chat.id, item)
+    if owner:
+        # Отправляем сообщение о начале обработки; без него ответ все равно будет отправлен
+        try:
+            batch.status = await message.answer(status_text)
+        except Exception as e:
+            logging.warning(f"Не удалось отправить сообщение о начале обработки: {e}")
+    # Позицию в очереди показываем только для первого сообщения пакета
+    item.task = asyncio.create_task(transcribe_item(
+        batch, item, batch.status if owner else None,
+        file_id, file_unique_id, filename, duration, error_text, fetch
+    ))
+    if owner:
+        await deliver_batch(batch, started_at)
+
+@router.message(F.voice)
+async def handle_voice(message: Message):
+    """Обработчик голосовых сообщений"""
+    await handle_media(
+        message, "🔍 Обрабатываю голосовое сообщение...",
+        "❌ Произошла ошибка при обработке голосового сообщения",
+        message.voice.file_id, message.voice.file_unique_id, "voice.ogg", message.voice.duration
+    )
+
+@router.message(F.audio)
+async def handle_audio(message: Message):
+    """Обработчик аудиофайлов"""
+    await handle_media(
+        message, "🔍 Обрабатываю аудиофайл...",
+        "❌ Произошла ошибка при обработке аудиофайла",
+        message.audio.file_id, message.audio.file_unique_id,
+        message.audio.file_name or "audio.mp3", message.audio.duration
+    )
+
+@router.message(F.video_note)
+async def handle_video_note(message: Message):
+    """Обработчик видеосообщений (кружков): распознается только звуковая дорожка"""
+    await handle_media(
+        message, "🔍 Обрабатываю видеосообщение...",
+        "❌ Произошла ошибка при обработке видеосообщения",
+        message.video_note.file_id, message.video_note.file_unique_id, "video_note.ogg",
+        message.video_note.duration, fetch=extract_audio_to_buffer
+    )
+
+@router.message(F.video)
+async def handle_video(message: Message):
+    """Обработчик видео: распознается только звуковая дорожка"""
+    await handle_media(
+        message, "🔍 Обрабатываю видео...",
+        "❌ Произошла ошибка при обработке видео",
+        message.video.file_id, message.video.file_unique_id, "video.ogg",
+        message.video.duration, fetch=extract_audio_to_buffer
+    )
+
+@router.message(F.document.mime_type.startswith("audio/") | F.document.mime_type.startswith("video/"))
+async def handle_media_document(message: Message):
+    """Обработчик аудио и видео, отправленных файлом: звук извлекается в Opus"""
+    await handle_media(
+        message, "🔍 Обрабатываю файл...",
+        "❌ Произошла ошибка при обработке файла",
+        message.document.file_id, message.document.file_unique_id, "document.ogg",
+        None, fetch=extract_audio_to_buffer
+    )
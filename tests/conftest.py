@@ -0,0 +1,12 @@
+import os
+
+# Настройки читаются при первом обращении к config, поэтому окружение задается
+# до импорта модулей бота: без config/.env, дискового кэша и общего хранилища
+os.environ.update({
+    "RENDER": "1",
+    "BOT_TOKEN": "123456:TEST-TOKEN",
+    "OPENAI_API_KEY": "sk-test-openai-key",
+    "ELEVENLABS_API_KEY": "test-elevenlabs-key",
+    "TRANSCRIPT_CACHE_PATH": "",
+    "SHARED_STATE_URL": "memory://",
+})
@@ -0,0 +1,55 @@
+import os
+from utils.audio_buffer import AudioBuffer
+
+
+def test_buffer_spools_to_disk_over_threshold():
+    resident_before = AudioBuffer.resident_bytes
+    with AudioBuffer(max_memory=1024) as buffer:
+        buffer.write(b"a" * 1000)
+        assert buffer.in_memory
+        assert AudioBuffer.resident_bytes == resident_before + 1000
+        buffer.write(b"b" * 1000)
+        # Перенесенные на диск данные не учитываются в памяти под аудио
+        assert not buffer.in_memory
+        assert AudioBuffer.resident_bytes == resident_before
+        assert buffer.size == 2000
+        assert buffer.getvalue() == b"a" * 1000 + b"b" * 1000
+    assert buffer.closed
+    assert AudioBuffer.resident_bytes == resident_before
+
+
+def test_close_releases_resident_bytes():
+    resident_before = AudioBuffer.resident_bytes
+    buffer = AudioBuffer.from_bytes(b"x" * 500)
+    assert AudioBuffer.resident_bytes == resident_before + 500
+    buffer.close()
+    buffer.close()
+    assert AudioBuffer.resident_bytes == resident_before
+
+
+def test_iter_chunks_reads_whole_buffer_and_rewinds():
+    data = os.urandom(200 * 1024)
+    with AudioBuffer.from_bytes(data) as buffer:
+        assert b"".join(buffer.iter_chunks(chunk_size=64 * 1024)) == data
+        assert buffer.tell() == 0
+
+
+def test_upload_readers_have_independent_positions():
+    data = bytes(range(256)) * 40
+    with AudioBuffer.from_bytes(data, filename="voice.ogg") as buffer:
+        name, first = buffer.upload_file()
+        _, second = buffer.upload_file()
+        assert name == "voice.ogg"
+        # Два провайдера читают один буфер вперемешку (дублирующий запрос)
+        assert first.read(100) == data[:100]
+        assert second.read(300) == data[:300]
+        assert first.read(100) == data[100:200]
+        assert second.read() == data[300:]
+
+        # Повтор запроса перечитывает буфер с начала
+        first.seek(0)
+        assert first.read() == data
+        assert first.seek(-10, os.SEEK_END) == len(data) - 10
+        assert first.read() == data[-10:]
+        # fileno не реализован, иначе httpx сбросил бы буфер из памяти на диск
+        assert not hasattr(buffer, "fileno")
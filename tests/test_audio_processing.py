@@ -0,0 +1,105 @@
+import os
+import shutil
+import time
+import pytest
+from pydub import AudioSegment
+from pydub.generators import Sine
+from utils.audio_buffer import AudioBuffer
+from utils.audio_processing import (
+    PCM_ARGS, PCM_BYTES_PER_MS, PCM_FRAME_RATE, PcmAudio,
+    export_audio, find_split_points, remove_overlap, run_ffmpeg, split_audio, trim_silence,
+)
+
+
+def speech_like(seconds):
+    """Тон по 4 с с паузами по 1 с, моно 16 кГц, с тишиной по краям"""
+    tone = Sine(220, sample_rate=PCM_FRAME_RATE).to_audio_segment(duration=4000, volume=-10).set_channels(1)
+    pause = AudioSegment.silent(duration=1000, frame_rate=PCM_FRAME_RATE)
+    segment = pause
+    while len(segment) < seconds * 1000:
+        segment += tone + pause
+    return segment.set_sample_width(2)
+
+
+def as_pcm(segment):
+    return PcmAudio(AudioBuffer.from_bytes(segment.raw_data, filename="audio.pcm"))
+
+
+def test_pcm_audio_matches_audio_segment():
+    segment = speech_like(30)
+    with as_pcm(segment) as pcm:
+        assert len(pcm) == len(segment)
+        assert abs(pcm.dBFS - segment.dBFS) < 0.01
+        assert pcm[5000:7000].raw_data == segment[5000:7000].raw_data
+        # Срез среза отсчитывается от начала своего участка
+        assert pcm[1000:20000][2000:3000].raw_data == segment[3000:4000].raw_data
+        assert pcm[0:1000].dBFS == -float("infinity")
+
+
+def test_split_points_are_the_same_for_pcm_audio():
+    segment = speech_like(60)
+    with as_pcm(segment) as pcm:
+        expected = find_split_points(segment, 20000, 25000)
+        assert find_split_points(pcm, 20000, 25000) == expected
+        chunks = split_audio(pcm, 20000, 25000)
+    assert len(expected) > 1
+    assert all(at_silence for _, _, at_silence in expected)
+    assert len(chunks) == len(expected)
+
+
+def test_trim_silence_returns_a_view():
+    segment = speech_like(12)
+    with as_pcm(segment) as pcm:
+        trimmed = trim_silence(pcm)
+        assert isinstance(trimmed, PcmAudio)
+        assert len(trimmed) == len(trim_silence(segment))
+
+
+def test_remove_overlap_drops_repeated_words():
+    previous = "мы встретимся завтра в десять утра"
+    assert remove_overlap(previous, "в десять утра у входа") == "у входа"
+
+
+def test_remove_overlap_ignores_case_and_punctuation():
+    assert remove_overlap("Увидимся, завтра.", "завтра утром") == "утром"
+
+
+def test_remove_overlap_keeps_text_without_repeat():
+    assert remove_overlap("первый фрагмент", "второй фрагмент") == "второй фрагмент"
+    assert remove_overlap("", "текст") == "текст"
+
+
+def test_run_ffmpeg_drains_stderr_while_reading_stdout(monkeypatch, tmp_path):
+    # Процесс сначала пишет в stderr больше, чем вмещает канал, и только потом отдает результат
+    script = tmp_path / "noisy"
+    script.write_text("#!/bin/sh\nhead -c 1000000 /dev/zero >&2\ncat\n")
+    script.chmod(0o755)
+    monkeypatch.setattr(AudioSegment, "converter", str(script))
+    data = os.urandom(256 * 1024)
+    assert run_ffmpeg(data, [], timeout=10) == data
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg не установлен")
+def test_run_ffmpeg_kills_process_after_timeout():
+    # -re читает вход со скоростью воспроизведения: 10 с аудио не успеют за 0.5 с
+    pcm = speech_like(10).raw_data
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="не завершился"):
+        run_ffmpeg(pcm, PCM_ARGS, input_args=["-re", *PCM_ARGS], timeout=0.5)
+    assert time.monotonic() - started < 5
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg не установлен")
+def test_export_streams_pcm_audio_without_reading_it_whole(monkeypatch):
+    segment = speech_like(30)
+
+    def whole_read(self):
+        raise AssertionError("участок прочитан в память целиком")
+
+    with as_pcm(segment) as pcm:
+        monkeypatch.setattr(PcmAudio, "raw_data", property(whole_read))
+        with export_audio(pcm[0:20000], "chunk.ogg", "24k") as encoded:
+            data = encoded.getvalue()
+    monkeypatch.undo()
+    decoded_ms = len(run_ffmpeg(data, PCM_ARGS)) // PCM_BYTES_PER_MS
+    assert abs(decoded_ms - 20000) < 100
@@ -0,0 +1,33 @@
+import asyncio
+import aiohttp
+from bench.fakes import FakeTelegram, FaultConfig, start_app
+from bench.runner import ERROR_MARKERS
+
+
+def test_fake_telegram_keeps_final_text_of_each_message():
+    async def scenario():
+        telegram = FakeTelegram(FaultConfig(latency=0, latency_per_mb=0, jitter=0))
+        runner, url = await start_app(telegram.create_app())
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def call(method, **params):
+                    async with session.post(f"{url}/bot123:TEST/{method}", data=params) as response:
+                        return (await response.json())["result"]
+
+                status = await call("sendMessage", chat_id=1, text="🎤 Обрабатываю...")
+                reply = await call("sendMessage", chat_id=1, text="1. первая расшифровка")
+                edited = await call(
+                    "editMessageText", chat_id=1, message_id=reply["message_id"],
+                    text="1. первая расшифровка\n\n2. ❌ Произошла ошибка при обработке голосового сообщения",
+                )
+                await call("deleteMessage", chat_id=1, message_id=status["message_id"])
+        finally:
+            await runner.cleanup()
+        return telegram, reply, edited
+
+    telegram, reply, edited = asyncio.run(scenario())
+    assert edited["message_id"] == reply["message_id"]
+    # Удаленное сообщение о статусе не считается, ошибка из правки находится в середине текста
+    assert list(telegram.texts) == [(1, reply["message_id"])]
+    errors = [text for text in telegram.texts.values() if any(marker in text for marker in ERROR_MARKERS)]
+    assert len(errors) == 1
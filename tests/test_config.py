@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import pytest
+from config import Settings
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_single_worker_keeps_shared_state_in_memory():
+    settings = Settings({"TRANSCRIPT_CACHE_PATH": "data/cache.sqlite3"})
+    assert settings.WEB_WORKERS == 1
+    assert settings.SHARED_STATE_URL == "memory://"
+
+
+def test_several_workers_share_transcript_cache_file():
+    settings = Settings({"WEB_WORKERS": "4", "TRANSCRIPT_CACHE_PATH": "data/cache.sqlite3"})
+    assert settings.SHARED_STATE_URL == "sqlite:///data/cache.sqlite3"
+
+
+def test_explicit_shared_state_url_wins():
+    settings = Settings({"SHARED_STATE_URL": "sqlite:///state.sqlite3"})
+    assert settings.SHARED_STATE_URL == "sqlite:///state.sqlite3"
+
+
+def test_module_attributes_are_read_lazily_from_settings(monkeypatch):
+    import config
+    monkeypatch.setenv("JOB_MAX_CONCURRENT", "7")
+    config.get_settings.cache_clear()
+    try:
+        from config import JOB_MAX_CONCURRENT
+        assert JOB_MAX_CONCURRENT == 7
+        # Настройки читаются один раз и кэшируются
+        monkeypatch.setenv("JOB_MAX_CONCURRENT", "9")
+        assert config.JOB_MAX_CONCURRENT == 7
+        assert config.get_settings() is config.get_settings()
+    finally:
+        config.get_settings.cache_clear()
+
+
+def test_unknown_module_attribute_raises_attribute_error():
+    import config
+    for name in ("NO_SUCH_SETTING", "log_summary", "settings"):
+        with pytest.raises(AttributeError):
+            getattr(config, name)
+
+
+def test_import_does_not_read_environment():
+    code = "import config; print(config.get_settings.cache_info().currsize)"
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+    )
+    assert completed.stdout.strip() == "0"
@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+from utils.job_queue import QueueFullError, TranscriptionScheduler
+
+
+class Recorder:
+    """Задания, которые ждут разрешения завершиться и запоминают порядок запуска"""
+
+    def __init__(self):
+        self.started = []
+        self.running = {}
+        self.peak = {}
+        self.release = asyncio.Event()
+
+    def job(self, chat_id, name):
+        async def run():
+            self.started.append(name)
+            self.running[chat_id] = self.running.get(chat_id, 0) + 1
+            self.peak[chat_id] = max(self.peak.get(chat_id, 0), self.running[chat_id])
+            try:
+                await self.release.wait()
+            finally:
+                self.running[chat_id] -= 1
+            return name
+        return run
+
+
+def test_chats_are_served_round_robin():
+    async def scenario():
+        scheduler = TranscriptionScheduler(max_concurrent=1, max_per_chat=1, max_queue=100, max_queue_per_chat=100)
+        recorder = Recorder()
+        # Первое задание занимает единственный слот, пока в очередь встают остальные
+        blocker = asyncio.Event()
+
+        async def first():
+            await blocker.wait()
+            return "first"
+
+        jobs = [scheduler.submit("busy", first)]
+        jobs += [scheduler.submit("busy", recorder.job("busy", f"busy-{i}")) for i in range(5)]
+        jobs += [scheduler.submit("quiet", recorder.job("quiet", f"quiet-{i}")) for i in range(2)]
+        recorder.release.set()
+        blocker.set()
+        await asyncio.gather(*jobs)
+        return recorder.started
+
+    started = asyncio.run(scenario())
+    # Сообщения второго чата не ждут, пока выполнится вся очередь первого
+    assert started[:4] == ["busy-0", "quiet-0", "busy-1", "quiet-1"]
+    assert started[4:] == ["busy-2", "busy-3", "busy-4"]
+
+
+def test_per_chat_cap_leaves_slots_for_other_chats():
+    async def scenario():
+        scheduler = TranscriptionScheduler(max_concurrent=4, max_per_chat=2, max_queue=100, max_queue_per_chat=100)
+        recorder = Recorder()
+        jobs = [scheduler.submit("busy", recorder.job("busy", f"busy-{i}")) for i in range(6)]
+        jobs.append(scheduler.submit("quiet", recorder.job("quiet", "quiet-0")))
+        await asyncio.sleep(0)
+        running = dict(scheduler._running)
+        position = scheduler.position(jobs[-2])
+        recorder.release.set()
+        results = await asyncio.gather(*jobs)
+        return scheduler, recorder, running, position, results
+
+    scheduler, recorder, running, position, results = asyncio.run(scenario())
+    assert running == {"busy": 2, "quiet": 1}
+    assert recorder.peak["busy"] == 2
+    assert position > 0
+    assert results == [f"busy-{i}" for i in range(6)] + ["quiet-0"]
+    assert scheduler.stats()["completed"] == 7
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        scheduler = TranscriptionScheduler(max_concurrent=1, max_per_chat=1, max_queue=3, max_queue_per_chat=2)
+        recorder = Recorder()
+        jobs = [scheduler.submit("a", recorder.job("a", "a-0"))]
+        # Первое задание выполняется и в очереди не числится
+        jobs += [scheduler.submit("a", recorder.job("a", f"a-{i}")) for i in (1, 2)]
+        with pytest.raises(QueueFullError):
+            scheduler.submit("a", recorder.job("a", "a-3"))
+
+        jobs.append(scheduler.submit("b", recorder.job("b", "b-0")))
+        with pytest.raises(QueueFullError):
+            scheduler.submit("c", recorder.job("c", "c-0"))
+
+        rejected = scheduler.stats()["rejected"]
+        recorder.release.set()
+        await asyncio.gather(*jobs)
+        return scheduler, rejected
+
+    scheduler, rejected = asyncio.run(scenario())
+    assert rejected == 2
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_job_exception_is_delivered_to_awaiter():
+    async def scenario():
+        scheduler = TranscriptionScheduler(max_concurrent=1, max_per_chat=1, max_queue=10, max_queue_per_chat=10)
+
+        async def broken():
+            raise ValueError("битый файл")
+
+        with pytest.raises(ValueError):
+            await scheduler.submit("a", broken)
+        return scheduler
+
+    assert asyncio.run(scenario()).stats()["failed"] == 1
+
+
+def test_cancelled_jobs_leave_queue_and_stop_running():
+    async def scenario():
+        scheduler = TranscriptionScheduler(max_concurrent=1, max_per_chat=1, max_queue=10, max_queue_per_chat=10)
+        recorder = Recorder()
+        running = scheduler.submit("a", recorder.job("a", "a-0"))
+        queued = scheduler.submit("a", recorder.job("a", "a-1"))
+        last = scheduler.submit("a", recorder.job("a", "a-2"))
+        await asyncio.sleep(0)
+
+        # Ожидающее задание снимается с очереди и не запускается
+        queued.future.cancel()
+        await asyncio.sleep(0)
+        queued_after_cancel = scheduler.stats()["queued"]
+
+        # Отмена выполняемого задания отменяет его задачу и освобождает слот
+        running.future.cancel()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        recorder.release.set()
+        result = await last
+        return scheduler, recorder, queued_after_cancel, result
+
+    scheduler, recorder, queued_after_cancel, result = asyncio.run(scenario())
+    assert queued_after_cancel == 1
+    assert result == "a-2"
+    assert recorder.started == ["a-0", "a-2"]
+    assert recorder.running == {"a": 0}
+    stats = scheduler.stats()
+    assert stats["cancelled"] == 2
+    assert stats["running"] == 0 and stats["queued"] == 0
+    assert not scheduler._tasks
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import shutil
+import subprocess
+from types import SimpleNamespace
+import pytest
+from pydub import AudioSegment
+import utils.media_extract as media_extract
+from utils.media_extract import NotStreamableError, extract_audio_to_buffer
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg не установлен")
+
+
+class FakeBot:
+    """Бот, отдающий один файл и считающий полные скачивания"""
+
+    def __init__(self, data):
+        self.data = data
+        self.downloads = 0
+
+    async def get_file(self, file_id):
+        return SimpleNamespace(file_path=f"videos/{file_id}")
+
+    async def download_file(self, file_path, destination, seek=False):
+        self.downloads += 1
+        destination.write(self.data)
+
+
+def make_mp4(path, faststart):
+    """Видео на 20 с со звуком; без faststart индекс (moov) пишется в конец файла"""
+    movflags = ["-movflags", "+faststart"] if faststart else []
+    subprocess.run([
+        AudioSegment.converter, "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc=s=240x240:r=25:d=20", "-f", "lavfi", "-i", "sine=d=20",
+        "-c:v", "mpeg4", "-q:v", "3", "-c:a", "aac", "-shortest", *movflags, path,
+    ], check=True)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def use_stream(monkeypatch, data):
+    async def stream(bot, file_path, chunk_size=64 * 1024):
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+    monkeypatch.setattr(media_extract, "stream_telegram_file", stream)
+
+
+def extract(bot):
+    async def scenario():
+        buffer = await extract_audio_to_buffer(bot, "video")
+        with buffer:
+            return buffer.size
+    return asyncio.run(scenario())
+
+
+def test_streamable_video_is_extracted_from_pipe(monkeypatch, tmp_path):
+    data = make_mp4(str(tmp_path / "faststart.mp4"), faststart=True)
+    use_stream(monkeypatch, data)
+    bot = FakeBot(data)
+    assert extract(bot) > 0
+    assert bot.downloads == 0
+
+
+def test_moov_at_end_falls_back_to_file(monkeypatch, tmp_path):
+    data = make_mp4(str(tmp_path / "late_moov.mp4"), faststart=False)
+    use_stream(monkeypatch, data)
+    bot = FakeBot(data)
+    assert extract(bot) > 0
+    assert bot.downloads == 1
+
+
+def test_not_streamable_is_detected_from_ffmpeg_output(tmp_path):
+    data = make_mp4(str(tmp_path / "late_moov.mp4"), faststart=False)
+
+    async def chunks():
+        yield data
+
+    async def scenario():
+        buffer = media_extract.AudioBuffer()
+        with buffer:
+            await media_extract._run_extract(buffer, chunks=chunks())
+
+    with pytest.raises(NotStreamableError):
+        asyncio.run(scenario())
+
+
+def test_other_ffmpeg_errors_are_not_retried_from_file(monkeypatch):
+    data = os.urandom(256 * 1024)
+    use_stream(monkeypatch, data)
+    bot = FakeBot(data)
+    with pytest.raises(RuntimeError) as error:
+        extract(bot)
+    assert not isinstance(error.value, NotStreamableError)
+    assert bot.downloads == 0
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+import utils.message_batch as message_batch
+from utils.message_batch import BatchItem, MessageCoalescer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_item(message_id):
+    return BatchItem(SimpleNamespace(message_id=message_id))
+
+
+def make_coalescer(monkeypatch, window=1.0, max_messages=20):
+    clock = Clock()
+    monkeypatch.setattr(message_batch.time, "monotonic", clock)
+    return MessageCoalescer(window=window, max_messages=max_messages), clock
+
+
+def test_messages_within_window_join_first_owner(monkeypatch):
+    coalescer, clock = make_coalescer(monkeypatch)
+    batch, owner = coalescer.join(1, make_item(1))
+    assert owner
+    for message_id in (2, 3):
+        clock.now += 0.9
+        joined, owner = coalescer.join(1, make_item(message_id))
+        assert joined is batch
+        assert not owner
+    assert [item.message.message_id for item in batch.items] == [1, 2, 3]
+
+
+def test_message_after_window_expiry_becomes_new_owner(monkeypatch):
+    coalescer, clock = make_coalescer(monkeypatch)
+    first, _ = coalescer.join(1, make_item(1))
+    assert coalescer.window_remaining(first) == 1.0
+    clock.now += 1.5
+    assert coalescer.window_remaining(first) < 0
+
+    second, owner = coalescer.join(1, make_item(2))
+    assert owner
+    assert second is not first
+    assert [item.message.message_id for item in first.items] == [1]
+
+
+def test_closed_batch_hands_ownership_to_next_message(monkeypatch):
+    coalescer, _ = make_coalescer(monkeypatch)
+    first, _ = coalescer.join(1, make_item(1))
+    coalescer.close(first)
+    second, owner = coalescer.join(1, make_item(2))
+    assert owner
+    assert second is not first
+
+    # Повторное закрытие старого пакета не закрывает новый
+    coalescer.close(first)
+    joined, owner = coalescer.join(1, make_item(3))
+    assert joined is second
+    assert not owner
+
+
+def test_full_batch_hands_ownership_to_next_message(monkeypatch):
+    coalescer, _ = make_coalescer(monkeypatch, max_messages=2)
+    first, _ = coalescer.join(1, make_item(1))
+    coalescer.join(1, make_item(2))
+    second, owner = coalescer.join(1, make_item(3))
+    assert owner
+    assert second is not first
+    assert len(first.items) == 2
+
+
+def test_chats_are_batched_separately(monkeypatch):
+    coalescer, _ = make_coalescer(monkeypatch)
+    first, first_owner = coalescer.join(1, make_item(1))
+    second, second_owner = coalescer.join(2, make_item(1))
+    assert first_owner and second_owner
+    assert first is not second
+    assert coalescer.stats() == {"open_batches": 2}
+
+
+def test_out_of_order_messages_are_sorted(monkeypatch):
+    coalescer, _ = make_coalescer(monkeypatch)
+    batch, _ = coalescer.join(1, make_item(5))
+    coalescer.join(1, make_item(3))
+    coalescer.join(1, make_item(4))
+    assert [item.message.message_id for item in batch.items] == [3, 4, 5]
+
+
+def test_delivered_callbacks_receive_message(monkeypatch):
+    coalescer, _ = make_coalescer(monkeypatch)
+    delivered = []
+    coalescer.on_delivered(lambda message: delivered.append(message.message_id))
+    item = make_item(7)
+    coalescer.join(1, item)
+    coalescer.delivered(item)
+    assert delivered == [7]
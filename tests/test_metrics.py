@@ -0,0 +1,77 @@
+from utils.metrics import Counter, Gauge, Histogram, MetricsRegistry, error_reason
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("stage_seconds", "Этапы", ["stage"], buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 20):
+        histogram.observe(value, stage="download")
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP stage_seconds Этапы", "# TYPE stage_seconds histogram"]
+    # Граница корзины включается в нее (le — «меньше или равно»)
+    assert lines[2:] == [
+        'stage_seconds_bucket{stage="download",le="0.1"} 2',
+        'stage_seconds_bucket{stage="download",le="1"} 3',
+        'stage_seconds_bucket{stage="download",le="10"} 3',
+        'stage_seconds_bucket{stage="download",le="+Inf"} 4',
+        'stage_seconds_sum{stage="download"} 20.65',
+        'stage_seconds_count{stage="download"} 4',
+    ]
+
+
+def test_histogram_time_observes_block_duration():
+    histogram = Histogram("block_seconds", "Блок", buckets=(1,))
+    try:
+        with histogram.time():
+            raise ValueError()
+    except ValueError:
+        pass
+    assert 'block_seconds_count 1' in histogram.render()
+
+
+def test_counter_and_gauge_labels():
+    counter = Counter("errors_total", "Ошибки", ["stage", "reason"])
+    counter.inc(stage="provider", reason="http_503")
+    counter.inc(2, stage="provider", reason="http_503")
+    gauge = Gauge("in_flight", "В работе", ["kind"])
+    with gauge.track(kind="jobs"):
+        assert gauge.render()[-1] == 'in_flight{kind="jobs"} 1'
+    assert counter.render()[-1] == 'errors_total{stage="provider",reason="http_503"} 3'
+    assert gauge.render()[-1] == 'in_flight{kind="jobs"} 0'
+
+
+def test_label_values_are_escaped():
+    counter = Counter("events_total", "События", ["reason"])
+    counter.inc(reason='bad "quote"\nline')
+    assert counter.render()[-1] == 'events_total{reason="bad \\"quote\\"\\nline"} 1'
+
+
+def test_registry_runs_collect_callbacks_before_render():
+    registry = MetricsRegistry()
+    gauge = registry.register(Gauge("cache_entries", "Записи кэша"))
+    registry.on_collect(lambda: gauge.set(42))
+    assert registry.render().endswith("cache_entries 42\n")
+
+
+def test_error_reason_prefers_http_status():
+    class ApiError(Exception):
+        status_code = 429
+
+    class ResponseError(Exception):
+        response = type("Response", (), {"status_code": 502})()
+
+    assert error_reason(ApiError()) == "http_429"
+    assert error_reason(ResponseError()) == "http_502"
+    assert error_reason(TimeoutError()) == "TimeoutError"
+
+
+def test_registry_constant_labels_mark_every_sample():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("updates_total", "Обновления", ["kind"]))
+    histogram = registry.register(Histogram("wait_seconds", "Ожидание", buckets=(1,)))
+    counter.inc(kind="voice")
+    histogram.observe(0.5)
+    registry.set_constant_labels(worker=2)
+    lines = registry.render().splitlines()
+    assert 'updates_total{worker="2",kind="voice"} 1' in lines
+    assert 'wait_seconds_bucket{worker="2",le="1"} 1' in lines
+    assert 'wait_seconds_count{worker="2"} 1' in lines
@@ -0,0 +1,95 @@
+import time
+import utils.provider_router as provider_router
+from utils.provider_router import ProviderRouter, STATE_HALF_OPEN, STATE_OPEN
+
+PROVIDERS = ["whisper", "elevenlabs"]
+
+
+def make_router():
+    return ProviderRouter(PROVIDERS, weights={"whisper": 1.0, "elevenlabs": 0.0})
+
+
+def half_open(router, name):
+    """Переводит выключатель провайдера в состояние, когда пора отправить пробный запрос"""
+    health = router.health[name]
+    health.state = STATE_OPEN
+    health.opened_at = time.monotonic() - provider_router.ROUTER_OPEN_SECONDS - 1
+
+
+def test_hedging_is_off_by_default():
+    router = make_router()
+    for _ in range(50):
+        router.record("whisper", True, 1.0, 10)
+    assert router.hedge_delay("whisper", 10) is None
+
+
+def test_hedge_delay_scales_with_audio_duration(monkeypatch):
+    monkeypatch.setattr(provider_router, "ROUTER_HEDGING", True)
+    router = make_router()
+    # Провайдер распознает со скоростью 0.1 с на секунду аудио
+    for seconds in (10, 60, 180) * 10:
+        router.record("whisper", True, seconds / 10, seconds)
+
+    assert router.hedge_delay("whisper", 10) == provider_router.ROUTER_HEDGE_MIN_DELAY
+    # Длинный фрагмент идет дольше короткого, но это не повод его дублировать
+    assert router.hedge_delay("whisper", 180) >= 18
+    assert router.hedge_delay("whisper", 600) >= 60
+
+
+def test_hedge_delay_needs_enough_samples(monkeypatch):
+    monkeypatch.setattr(provider_router, "ROUTER_HEDGING", True)
+    router = make_router()
+    for _ in range(provider_router.ROUTER_HEDGE_MIN_SAMPLES - 1):
+        router.record("whisper", True, 1.0, 10)
+    assert router.hedge_delay("whisper", 10) is None
+
+
+def test_half_open_probe_is_reserved_by_first_caller():
+    router = make_router()
+    half_open(router, "elevenlabs")
+
+    first = object()
+    assert "elevenlabs" in router.candidates(first)
+    assert router.health["elevenlabs"].state == STATE_HALF_OPEN
+    # Пока проба занята, остальные вызовы не получают провайдера
+    for _ in range(10):
+        assert router.candidates(object()) == ["whisper"]
+
+    # Проба не понадобилась (ответил основной провайдер): ее может занять следующий
+    router.release_probes(first)
+    assert "elevenlabs" in router.candidates(object())
+
+
+def test_release_probes_keeps_other_owners_reservation():
+    router = make_router()
+    half_open(router, "elevenlabs")
+    owner = object()
+    router.candidates(owner)
+    router.release_probes(object())
+    assert router.candidates(object()) == ["whisper"]
+
+
+def test_probe_result_closes_or_reopens_circuit():
+    router = make_router()
+    half_open(router, "elevenlabs")
+    router.candidates(object())
+    router.record("elevenlabs", False, 1.0)
+    assert router.health["elevenlabs"].state == STATE_OPEN
+    assert router.candidates(object()) == ["whisper"]
+
+    half_open(router, "elevenlabs")
+    router.candidates(object())
+    router.record("elevenlabs", True, 1.0)
+    assert router.candidates(object()) == ["whisper", "elevenlabs"]
+
+
+def test_release_clears_only_own_probe():
+    router = make_router()
+    half_open(router, "elevenlabs")
+    owner = object()
+    router.candidates(owner)
+    # Запрос, выбранный до перехода в полуоткрытое состояние, пробу не снимает
+    router.release("elevenlabs", object())
+    assert router.health["elevenlabs"].probe_owner is owner
+    router.release("elevenlabs", owner)
+    assert router.health["elevenlabs"].probe_owner is None
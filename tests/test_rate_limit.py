@@ -0,0 +1,134 @@
+import asyncio
+import email.utils
+import time
+import pytest
+import utils.rate_limit as rate_limit
+from utils.rate_limit import (
+    DIMENSION_REQUESTS,
+    ProviderThrottled,
+    RateLimitGovernor,
+    TokenBucket,
+    parse_retry_after,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def make_governor(requests_per_minute="", budget=20):
+    return RateLimitGovernor(
+        ["whisper", "elevenlabs"], requests_per_minute=requests_per_minute, audio_seconds_per_minute="",
+        budget=budget, retries=2, backoff=1.0, workers=1,
+    )
+
+
+def test_bucket_allows_burst_then_spaces_requests():
+    # 60 запросов в минуту: запас на BURST_SECONDS секунд, дальше по одному в секунду
+    bucket = TokenBucket(60, now=0.0)
+    assert bucket.capacity == rate_limit.BURST_SECONDS
+    waits = [bucket.reserve(1, now=0.0) for _ in range(rate_limit.BURST_SECONDS + 3)]
+    assert waits[:rate_limit.BURST_SECONDS] == [0.0] * rate_limit.BURST_SECONDS
+    assert waits[rate_limit.BURST_SECONDS:] == pytest.approx([1.0, 2.0, 3.0])
+
+    # Неотправленный запрос возвращает токены, и следующему ждать меньше
+    bucket.refund(1, now=0.0)
+    assert bucket.reserve(1, now=0.0) == pytest.approx(3.0)
+    # Через секунду запас пополнился на один токен
+    assert bucket.reserve(1, now=1.0) == pytest.approx(3.0)
+
+
+def test_bucket_drain_removes_burst():
+    bucket = TokenBucket(60, now=0.0)
+    bucket.drain()
+    assert bucket.reserve(1, now=0.0) == pytest.approx(1.0)
+
+
+def test_parse_retry_after_formats():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after({"Retry-After": "7"}) == 7.0
+    assert parse_retry_after({"retry-after-ms": "1500", "Retry-After": "7"}) == 1.5
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= parse_retry_after({"Retry-After": date}) <= 30
+    assert parse_retry_after({"Retry-After": "скоро"}) is None
+
+
+def test_long_retry_after_pauses_provider(clock):
+    governor = make_governor(budget=20)
+    governor.rate_limited("whisper", 45)
+
+    # Квота исчерпана: ожидание не укладывается в бюджет, запрос сразу уходит резервному
+    with pytest.raises(ProviderThrottled):
+        asyncio.run(governor.admit("whisper", 10, governor.deadline()))
+    asyncio.run(governor.admit("elevenlabs", 10, governor.deadline()))
+
+    stats = governor.stats()
+    assert stats["whisper"]["blocked_seconds"] == pytest.approx(45)
+    assert stats["whisper"]["rejected"] == 1
+    assert stats["elevenlabs"]["admitted"] == 1
+
+    # После паузы запросы снова допускаются
+    clock.now += 46
+    asyncio.run(governor.admit("whisper", 10, governor.deadline()))
+    assert governor.stats()["whisper"]["admitted"] == 1
+
+
+def test_short_retry_after_does_not_pause_provider(clock):
+    governor = make_governor(budget=20)
+    governor.rate_limited("whisper", 2)
+    assert governor.stats()["whisper"]["blocked_seconds"] == 0
+    # Короткий Retry-After задерживает только повтор запроса, получившего 429
+    assert governor.retry_delay(0, retry_after=2) >= 2
+
+
+def test_rate_is_learned_from_first_429_and_recovers(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_RECOVERY_SECONDS", 300)
+    governor = make_governor()
+    limiter = governor.limiters["whisper"]
+    # Без заданного лимита провайдер получает 30 запросов за 10 секунд (180 в минуту)
+    for _ in range(30):
+        asyncio.run(governor.admit("whisper", 5, governor.deadline()))
+        clock.now += 10 / 30
+    assert limiter.effective_rate(DIMENSION_REQUESTS) is None
+
+    governor.rate_limited("whisper", None)
+    learned = limiter.learned[DIMENSION_REQUESTS]
+    assert learned == pytest.approx(180, rel=0.05)
+    assert limiter.effective_rate(DIMENSION_REQUESTS) == pytest.approx(learned * rate_limit.DECREASE_FACTOR)
+
+    # 429 на одновременные запросы снижают частоту один раз
+    governor.rate_limited("whisper", None)
+    assert limiter.factor == pytest.approx(rate_limit.DECREASE_FACTOR)
+    clock.now += rate_limit.DECREASE_INTERVAL + 0.1
+    governor.rate_limited("whisper", None)
+    assert limiter.factor == pytest.approx(rate_limit.DECREASE_FACTOR ** 2)
+    assert limiter.learned[DIMENSION_REQUESTS] == learned
+
+    # Успешные запросы постепенно возвращают частоту, а без 429 выученный лимит забывается
+    for _ in range(20):
+        governor.succeeded("whisper")
+    assert limiter.factor == 1.0
+    assert limiter.effective_rate(DIMENSION_REQUESTS) == pytest.approx(learned)
+    clock.now += 301
+    governor.succeeded("whisper")
+    assert limiter.effective_rate(DIMENSION_REQUESTS) is None
+
+
+def test_configured_limit_is_split_between_workers():
+    governor = RateLimitGovernor(
+        ["whisper"], requests_per_minute="whisper:100", audio_seconds_per_minute="whisper:600", workers=4,
+    )
+    limiter = governor.limiters["whisper"]
+    assert limiter.effective_rate(DIMENSION_REQUESTS) == 25
+    assert limiter.effective_rate(rate_limit.DIMENSION_AUDIO_SECONDS) == 150
@@ -0,0 +1,211 @@
+import asyncio
+import shutil
+import time
+import pytest
+import utils.speech_to_text as speech_to_text
+from bench.audio_samples import generate_audio
+from bench.fakes import FaultConfig, ProviderStats, create_elevenlabs_app, start_app
+from utils.audio_buffer import AudioBuffer
+from utils.audio_processing import PcmAudio
+from utils.speech_to_text import SpeechToTextConverter, _elevenlabs_endpoint
+
+# Задержка медленного поддельного провайдера, в секундах
+LATENCY = 0.3
+
+
+def make_converter():
+    """Конвертер с поддельным провайдером: каждый запрос отвечает через LATENCY секунд"""
+    converter = SpeechToTextConverter()
+    # SDK провайдеров не нужны: запрос подменяется целиком
+    converter._clients_loaded = True
+    converter.in_flight = 0
+    converter.peak_in_flight = 0
+
+    async def slow_request(provider, audio, language, seconds=None, probe_owner=None):
+        converter.in_flight += 1
+        converter.peak_in_flight = max(converter.peak_in_flight, converter.in_flight)
+        try:
+            await asyncio.sleep(LATENCY)
+        finally:
+            converter.in_flight -= 1
+        return f"текст от {provider}"
+
+    converter._request = slow_request
+    return converter
+
+
+async def convert_many(converter, count):
+    started = time.monotonic()
+    results = await asyncio.gather(*(
+        converter._convert(AudioBuffer.from_bytes(b"\0" * 4000), "ru", 1.0) for _ in range(count)
+    ))
+    return time.monotonic() - started, results
+
+
+def test_jobs_up_to_cap_finish_in_one_latency():
+    converter = make_converter()
+    elapsed, results = asyncio.run(convert_many(converter, converter.max_concurrency))
+    assert all(provider is not None for _, provider in results)
+    assert converter.peak_in_flight == converter.max_concurrency
+    assert elapsed < LATENCY * 1.8
+
+
+def test_jobs_above_cap_wait_for_a_slot():
+    converter = make_converter()
+    elapsed, _ = asyncio.run(convert_many(converter, converter.max_concurrency * 2))
+    assert converter.peak_in_flight == converter.max_concurrency
+    assert elapsed >= LATENCY * 2
+
+
+def test_elevenlabs_requests_reach_configured_base_url(monkeypatch):
+    async def scenario():
+        stats = ProviderStats()
+        runner, url = await start_app(create_elevenlabs_app(FaultConfig(latency=0, jitter=0), stats))
+        monkeypatch.setattr(speech_to_text, "ELEVENLABS_BASE_URL", url)
+        converter = SpeechToTextConverter()
+        try:
+            await converter.warm_up()
+            with AudioBuffer.from_bytes(b"\0" * 4000) as audio:
+                text = await converter._convert_with_elevenlabs(audio)
+        finally:
+            await converter.close()
+            await runner.cleanup()
+        return stats, text
+
+    stats, text = asyncio.run(scenario())
+    assert stats.requests == 1
+    assert stats.bytes_received == 4000
+    assert "4000" in text
+
+
+def test_elevenlabs_endpoint_for_class_environment(monkeypatch):
+    import elevenlabs.environment
+
+    class ElevenLabsEnvironment:
+        def __init__(self, base, wss):
+            self.base = base
+            self.wss = wss
+
+    monkeypatch.setattr(elevenlabs.environment, "ElevenLabsEnvironment", ElevenLabsEnvironment)
+    endpoint = _elevenlabs_endpoint("http://127.0.0.1:8080")
+    assert set(endpoint) == {"environment"}
+    assert endpoint["environment"].base == "http://127.0.0.1:8080"
+    assert endpoint["environment"].wss == "ws://127.0.0.1:8080"
+    assert _elevenlabs_endpoint(None) == {}
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+def test_server_error_fails_over_without_retrying():
+    async def scenario():
+        converter = SpeechToTextConverter()
+        converter._clients_loaded = True
+        calls = []
+
+        async def request(provider, audio, language, seconds=None, probe_owner=None):
+            calls.append(provider)
+            if provider == "whisper":
+                raise ServerError("service unavailable")
+            return f"текст от {provider}"
+
+        converter._request = request
+        converter.router.candidates = lambda owner=None: ["whisper", "elevenlabs"]
+        result = await converter._convert(AudioBuffer.from_bytes(b"\0" * 4000), "ru", 1.0)
+        # Последний провайдер в списке повторяет запрос: резерва у него нет
+        converter.router.candidates = lambda owner=None: ["whisper"]
+        converter.governor.backoff = 0.01
+        calls_before = len(calls)
+        await converter._convert(AudioBuffer.from_bytes(b"\0" * 4000), "ru", 1.0)
+        return result, calls[:calls_before], calls[calls_before:], converter.governor.retries
+
+    result, with_fallback, without_fallback, retries = asyncio.run(scenario())
+    assert result == ("текст от elevenlabs", "elevenlabs")
+    assert with_fallback == ["whisper", "elevenlabs"]
+    assert without_fallback == ["whisper"] * (retries + 1)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg не установлен")
+def test_decoded_audio_longer_than_chunk_max_is_split(monkeypatch):
+    monkeypatch.setattr(speech_to_text, "CHUNK_TARGET_SECONDS", 8)
+    monkeypatch.setattr(speech_to_text, "CHUNK_MAX_SECONDS", 12)
+    _, data = generate_audio("audio", 30)
+
+    async def scenario():
+        converter = make_converter()
+        # Длительность из сообщения занижена: до декодирования разбиение кажется ненужным
+        assert not converter._needs_chunking_check(AudioBuffer.from_bytes(data), 5)
+        return [part async for part in converter.transcribe_stream(data, "ru", duration=5)]
+
+    parts = asyncio.run(scenario())
+    assert len(parts) >= 3
+    assert all(provider is not None for _, provider in parts)
+
+
+def test_needs_preprocessing(monkeypatch):
+    monkeypatch.setattr(speech_to_text, "PREPROCESS_ENABLED", True)
+    monkeypatch.setattr(speech_to_text, "PREPROCESS_MIN_BYTES", 256 * 1024)
+    monkeypatch.setattr(speech_to_text, "PREPROCESS_COMPACT_BITRATE", 64000)
+    converter = make_converter()
+    small = AudioBuffer.from_bytes(b"\0" * 100 * 1024)
+    large = AudioBuffer.from_bytes(b"\0" * 1024 * 1024)
+    with small, large:
+        assert not converter._needs_preprocessing(small, 5)
+        # 1 МБ за 60 с — около 140 кбит/с (MP3), за 300 с — около 28 кбит/с (голосовое в Opus)
+        assert converter._needs_preprocessing(large, 60)
+        assert not converter._needs_preprocessing(large, 300)
+        # Без длительности битрейт неизвестен, поэтому большой файл перекодируется
+        assert converter._needs_preprocessing(large, None)
+        monkeypatch.setattr(speech_to_text, "PREPROCESS_ENABLED", False)
+        assert not converter._needs_preprocessing(large, 60)
+
+
+def preprocess_with_encoded_size(monkeypatch, encoded_size):
+    """Прогоняет файл через предобработку, подменяя декодирование и кодирование"""
+    monkeypatch.setattr(speech_to_text, "PREPROCESS_MIN_BYTES", 0)
+    monkeypatch.setattr(speech_to_text, "load_audio", lambda audio: PcmAudio(AudioBuffer.from_bytes(b"\0" * 32000)))
+    monkeypatch.setattr(speech_to_text, "trim_silence", lambda segment: segment)
+    monkeypatch.setattr(
+        speech_to_text, "export_audio",
+        lambda segment, filename, bitrate: AudioBuffer.from_bytes(b"\1" * encoded_size, filename=filename),
+    )
+    converter = make_converter()
+    uploaded = []
+    request = converter._request
+
+    async def recording_request(provider, audio, language, seconds=None, probe_owner=None):
+        uploaded.append(audio.size)
+        return await request(provider, audio, language, seconds, probe_owner)
+
+    converter._request = recording_request
+    audio = AudioBuffer.from_bytes(b"\0" * 5000, filename="voice.mp3")
+    asyncio.run(converter.transcribe(audio, "ru"))
+    audio.close()
+    return uploaded, converter.preprocessing_stats()
+
+
+def test_smaller_of_original_and_reencoded_is_uploaded(monkeypatch):
+    uploaded, stats = preprocess_with_encoded_size(monkeypatch, 2000)
+    assert uploaded == [2000]
+    assert stats["mp3"]["bytes_after"] == 2000
+
+    # Перекодированный файл оказался больше исходного: отправляется исходный
+    uploaded, stats = preprocess_with_encoded_size(monkeypatch, 8000)
+    assert uploaded == [5000]
+    assert stats["mp3"]["bytes_after"] == 5000
+
+
+def test_preprocessing_stats_are_kept_per_file_type():
+    converter = make_converter()
+    with AudioBuffer.from_bytes(b"\0" * 1000, filename="a.mp3") as mp3, \
+            AudioBuffer.from_bytes(b"\0" * 300, filename="voice.ogg") as ogg:
+        converter._record_preprocessing(mp3, 400, 0.5, 2.0)
+        converter._record_preprocessing(mp3, 600, 0.25, 1.0)
+        converter._record_preprocessing(ogg, 300, 0.0, 1.5, preprocessed=False)
+    stats = converter.preprocessing_stats()
+    assert stats["mp3"] == {
+        "files": 2, "preprocessed": 2, "bytes_before": 2000, "bytes_after": 1000,
+        "preprocess_seconds": 0.75, "total_seconds": 3.0,
+    }
+    assert stats["ogg"]["files"] == 1 and stats["ogg"]["preprocessed"] == 0
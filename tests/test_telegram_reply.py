@@ -0,0 +1,120 @@
+import asyncio
+from types import SimpleNamespace
+from aiogram.exceptions import TelegramRetryAfter
+from utils.telegram_reply import TELEGRAM_MESSAGE_LIMIT, StreamingReply, split_message
+
+
+def test_telegram_limit_is_4096():
+    assert TELEGRAM_MESSAGE_LIMIT == 4096
+
+
+def test_text_at_limit_is_one_message():
+    text = "а" * TELEGRAM_MESSAGE_LIMIT
+    assert split_message(text) == [text]
+
+
+def test_text_over_limit_without_spaces_is_cut_at_limit():
+    text = "а" * TELEGRAM_MESSAGE_LIMIT + "б"
+    assert split_message(text) == ["а" * TELEGRAM_MESSAGE_LIMIT, "б"]
+
+
+def test_text_is_split_on_last_space_before_limit():
+    first = "слово " * 682  # 4092 символа
+    text = first + "конец"
+    pages = split_message(text)
+    assert pages == [first[:-1], "конец"]
+    assert all(len(page) <= TELEGRAM_MESSAGE_LIMIT for page in pages)
+
+
+def test_space_exactly_at_limit_is_used_as_boundary():
+    text = "а" * TELEGRAM_MESSAGE_LIMIT + " " + "б" * 10
+    assert split_message(text) == ["а" * TELEGRAM_MESSAGE_LIMIT, "б" * 10]
+
+
+def test_pages_keep_all_words():
+    words = [f"слово{i}" for i in range(3000)]
+    text = " ".join(words)
+    pages = split_message(text)
+    assert len(pages) > 1
+    assert all(len(page) <= TELEGRAM_MESSAGE_LIMIT for page in pages)
+    assert " ".join(pages).split() == words
+
+
+def test_sent_pages_do_not_change_when_text_grows():
+    text = " ".join(f"слово{i}" for i in range(2000))
+    pages = split_message(text)
+    longer = split_message(text + " и еще немного текста")
+    assert longer[:len(pages) - 1] == pages[:-1]
+
+
+class FakeSent:
+    def __init__(self, chat, text):
+        self.chat = chat
+        self.text = text
+        self.deleted = False
+
+    async def edit_text(self, text):
+        if self.chat.fail_edits:
+            raise self.chat.fail_edits.pop(0)
+        self.text = text
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeMessage:
+    """Сообщение пользователя: запоминает ответы и может отказывать в правках"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(type="private")
+        self.fail_edits = []
+        self.replies = []
+
+    async def reply(self, text):
+        sent = FakeSent(self, text)
+        self.replies.append(sent)
+        return sent
+
+
+def make_reply(message):
+    reply = StreamingReply(message)
+    reply.streaming = True
+    reply.min_interval = 0.01
+    return reply
+
+
+def test_background_edit_errors_are_logged_not_raised(caplog):
+    async def scenario():
+        message = FakeMessage()
+        reply = make_reply(message)
+        await reply.update("начало")
+        message.fail_edits = [
+            TelegramRetryAfter(method=None, message="Flood control", retry_after=0),
+            RuntimeError("соединение разорвано"),
+        ]
+        await reply.update("начало и продолжение")
+        task = reply._flush_task
+        await asyncio.gather(task)
+        await reply.finish()
+        return message, reply
+
+    message, reply = asyncio.run(scenario())
+    # Флуд-контроль выжидается и правка повторяется, сетевая ошибка только пишется в лог
+    assert "соединение разорвано" in caplog.text
+    assert reply.min_interval == 0.02
+    assert [sent.text for sent in message.replies] == ["начало и продолжение"]
+
+
+def test_finish_deletes_pages_no_longer_needed():
+    async def scenario():
+        message = FakeMessage()
+        reply = make_reply(message)
+        await reply.update("слово " * 1500)
+        await reply.update("короткий итог")
+        await reply._flush_task
+        return message
+
+    message = asyncio.run(scenario())
+    assert len(message.replies) == 3
+    assert message.replies[0].text == "короткий итог"
+    assert [sent.deleted for sent in message.replies] == [False, True, True]
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+from utils.shared_state import SharedState, SQLiteSharedState
+from utils.transcript_cache import TranscriptCache, make_cache_key
+
+SCOPE = ("whisper", "whisper-1", "ru")
+
+
+def test_lru_evicts_least_recently_used():
+    async def scenario():
+        cache = TranscriptCache(path="", memory_entries=2)
+        await cache.set(["a"], "первый")
+        await cache.set(["b"], "второй")
+        # Обращение к "a" делает "b" самой давней записью
+        assert await cache.get("a") == "первый"
+        await cache.set(["c"], "третий")
+        return cache, await cache.get("a"), await cache.get("b"), await cache.get("c")
+
+    cache, a, b, c = asyncio.run(scenario())
+    assert (a, b, c) == ("первый", None, "третий")
+    assert cache.evictions == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_expired_entries_are_misses():
+    async def scenario():
+        cache = TranscriptCache(path="", max_age=60)
+        await cache.set(["a"], "текст")
+        text, created_at = cache._memory["a"]
+        cache._memory["a"] = (text, created_at - 61)
+        return await cache.get("a")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_store_hit_is_promoted_to_memory(tmp_path):
+    store = SQLiteSharedState(str(tmp_path / "state.sqlite3"))
+    key = make_cache_key("file", "unique", SCOPE)
+
+    async def scenario():
+        # Другой процесс с тем же хранилищем: его память пуста, запись находится в хранилище
+        writer = TranscriptCache(store=store)
+        await writer.set([key], "общая расшифровка")
+        reader = TranscriptCache(store=store)
+        first = await reader.get(key)
+        second = await reader.get(key)
+        return reader, first, second
+
+    try:
+        reader, first, second = asyncio.run(scenario())
+    finally:
+        store.close()
+    assert first == second == "общая расшифровка"
+    assert reader.disk_hits == 1
+    assert reader.memory_hits == 1
+
+
+def test_cache_keys_are_scoped_by_provider():
+    whisper = make_cache_key("sha256", "abc", SCOPE)
+    elevenlabs = make_cache_key("sha256", "abc", ("elevenlabs", "scribe_v1", "ru"))
+    assert whisper != elevenlabs
+
+
+def test_get_any_finds_transcript_stored_by_fallback_provider(tmp_path):
+    store = SQLiteSharedState(str(tmp_path / "state.sqlite3"))
+    fallback_scope = ("elevenlabs", "scribe_v1", "ru")
+    keys = [make_cache_key("file", "unique", scope) for scope in (SCOPE, fallback_scope)]
+
+    async def scenario():
+        # Ответил резервный провайдер: расшифровка сохранена под его областью
+        writer = TranscriptCache(store=store)
+        await writer.set([keys[1]], "расшифровка резервного")
+        reader = TranscriptCache(store=store)
+        found = await reader.get_any(keys)
+        missed = await reader.get_any([make_cache_key("file", "other", scope) for scope in (SCOPE, fallback_scope)])
+        return reader, found, missed
+
+    try:
+        reader, found, missed = asyncio.run(scenario())
+    finally:
+        store.close()
+    assert found == ("расшифровка резервного", keys[1])
+    assert missed == (None, None)
+    # Поиск под несколькими ключами считается одним попаданием или промахом
+    assert (reader.disk_hits, reader.misses) == (1, 1)
+
+
+def test_store_batches_access_times_but_evicts_by_them(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    store = SQLiteSharedState(path)
+    try:
+        store.transcript_set(["a"], "первый", 100.0, 0, 2)
+        store.transcript_set(["b"], "второй", 101.0, 0, 2)
+        # Чтение не пишет в файл сразу: время обращения копится в памяти
+        assert store.transcript_get("a", 102.0, 0) == ("первый", 100.0)
+        assert store._db.execute("SELECT accessed_at FROM transcripts WHERE key = 'a'").fetchone() == (100.0,)
+        # Перед вытеснением накопленные обращения записываются, и вытесняется "b", а не "a"
+        store.transcript_set(["c"], "третий", 103.0, 0, 2)
+        assert store.transcript_get("b", 104.0, 0) is None
+        assert store.transcript_get("a", 104.0, 0) == ("первый", 100.0)
+    finally:
+        store.close()
+
+    # Обращения, не записанные до закрытия, сохраняются при закрытии
+    reopened = SQLiteSharedState(path)
+    try:
+        assert reopened._db.execute("SELECT accessed_at FROM transcripts WHERE key = 'a'").fetchone() == (104.0,)
+    finally:
+        reopened.close()
+
+
+def test_shared_state_requires_every_operation():
+    class Partial(SharedState):
+        def claim(self, key, ttl):
+            return True
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,115 @@
+import asyncio
+from aiohttp import web
+import utils.webhook as webhook
+from utils.shared_state import SQLiteSharedState
+from utils.webhook import UpdateDeduplicator
+
+
+def test_repeated_update_is_reported_once():
+    async def scenario():
+        deduplicator = UpdateDeduplicator(ttl=60, max_size=100)
+        return [await deduplicator.seen(update_id) for update_id in (1, 2, 1, 3, 2)], deduplicator
+
+    results, deduplicator = asyncio.run(scenario())
+    assert results == [False, False, True, False, True]
+    assert deduplicator.duplicates == 2
+
+
+def test_update_without_id_is_never_duplicate():
+    async def scenario():
+        deduplicator = UpdateDeduplicator(ttl=60, max_size=100)
+        return [await deduplicator.seen(None) for _ in range(3)], len(deduplicator)
+
+    assert asyncio.run(scenario()) == ([False, False, False], 0)
+
+
+def test_seen_ids_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(webhook.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        deduplicator = UpdateDeduplicator(ttl=10, max_size=100)
+        await deduplicator.seen(1)
+        now[0] += 5
+        repeated_in_time = await deduplicator.seen(1)
+        now[0] += 11
+        repeated_late = await deduplicator.seen(1)
+        return repeated_in_time, repeated_late
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_oldest_ids_are_evicted_over_max_size():
+    async def scenario():
+        deduplicator = UpdateDeduplicator(ttl=60, max_size=3)
+        sizes = []
+        for update_id in range(5):
+            await deduplicator.seen(update_id)
+            sizes.append(len(deduplicator))
+        recent = await deduplicator.seen(4)
+        evicted = await deduplicator.seen(0)
+        return sizes, recent, evicted, len(deduplicator)
+
+    sizes, recent, evicted, size = asyncio.run(scenario())
+    assert sizes == [1, 2, 3, 3, 3]
+    assert recent is True
+    assert evicted is False
+    assert size == 3
+
+
+def test_shared_state_catches_duplicates_across_processes(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def scenario():
+        # Два процесса с собственной памятью и общим файлом состояния
+        first = UpdateDeduplicator(ttl=60, max_size=100, state=SQLiteSharedState(path))
+        second = UpdateDeduplicator(ttl=60, max_size=100, state=SQLiteSharedState(path))
+        return await first.seen(42), await second.seen(42), await second.seen(43)
+
+    assert asyncio.run(scenario()) == (False, True, False)
+
+
+def test_update_chat_id_covers_update_kinds():
+    assert webhook.update_chat_id({"update_id": 1, "message": {"chat": {"id": -100}}}) == -100
+    assert webhook.update_chat_id({"update_id": 2, "callback_query": {"from": {"id": 7}, "message": {"chat": {"id": 5}}}}) == 5
+    assert webhook.update_chat_id({"update_id": 3, "inline_query": {"from": {"id": 7}}}) == 7
+    assert webhook.update_chat_id({"update_id": 4}) is None
+
+
+def test_router_sends_each_chat_to_one_worker():
+    router = webhook.UpdateRouter(worker_index=1, workers=4, base_port=9000, path="/updates")
+    owners = {router.owner({"update_id": i, "message": {"chat": {"id": -1001234}}}) for i in range(10)}
+    assert len(owners) == 1
+    assert router.owner({"update_id": 1, "message": {"chat": {"id": 6}}}) == 2
+    # Обновление без чата обрабатывает принявший процесс
+    assert router.owner({"update_id": 1}) == 1
+
+
+def test_router_forwards_to_owner_and_reports_failures():
+    received = []
+
+    async def accept(request):
+        received.append(await request.json())
+        return web.Response(text="OK")
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/updates", accept)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        port = runner.addresses[0][1]
+        router = webhook.UpdateRouter(worker_index=0, workers=2, base_port=port - 1, path="/updates")
+        try:
+            delivered = await router.forward(1, {"update_id": 5})
+            await runner.cleanup()
+            # Процесс-владелец недоступен: вызывающий обработает обновление сам
+            lost = await router.forward(1, {"update_id": 6})
+        finally:
+            await router.close()
+        return delivered, lost, router
+
+    delivered, lost, router = asyncio.run(scenario())
+    assert (delivered, lost) == (True, False)
+    assert received == [{"update_id": 5}]
+    assert (router.forwarded, router.forward_errors) == (1, 1)
@@ -0,0 +1,165 @@
+import logging
+import os
+import tempfile
+from config import AUDIO_SPOOL_MAX_BYTES
+from utils.metrics import STAGE_SECONDS, BYTES
+
+
+class AudioBuffer:
+    """
+    Буфер для передачи аудио из Telegram в API распознавания без лишних копий.
+
+    Файл скачивается в буфер кусками и держится в памяти до порога
+    AUDIO_SPOOL_MAX_BYTES, после чего переносится во временный файл, поэтому
+    память на одно задание ограничена независимо от размера аудио.
+    Буфер можно перечитывать с начала, если запрос к API нужно повторить.
+    """
+
+    # Суммарный объем аудио в памяти по всем заданиям и его максимум
+    resident_bytes = 0
+    peak_resident_bytes = 0
+
+    def __init__(self, filename="audio.ogg", max_memory=AUDIO_SPOOL_MAX_BYTES):
+        self.filename = filename
+        self.size = 0
+        self._resident = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+
+    @classmethod
+    def from_bytes(cls, data, filename="audio.ogg"):
+        """Создает буфер из готовых байтов"""
+        buffer = cls(filename=filename)
+        buffer.write(data)
+        buffer.seek(0)
+        return buffer
+
+    @property
+    def in_memory(self):
+        """True, пока данные не перенесены во временный файл на диске"""
+        return not getattr(self._file, "_rolled", False)
+
+    def _track_memory(self):
+        """Обновляет счетчики памяти после записи"""
+        resident = self.size if self.in_memory else 0
+        AudioBuffer.resident_bytes += resident - self._resident
+        AudioBuffer.peak_resident_bytes = max(AudioBuffer.peak_resident_bytes, AudioBuffer.resident_bytes)
+        self._resident = resident
+
+    def write(self, data):
+        written = self._file.write(data)
+        self.size = max(self.size, self._file.tell())
+        self._track_memory()
+        return written
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    # fileno() намеренно не реализован: httpx вызывает его для определения
+    # длины файла, а SpooledTemporaryFile при этом сбрасывает данные на диск
+
+    def iter_chunks(self, chunk_size=64 * 1024):
+        """Читает буфер с начала кусками, не загружая его в память целиком"""
+        self.seek(0)
+        chunk = self.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.read(chunk_size)
+        self.seek(0)
+
+    def getvalue(self):
+        """Возвращает все содержимое буфера (копирует данные, использовать только для малых файлов)"""
+        self.seek(0)
+        data = self.read()
+        self.seek(0)
+        return data
+
+    def upload_file(self):
+        """
+        Возвращает кортеж (имя, файл) для загрузки через SDK провайдеров
+        
+        Каждый вызов дает независимую позицию чтения, поэтому один буфер можно
+        одновременно отправлять нескольким провайдерам (дублирующие запросы).
+        """
+        return (self.filename, AudioBufferReader(self))
+
+    def close(self):
+        if not self._file.closed:
+            AudioBuffer.resident_bytes -= self._resident
+            self._resident = 0
+            self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AudioBufferReader:
+    """Читатель AudioBuffer со своей позицией чтения"""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._position = 0
+
+    def read(self, size=-1):
+        # Между seek и read нет точек переключения цикла событий, поэтому
+        # читатели одного буфера не мешают друг другу
+        self._buffer.seek(self._position)
+        data = self._buffer.read(size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._position = offset
+        elif whence == os.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._buffer.size + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+async def download_to_buffer(bot, file_id, filename="audio.ogg"):
+    """
+    Скачивает файл из Telegram напрямую в AudioBuffer
+
+    :param bot: экземпляр aiogram Bot
+    :param file_id: идентификатор файла в Telegram
+    :param filename: имя файла, передаваемое в API распознавания
+    :return: AudioBuffer, который вызывающий код должен закрыть
+    """
+    with STAGE_SECONDS.time(stage="telegram_get_file"):
+        telegram_file = await bot.get_file(file_id)
+    buffer = AudioBuffer(filename=filename)
+    try:
+        # aiogram пишет куски загрузки прямо в переданный объект, без промежуточного BytesIO
+        with STAGE_SECONDS.time(stage="telegram_download"):
+            await bot.download_file(telegram_file.file_path, destination=buffer)
+    except Exception:
+        buffer.close()
+        raise
+    BYTES.inc(buffer.size, direction="downloaded")
+    if not buffer.in_memory:
+        BYTES.inc(buffer.size, direction="spooled_to_disk")
+    logging.info(
+        f"Скачано {buffer.size} байт ({'в памяти' if buffer.in_memory else 'на диске'}), "
+        f"пик памяти под аудио: {AudioBuffer.peak_resident_bytes} байт"
+    )
+    return buffer
@@ -0,0 +1,348 @@
+import logging
+import math
+import re
+import subprocess
+import threading
+from pydub import AudioSegment
+from pydub.silence import detect_silence, detect_leading_silence
+from config import FFMPEG_TIMEOUT
+from utils.audio_buffer import AudioBuffer
+
+# Функции этого модуля синхронные и нагружают CPU (ffmpeg, поиск пауз),
+# поэтому вызывать их нужно через asyncio.to_thread
+
+# Формат, в который аудио декодируется для разбиения: моно, 16 кГц, 16 бит.
+# Для распознавания речи этого достаточно, а час записи занимает ~115 МБ вместо ~600 МБ
+PCM_FRAME_RATE = 16000
+PCM_ARGS = ["-f", "s16le", "-ar", str(PCM_FRAME_RATE), "-ac", "1"]
+PCM_BYTES_PER_MS = PCM_FRAME_RATE * 2 // 1000
+
+
+def _feed_stdin(process, source):
+    """Пишет данные в stdin ffmpeg кусками (выполняется в отдельном потоке)"""
+    try:
+        if isinstance(source, (AudioBuffer, PcmAudio)):
+            for chunk in source.iter_chunks():
+                process.stdin.write(chunk)
+        else:
+            process.stdin.write(source)
+    except BrokenPipeError:
+        # ffmpeg завершился раньше, чем прочитал вход; ошибку покажет код возврата
+        pass
+    finally:
+        process.stdin.close()
+
+
+def _read_stderr(process, errors):
+    """Читает stderr ffmpeg до конца, чтобы переполненный канал не остановил процесс"""
+    errors.append(process.stderr.read())
+
+
+def run_ffmpeg(source, output_args, input_args=(), destination=None, timeout=None):
+    """
+    Прогоняет данные через ffmpeg по каналам, без временных файлов
+
+    stdin пишется, а stderr читается в отдельных потоках одновременно с чтением stdout:
+    ffmpeg, заполнивший любой из каналов, иначе ждал бы вечно вместе с рабочим потоком.
+
+    :param source: AudioBuffer, PcmAudio или байты на вход ffmpeg
+    :param output_args: параметры выходного потока (кодек, формат)
+    :param input_args: параметры входного потока (например, формат сырого PCM)
+    :param destination: AudioBuffer для результата; если не указан, результат возвращается байтами
+    :param timeout: предельное время работы ffmpeg в секундах (по умолчанию FFMPEG_TIMEOUT)
+    :raises RuntimeError: если ffmpeg завершился с ошибкой или не уложился в timeout
+    """
+    if timeout is None:
+        timeout = FFMPEG_TIMEOUT
+    command = [
+        AudioSegment.converter, "-hide_banner", "-loglevel", "error",
+        *input_args, "-i", "pipe:0", "-vn", *output_args, "pipe:1"
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    errors = []
+    threads = [
+        threading.Thread(target=_feed_stdin, args=(process, source), daemon=True),
+        threading.Thread(target=_read_stderr, args=(process, errors), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    # По истечении времени процесс убивается: каналы закрываются, и чтение ниже завершается
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    watchdog = threading.Timer(timeout, kill)
+    watchdog.daemon = True
+    if timeout > 0:
+        watchdog.start()
+
+    output = []
+    try:
+        chunk = process.stdout.read(64 * 1024)
+        while chunk:
+            if destination is not None:
+                destination.write(chunk)
+            else:
+                output.append(chunk)
+            chunk = process.stdout.read(64 * 1024)
+    except BaseException:
+        # Ошибка записи результата (например, нет места на диске) не должна оставлять ffmpeg работать
+        process.kill()
+        raise
+    finally:
+        process.wait()
+        watchdog.cancel()
+        for thread in threads:
+            thread.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    if timed_out.is_set():
+        raise RuntimeError(f"ffmpeg не завершился за {timeout:g} с и был остановлен")
+    if process.returncode != 0:
+        stderr = b"".join(errors).decode(errors='ignore')[-500:]
+        raise RuntimeError(f"ffmpeg завершился с кодом {process.returncode}: {stderr}")
+    if destination is not None:
+        destination.seek(0)
+        return destination
+    return b"".join(output)
+
+
+class PcmAudio:
+    """
+    Декодированное аудио (моно PCM 16 кГц) в AudioBuffer вместо AudioSegment в памяти.
+
+    Часовая запись — это ~115 МБ PCM, поэтому данные лежат в буфере, который после
+    порога AUDIO_SPOOL_MAX_BYTES переносится во временный файл, а в память читаются
+    только нужные участки. Срез возвращает такой же объект без копирования данных;
+    поддерживается та часть интерфейса AudioSegment, которая нужна обрезке тишины
+    и нарезке: len(), срезы, dBFS, raw_data, frame_rate и channels.
+    """
+
+    frame_rate = PCM_FRAME_RATE
+    channels = 1
+    sample_width = 2
+
+    def __init__(self, buffer, start_ms=0, end_ms=None, lock=None):
+        self._buffer = buffer
+        self._start = start_ms
+        self._end = buffer.size // PCM_BYTES_PER_MS if end_ms is None else end_ms
+        # Срезы читаются из разных потоков (кодирование фрагментов), а seek и read
+        # у буфера общие
+        self._lock = lock or threading.Lock()
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError("PcmAudio поддерживает только срезы в миллисекундах")
+        length = len(self)
+        start = min(max(item.start or 0, 0), length)
+        end = length if item.stop is None else min(max(item.stop, start), length)
+        return PcmAudio(self._buffer, self._start + start, self._start + end, self._lock)
+
+    def _read(self, start_ms, end_ms):
+        with self._lock:
+            self._buffer.seek(start_ms * PCM_BYTES_PER_MS)
+            return self._buffer.read((end_ms - start_ms) * PCM_BYTES_PER_MS)
+
+    @property
+    def raw_data(self):
+        """Байты PCM участка (копируются в память, поэтому только для коротких участков)"""
+        return self._read(self._start, self._end)
+
+    def iter_chunks(self, chunk_ms=4000):
+        """Отдает байты PCM участка кусками по chunk_ms (4 с — 128 КБ), не читая участок целиком"""
+        for start in range(self._start, self._end, chunk_ms):
+            yield self._read(start, min(start + chunk_ms, self._end))
+
+    def to_segment(self):
+        """Участок в виде AudioSegment в памяти"""
+        return AudioSegment(
+            data=self.raw_data, sample_width=self.sample_width, frame_rate=self.frame_rate, channels=self.channels
+        )
+
+    @property
+    def dBFS(self):
+        """Громкость участка; длинный участок читается кусками по 10 с"""
+        squares = 0.0
+        samples = 0
+        for start in range(self._start, self._end, 10000):
+            piece = AudioSegment(
+                data=self._read(start, min(start + 10000, self._end)),
+                sample_width=self.sample_width, frame_rate=self.frame_rate, channels=self.channels
+            )
+            count = int(piece.frame_count())
+            squares += piece.rms ** 2 * count
+            samples += count
+        if not squares:
+            return -float("infinity")
+        rms = math.sqrt(squares / samples)
+        return 20 * math.log10(rms / (2 ** (8 * self.sample_width - 1)))
+
+    def close(self):
+        self._buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_audio(audio_buffer):
+    """
+    Декодирует AudioBuffer в моно PCM 16 кГц
+
+    Результат пишется в AudioBuffer по мере декодирования, поэтому память на
+    задание ограничена AUDIO_SPOOL_MAX_BYTES независимо от длины записи.
+
+    :return: PcmAudio, который вызывающий код должен закрыть
+    """
+    buffer = AudioBuffer(filename="audio.pcm")
+    try:
+        run_ffmpeg(audio_buffer, PCM_ARGS, destination=buffer)
+        if buffer.size < PCM_BYTES_PER_MS:
+            raise RuntimeError("ffmpeg не вернул аудиоданных")
+    except Exception:
+        buffer.close()
+        raise
+    return PcmAudio(buffer)
+
+
+def trim_silence(segment, threshold_db=-50.0, keep_ms=200, step_ms=10):
+    """
+    Обрезает тишину в начале и в конце аудио
+
+    :param threshold_db: уровень, ниже которого звук считается тишиной
+    :param keep_ms: сколько тишины оставить по краям, чтобы не срезать начало слов
+    """
+    start = detect_leading_silence(segment, silence_threshold=threshold_db, chunk_size=step_ms)
+    # Конец сканируем с хвоста, не разворачивая весь сегмент в памяти
+    end = len(segment)
+    while end - step_ms > start and segment[end - step_ms:end].dBFS < threshold_db:
+        end -= step_ms
+    if start >= end:
+        return segment
+    return segment[max(0, start - keep_ms):min(len(segment), end + keep_ms)]
+
+
+def _in_memory(segment):
+    """Поиск пауз pydub работает только с AudioSegment: окно поиска читается в память"""
+    return segment.to_segment() if isinstance(segment, PcmAudio) else segment
+
+
+def find_split_points(segment, target_ms, max_ms, min_silence_ms=400, search_window_ms=None):
+    """
+    Подбирает точки разреза аудио по паузам
+
+    Для каждого фрагмента ищем паузу ближе всего к target_ms от его начала,
+    но не дальше max_ms. Тишину ищем только в окне вокруг цели, а не по всему
+    файлу, чтобы не сканировать часовые записи целиком.
+
+    :return: список кортежей (начало, конец, разрез_по_паузе) в миллисекундах
+    """
+    if search_window_ms is None:
+        search_window_ms = max_ms - target_ms
+    # Громкость всего файла считается один раз: для PcmAudio это полный проход по буферу
+    loudness = segment.dBFS
+    silence_thresh = (loudness if loudness != float("-inf") else -60) - 16
+
+    points = []
+    start = 0
+    total = len(segment)
+    while total - start > max_ms:
+        window_start = max(start + 1, start + target_ms - search_window_ms)
+        window_end = start + max_ms
+        silences = detect_silence(
+            _in_memory(segment[window_start:window_end]),
+            min_silence_len=min_silence_ms,
+            silence_thresh=silence_thresh,
+            seek_step=10
+        )
+        if silences:
+            # Режем по середине паузы, ближайшей к целевой длине
+            target = start + target_ms
+            middles = [window_start + (s + e) // 2 for s, e in silences]
+            cut = min(middles, key=lambda m: abs(m - target))
+            points.append((start, cut, True))
+        else:
+            cut = window_end
+            points.append((start, cut, False))
+        start = cut
+    points.append((start, total, True))
+    return points
+
+
+def split_audio(segment, target_ms, max_ms, overlap_ms=1000, min_silence_ms=400):
+    """
+    Делит AudioSegment или PcmAudio на фрагменты по паузам
+
+    Если подходящей паузы нет, фрагмент режется жестко и захватывает
+    overlap_ms следующего фрагмента, чтобы слово на стыке не потерялось;
+    повторы на стыке потом убирает remove_overlap.
+
+    :return: список кортежей (срез segment, перекрывается_с_предыдущим) в порядке следования
+    """
+    chunks = []
+    overlapped = False
+    for start, end, at_silence in find_split_points(segment, target_ms, max_ms, min_silence_ms):
+        if not at_silence:
+            end = min(len(segment), end + overlap_ms)
+        chunks.append((segment[start:end], overlapped))
+        overlapped = not at_silence
+    return chunks
+
+
+def export_audio(segment, filename, bitrate="32k"):
+    """
+    Кодирует AudioSegment или PcmAudio в Opus/OGG и возвращает новый AudioBuffer
+
+    PcmAudio подается в ffmpeg кусками из своего буфера, поэтому участок любой
+    длины не копируется в память целиком. Как и при извлечении звука из видео,
+    режим voip и сложность 3 ускоряют кодирование в 2–3 раза при том же размере.
+    """
+    input_args = ["-f", "s16le", "-ar", str(segment.frame_rate), "-ac", str(segment.channels)]
+    source = segment if isinstance(segment, PcmAudio) else segment.raw_data
+    buffer = AudioBuffer(filename=filename)
+    try:
+        return run_ffmpeg(
+            source,
+            ["-c:a", "libopus", "-b:a", bitrate, "-application", "voip", "-compression_level", "3", "-f", "ogg"],
+            input_args=input_args,
+            destination=buffer
+        )
+    except Exception:
+        buffer.close()
+        raise
+
+
+def _normalize_word(word):
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def remove_overlap(previous_text, text, max_overlap_words=12):
+    """
+    Убирает из начала расшифровки фрагмента слова, повторяющие конец предыдущего
+
+    Вызывается только для фрагментов, перекрывающихся с предыдущим (жесткий
+    разрез без паузы), чтобы не удалить настоящие повторы слов на стыках по паузам.
+
+    :param previous_text: расшифровка предыдущего фрагмента
+    :param text: расшифровка текущего фрагмента
+    :param max_overlap_words: максимальная длина повтора на стыке в словах
+    """
+    previous_words = previous_text.split()
+    words = text.split()
+    if not previous_words or not words:
+        return text
+    tail = [_normalize_word(w) for w in previous_words[-max_overlap_words:]]
+    head = [_normalize_word(w) for w in words[:max_overlap_words]]
+    for size in range(min(len(tail), len(head)), 0, -1):
+        if tail[-size:] == head[:size] and any(tail[-size:]):
+            logging.debug(f"Удален повтор на стыке фрагментов: {' '.join(words[:size])}")
+            return " ".join(words[size:])
+    return text
@@ -0,0 +1,110 @@
+import logging
+import httpx
+from config import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_WRITE_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+    HTTP2_ENABLED,
+)
+
+
+def _http2_available():
+    """Проверяет, установлен ли пакет h2, необходимый httpx для HTTP/2"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HttpTransport:
+    """Общий пул HTTP-соединений для всех API распознавания речи"""
+
+    def __init__(self):
+        """Создает общий httpx.AsyncClient с настроенными лимитами пула и таймаутами"""
+        self.limits = httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+        # Отдельные таймауты на каждую фазу запроса: подключение, отправку файла и ожидание ответа
+        self.timeout = httpx.Timeout(
+            connect=HTTP_CONNECT_TIMEOUT,
+            write=HTTP_WRITE_TIMEOUT,
+            read=HTTP_READ_TIMEOUT,
+            pool=HTTP_POOL_TIMEOUT,
+        )
+
+        self.http2 = HTTP2_ENABLED
+        if self.http2 and not _http2_available():
+            logging.warning("Пакет h2 не установлен, HTTP/2 отключен (установите httpx[http2])")
+            self.http2 = False
+
+        self.requests_total = 0
+        self.responses_total = 0
+        self.responses_by_status = {}
+
+        self.client = httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+        logging.info(
+            f"HTTP-пул создан: max_connections={HTTP_MAX_CONNECTIONS}, "
+            f"keepalive={HTTP_MAX_KEEPALIVE_CONNECTIONS}, http2={self.http2}"
+        )
+
+    async def _on_request(self, request):
+        """Считает отправленные запросы"""
+        self.requests_total += 1
+
+    async def _on_response(self, response):
+        """Считает полученные ответы по классам статусов (2xx, 4xx, ...)"""
+        self.responses_total += 1
+        status_class = f"{response.status_code // 100}xx"
+        self.responses_by_status[status_class] = self.responses_by_status.get(status_class, 0) + 1
+
+    def stats(self):
+        """
+        Возвращает статистику пула соединений
+
+        :return: словарь с числом открытых, занятых и простаивающих соединений,
+                 количеством ожидающих запросов и счетчиками запросов/ответов
+        """
+        connections = []
+        pending = 0
+        # httpx не предоставляет публичного API для пула, поэтому читаем состояние httpcore
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        if pool is not None:
+            connections = list(getattr(pool, "connections", []))
+            pending = sum(1 for r in getattr(pool, "_requests", []) if r.is_queued())
+
+        http2_connections = 0
+        for connection in connections:
+            info = connection.info()
+            if "HTTP/2" in info:
+                http2_connections += 1
+
+        return {
+            "connections": len(connections),
+            "active": sum(1 for c in connections if not c.is_idle()),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "http2_connections": http2_connections,
+            "pending_requests": pending,
+            "max_connections": HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "requests_total": self.requests_total,
+            "responses_total": self.responses_total,
+            "responses_by_status": dict(self.responses_by_status),
+        }
+
+    async def aclose(self):
+        """Закрывает все соединения пула"""
+        if not self.client.is_closed:
+            await self.client.aclose()
+            logging.info("HTTP-пул закрыт")
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from config import (
+    JOB_MAX_CONCURRENT,
+    JOB_MAX_PER_CHAT,
+    JOB_MAX_QUEUE,
+    JOB_MAX_QUEUE_PER_CHAT,
+)
+from utils.metrics import STAGE_SECONDS, IN_FLIGHT, ERRORS
+
+
+class QueueFullError(Exception):
+    """Очередь заданий переполнена, задание не принято"""
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class Job:
+    """Задание на распознавание в очереди"""
+
+    def __init__(self, chat_id, func):
+        self.chat_id = chat_id
+        self.func = func
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.task = None
+
+    @property
+    def started(self):
+        return self.started_at is not None
+
+    def __await__(self):
+        return self.future.__await__()
+
+
+class TranscriptionScheduler:
+    """
+    Очередь заданий на распознавание со справедливым планированием по чатам.
+
+    Ограничивает число одновременно выполняемых заданий глобально и на один чат,
+    а чаты обслуживаются по кругу: сотня пересланных одним пользователем голосовых
+    не задерживает сообщения из других чатов. Когда очередь заполнена, новые
+    задания сразу отклоняются с QueueFullError.
+    """
+
+    def __init__(
+        self,
+        max_concurrent=JOB_MAX_CONCURRENT,
+        max_per_chat=JOB_MAX_PER_CHAT,
+        max_queue=JOB_MAX_QUEUE,
+        max_queue_per_chat=JOB_MAX_QUEUE_PER_CHAT,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_chat = max(1, max_per_chat)
+        self.max_queue = max_queue
+        self.max_queue_per_chat = max_queue_per_chat
+
+        # chat_id -> очередь ожидающих заданий
+        self._queues = {}
+        # Чаты с ожидающими заданиями в порядке обслуживания по кругу
+        self._order = deque()
+        # chat_id -> число выполняемых заданий
+        self._running = {}
+        self._running_total = 0
+        self.queued = 0
+        # Выполняемые задачи: без сильной ссылки цикл событий может собрать задачу сборщиком мусора
+        self._tasks = set()
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        # Время ожидания в очереди и время выполнения последних заданий
+        self.wait_times = deque(maxlen=1000)
+        self.service_times = deque(maxlen=1000)
+
+    def submit(self, chat_id, func):
+        """
+        Ставит задание в очередь
+
+        :param chat_id: идентификатор чата, по которому распределяется очередь
+        :param func: корутинная функция без аргументов, выполняющая работу
+        :return: Job; его можно ожидать через await, чтобы получить результат func
+        :raises QueueFullError: если превышена глобальная очередь или очередь чата
+        """
+        chat_queue = self._queues.get(chat_id)
+        if self.queued >= self.max_queue or (chat_queue and len(chat_queue) >= self.max_queue_per_chat):
+            self.rejected += 1
+            ERRORS.inc(stage="queue", reason="queue_full")
+            logging.warning(f"Очередь переполнена, задание из чата {chat_id} отклонено (в очереди: {self.queued})")
+            raise QueueFullError("Очередь заданий переполнена")
+
+        job = Job(chat_id, func)
+        if chat_queue is None:
+            chat_queue = self._queues[chat_id] = deque()
+            self._order.append(chat_id)
+        chat_queue.append(job)
+        self.queued += 1
+        # Отмена ожидания результата (например, задача обработчика отменена) снимает задание
+        job.future.add_done_callback(lambda future: self._on_future_done(job))
+        self._pump()
+        return job
+
+    def _on_future_done(self, job):
+        """Убирает отмененное задание из очереди или отменяет его выполнение"""
+        if not job.future.cancelled():
+            return
+        if job.task is not None:
+            job.task.cancel()
+            return
+        chat_queue = self._queues.get(job.chat_id)
+        if chat_queue and job in chat_queue:
+            chat_queue.remove(job)
+            self._drop(job, chat_queue)
+            self.cancelled += 1
+
+    def _drop(self, job, chat_queue):
+        """Учитывает снятие задания из очереди чата"""
+        if not chat_queue:
+            del self._queues[job.chat_id]
+            self._order.remove(job.chat_id)
+        self.queued -= 1
+
+    def position(self, job):
+        """
+        Оценивает позицию задания в очереди с учетом обслуживания чатов по кругу
+
+        :return: 0 для выполняемого задания, иначе примерное число заданий до него плюс один
+        """
+        if job.started:
+            return 0
+        chat_queue = self._queues.get(job.chat_id, ())
+        index = chat_queue.index(job) if job in chat_queue else 0
+        ahead = index + sum(
+            min(len(queue), index + 1)
+            for chat_id, queue in self._queues.items()
+            if chat_id != job.chat_id
+        )
+        return ahead + 1
+
+    def _pump(self):
+        """Запускает ожидающие задания, пока есть свободные слоты"""
+        while self._running_total < self.max_concurrent and self._order:
+            for _ in range(len(self._order)):
+                chat_id = self._order[0]
+                self._order.rotate(-1)
+                if self._running.get(chat_id, 0) < self.max_per_chat:
+                    break
+            else:
+                # У всех чатов с ожидающими заданиями занят лимит на чат
+                return
+
+            chat_queue = self._queues[chat_id]
+            job = chat_queue.popleft()
+            self._drop(job, chat_queue)
+            if job.future.cancelled():
+                # Отменено до того, как сработал обратный вызов будущего
+                self.cancelled += 1
+                continue
+            self._start(job)
+
+    def _start(self, job):
+        job.started_at = time.monotonic()
+        self.wait_times.append(job.started_at - job.enqueued_at)
+        STAGE_SECONDS.observe(job.started_at - job.enqueued_at, stage="queue_wait")
+        IN_FLIGHT.inc(kind="jobs")
+        self._running[job.chat_id] = self._running.get(job.chat_id, 0) + 1
+        self._running_total += 1
+        job.task = asyncio.create_task(self._execute(job))
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job):
+        try:
+            result = await job.func()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.service_times.append(time.monotonic() - job.started_at)
+            STAGE_SECONDS.observe(self.service_times[-1], stage="job_service")
+            IN_FLIGHT.dec(kind="jobs")
+            self._running[job.chat_id] -= 1
+            if not self._running[job.chat_id]:
+                del self._running[job.chat_id]
+            self._running_total -= 1
+            self._pump()
+
+    def stats(self):
+        """Возвращает размер очереди и время ожидания и выполнения (p50/p95, в секундах)"""
+        return {
+            "queued": self.queued,
+            "running": self._running_total,
+            "chats_waiting": len(self._queues),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "wait_p50": _percentile(self.wait_times, 50),
+            "wait_p95": _percentile(self.wait_times, 95),
+            "service_p50": _percentile(self.service_times, 50),
+            "service_p95": _percentile(self.service_times, 95),
+        }
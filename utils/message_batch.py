@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from config import BATCH_WINDOW, BATCH_MAX_MESSAGES
+from utils.metrics import BATCH_SIZE
+
+
+class BatchItem:
+    """Сообщение в пакете: части расшифровки по мере готовности и итоговый текст"""
+
+    def __init__(self, message):
+        self.message = message
+        self.pieces = []
+        # Итоговый текст (расшифровка или сообщение об ошибке); None, пока обработка идет
+        self.text = None
+        self.task = None
+        # True, когда итоговый текст попал в ответ
+        self.delivered = False
+
+    @property
+    def done(self):
+        return self.text is not None
+
+
+class MessageBatch:
+    """Голосовые и аудио одного чата, на которые отправляется общий ответ"""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.items = []
+        self.closed = False
+        self.last_arrival = time.monotonic()
+        # Сообщение о ходе обработки, общее для пакета
+        self.status = None
+        self._changed = asyncio.Event()
+
+    def add(self, item):
+        # Обновления могут прийти не по порядку: держим сообщения упорядоченными по message_id
+        index = len(self.items)
+        while index > 0 and self.items[index - 1].message.message_id > item.message.message_id:
+            index -= 1
+        self.items.insert(index, item)
+        self.last_arrival = time.monotonic()
+        self.notify()
+
+    def notify(self):
+        """Сообщает владельцу пакета, что появилось новое сообщение или часть расшифровки"""
+        self._changed.set()
+
+    async def wait_changed(self, timeout=None):
+        """Ждет изменений в пакете не дольше timeout секунд"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._changed.clear()
+
+    @property
+    def done(self):
+        return all(item.done for item in self.items)
+
+
+class MessageCoalescer:
+    """
+    Объединяет голосовые и аудио одного чата, пришедшие подряд, в пакет с общим ответом.
+
+    Сообщение присоединяется к открытому пакету чата, если пришло не позже чем через
+    BATCH_WINDOW секунд после предыдущего (пересланная пачка приходит почти разом).
+    Первое сообщение пакета становится его владельцем: отправляет одно сообщение
+    о ходе обработки и один ответ, в который по порядку собираются расшифровки.
+    Пакет закрывается, когда все его сообщения обработаны и окно истекло.
+    """
+
+    def __init__(self, window=BATCH_WINDOW, max_messages=BATCH_MAX_MESSAGES):
+        self.window = window
+        self.max_messages = max(1, max_messages)
+        self._open = {}
+        self._delivered_callbacks = []
+
+    def join(self, chat_id, item):
+        """
+        Добавляет сообщение в открытый пакет чата или открывает новый
+
+        :return: кортеж (пакет, True если вызывающий код — владелец нового пакета)
+        """
+        batch = self._open.get(chat_id)
+        owner = (
+            batch is None
+            or batch.closed
+            or len(batch.items) >= self.max_messages
+            or time.monotonic() - batch.last_arrival > self.window
+        )
+        if owner:
+            batch = MessageBatch(chat_id)
+            self._open[chat_id] = batch
+        elif len(batch.items) == 1:
+            logging.info(f"Сообщения чата {chat_id} объединяются в общий ответ")
+        batch.add(item)
+        return batch, owner
+
+    def window_remaining(self, batch):
+        """Сколько секунд пакет еще принимает новые сообщения"""
+        return batch.last_arrival + self.window - time.monotonic()
+
+    def close(self, batch):
+        """Закрывает пакет: следующие сообщения чата откроют новый"""
+        if batch.closed:
+            return
+        batch.closed = True
+        if self._open.get(batch.chat_id) is batch:
+            del self._open[batch.chat_id]
+        BATCH_SIZE.observe(len(batch.items))
+
+    def on_delivered(self, callback):
+        """Регистрирует функцию, вызываемую с сообщением, когда его расшифровка попала в ответ"""
+        self._delivered_callbacks.append(callback)
+
+    def delivered(self, item):
+        for callback in self._delivered_callbacks:
+            callback(item.message)
+
+    def stats(self):
+        return {"open_batches": len(self._open)}
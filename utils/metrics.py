@@ -0,0 +1,213 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from aiohttp import web
+
+# Границы корзин гистограмм задержек в секундах: от обращений к Telegram до распознавания часовых записей
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None, constant=None):
+    pairs = [constant] if constant else []
+    pairs += [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Базовый класс метрики с метками; значения хранятся по кортежу значений меток"""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self, constant=None):
+        """
+        :param constant: общие для всех значений метки в готовом виде (например, worker="1")
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key, constant=constant)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и уменьшаться"""
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Увеличивает значение на время выполнения блока (для счетчиков «в работе»)"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Гистограмма с накопительными корзинами, суммой и числом наблюдений"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [счетчики по корзинам + корзина +Inf, сумма, количество]
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self, constant=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le, constant)} {cumulative}")
+            labels = _format_labels(self.labelnames, key, constant=constant)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик, отдаваемых в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collect_callbacks = []
+        self._constant = None
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def on_collect(self, callback):
+        """Регистрирует функцию, обновляющую метрики-снимки (размер кэша, пула и т.п.) перед выдачей"""
+        self._collect_callbacks.append(callback)
+
+    def set_constant_labels(self, **labels):
+        """
+        Задает метки, добавляемые ко всем значениям (например, номер процесса-обработчика,
+        чтобы значения разных процессов не смешивались в Prometheus)
+        """
+        self._constant = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) or None
+
+    def render(self):
+        for callback in self._collect_callbacks:
+            callback()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(self._constant))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Длительность этапов конвейера: обращения к Telegram, хэширование, декодирование,
+# предобработка, ожидание в очереди, отправка ответа и т.д.
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "stt_stage_seconds", "Длительность этапов конвейера распознавания", ["stage"]
+))
+PROVIDER_SECONDS = REGISTRY.register(Histogram(
+    "stt_provider_request_seconds", "Длительность запросов к провайдерам распознавания", ["provider", "outcome"]
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "stt_in_flight", "Число выполняемых операций", ["kind"]
+))
+BYTES = REGISTRY.register(Counter(
+    "stt_bytes_total", "Объем обработанного аудио в байтах", ["direction"]
+))
+FALLBACKS = REGISTRY.register(Counter(
+    "stt_fallbacks_total", "Переключения на резервного провайдера", ["provider", "reason"]
+))
+ERRORS = REGISTRY.register(Counter(
+    "stt_errors_total", "Ошибки конвейера распознавания", ["stage", "reason"]
+))
+THROTTLES = REGISTRY.register(Counter(
+    "stt_throttle_events_total",
+    "События клиентских лимитов провайдеров: ожидание, отказ, ответ 429, повтор",
+    ["provider", "event"],
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "stt_batch_messages", "Число сообщений в пакете с общим ответом", buckets=(1, 2, 3, 5, 10, 20, 50)
+))
+SNAPSHOT = REGISTRY.register(Gauge(
+    "stt_component_state", "Снимок состояния компонентов (кэш, пул, очередь, провайдеры)", ["component", "field"]
+))
+
+
+def set_snapshot(component, stats):
+    """Переносит числовые поля словаря статистики в метрику stt_component_state"""
+    for field, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            SNAPSHOT.set(value, component=component, field=field)
+
+
+def error_reason(error):
+    """Короткая причина ошибки для метки: HTTP-статус или имя класса исключения"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return f"http_{status_code}" if status_code else type(error).__name__
+
+
+async def metrics_handler(request):
+    """Обработчик aiohttp для маршрута /metrics"""
+    return web.Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import deque
+from config import (
+    ROUTER_WEIGHTS,
+    ROUTER_WINDOW_SIZE,
+    ROUTER_MIN_SAMPLES,
+    ROUTER_ERROR_THRESHOLD,
+    ROUTER_CONSECUTIVE_FAILURES,
+    ROUTER_OPEN_SECONDS,
+    ROUTER_HEDGING,
+    ROUTER_HEDGE_MIN_SAMPLES,
+    ROUTER_HEDGE_MIN_DELAY,
+    ROUTER_SYNC_INTERVAL,
+)
+
+# Состояния автоматического выключателя
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# Канал общего хранилища с результатами запросов к провайдерам
+HEALTH_CHANNEL = "provider_health"
+# За сколько последних секунд новый процесс загружает историю запросов при запуске
+HEALTH_HISTORY_SECONDS = 300
+
+
+def parse_weights(value):
+    """Разбирает строку вида "whisper:1,elevenlabs:0" в словарь весов"""
+    weights = {}
+    for item in value.split(","):
+        if ":" not in item:
+            continue
+        name, weight = item.split(":", 1)
+        try:
+            weights[name.strip()] = max(0.0, float(weight))
+        except ValueError:
+            logging.warning(f"Некорректный вес провайдера: {item}")
+    return weights
+
+
+class ProviderHealth:
+    """Скользящая статистика задержек и ошибок провайдера с автоматическим выключателем"""
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        # (успех, задержка в секундах, длительность аудио в секундах или None) последних запросов
+        self.samples = deque(maxlen=ROUTER_WINDOW_SIZE)
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        # Кто занял единственный пробный запрос полуоткрытого выключателя (None — свободен)
+        self.probe_owner = None
+
+    @staticmethod
+    def _percentile(values, percentile):
+        values = sorted(values)
+        if not values:
+            return None
+        index = min(len(values) - 1, int(len(values) * percentile / 100))
+        return values[index]
+
+    def latency_percentile(self, percentile):
+        """Возвращает перцентиль задержки успешных запросов или None, если данных нет"""
+        return self._percentile((latency for success, latency, _ in self.samples if success), percentile)
+
+    def latency_per_second_percentile(self, percentile):
+        """
+        Возвращает перцентиль задержки на секунду аудио среди успешных запросов
+        с известной длительностью или None, если таких запросов меньше ROUTER_HEDGE_MIN_SAMPLES
+        """
+        rates = [latency / seconds for success, latency, seconds in self.samples if success and seconds]
+        if len(rates) < ROUTER_HEDGE_MIN_SAMPLES:
+            return None
+        return self._percentile(rates, percentile)
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for success, _, _ in self.samples if not success) / len(self.samples)
+
+    def available(self, now):
+        """
+        Проверяет, можно ли отправить запрос провайдеру
+
+        Открытый выключатель через ROUTER_OPEN_SECONDS переходит в полуоткрытое
+        состояние и пропускает один пробный запрос, пока тот не занят.
+        """
+        if self.state == STATE_OPEN and now - self.opened_at >= ROUTER_OPEN_SECONDS:
+            self.state = STATE_HALF_OPEN
+            self.probe_owner = None
+            logging.info(f"Провайдер {self.name}: пробуем восстановить (half-open)")
+        if self.state == STATE_HALF_OPEN:
+            return self.probe_owner is None
+        return self.state == STATE_CLOSED
+
+    def record(self, success, latency, now, seconds=None):
+        self.samples.append((success, latency, seconds))
+        if success:
+            self.consecutive_failures = 0
+            if self.state != STATE_CLOSED:
+                logging.info(f"Провайдер {self.name} снова доступен")
+            self.state = STATE_CLOSED
+            self.probe_owner = None
+            return
+
+        self.consecutive_failures += 1
+        too_many_errors = len(self.samples) >= ROUTER_MIN_SAMPLES and self.error_rate() >= ROUTER_ERROR_THRESHOLD
+        if self.state == STATE_HALF_OPEN or too_many_errors or self.consecutive_failures >= ROUTER_CONSECUTIVE_FAILURES:
+            if self.state != STATE_OPEN:
+                logging.warning(
+                    f"Провайдер {self.name} временно отключен на {ROUTER_OPEN_SECONDS} с "
+                    f"(ошибок: {self.error_rate():.0%}, подряд: {self.consecutive_failures})"
+                )
+            self.state = STATE_OPEN
+            self.opened_at = now
+            self.probe_owner = None
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "weight": self.weight,
+            "samples": len(self.samples),
+            "error_rate": self.error_rate(),
+            "p50": self.latency_percentile(50),
+            "p95": self.latency_percentile(95),
+        }
+
+
+class ProviderRouter:
+    """
+    Выбирает провайдера распознавания по весам и состоянию здоровья.
+
+    Провайдеры с отключенным выключателем пропускаются, провайдеры с нулевым
+    весом используются только как резервные. С общим хранилищем процессы
+    обмениваются результатами запросов, поэтому отказ провайдера, замеченный
+    одним процессом, учитывается всеми.
+    """
+
+    def __init__(self, providers, weights=None, state=None):
+        """
+        :param providers: имена доступных провайдеров (для которых настроены ключи)
+        :param weights: веса провайдеров; по умолчанию берутся из ROUTER_WEIGHTS
+        :param state: хранилище общего состояния (SharedState) для обмена статистикой между процессами
+        """
+        if weights is None:
+            weights = parse_weights(ROUTER_WEIGHTS)
+        self.health = {name: ProviderHealth(name, weights.get(name, 1.0)) for name in providers}
+
+        self.state = state if state is not None and state.shared else None
+        self._worker_id = uuid.uuid4().hex
+        # Результаты своих запросов, еще не опубликованные в общем хранилище
+        self._pending = []
+        self._last_event_id = 0
+        self._sync_task = None
+
+    def preferred(self):
+        """Провайдер с наибольшим весом среди доступных (без случайности)"""
+        available = [h for h in self.health.values() if h.state != STATE_OPEN]
+        if not available:
+            available = list(self.health.values())
+        return max(available, key=lambda h: h.weight).name
+
+    def candidates(self, owner=None):
+        """
+        Возвращает провайдеров в порядке попыток
+
+        Первый выбирается случайно пропорционально весу среди доступных,
+        остальные доступные идут следом по убыванию веса. Пробный запрос
+        полуоткрытого провайдера занимается здесь же, при выборе, поэтому
+        одновременные вызовы не пробуют восстанавливающегося провайдера разом;
+        неиспользованные пробы вызывающий код возвращает через release_probes.
+
+        :param owner: объект, от имени которого занимаются пробные запросы
+        """
+        if owner is None:
+            owner = object()
+        now = time.monotonic()
+        available = [h for h in self.health.values() if h.available(now)]
+        if not available:
+            return []
+        for health in available:
+            if health.state == STATE_HALF_OPEN:
+                health.probe_owner = owner
+
+        weighted = [h for h in available if h.weight > 0]
+        if weighted:
+            primary = random.choices(weighted, weights=[h.weight for h in weighted])[0]
+        else:
+            primary = available[0]
+        rest = sorted((h for h in available if h is not primary), key=lambda h: h.weight, reverse=True)
+        return [h.name for h in [primary] + rest]
+
+    def release(self, name, owner):
+        """
+        Отмечает запрос, завершившийся без результата для статистики (отменен, 429, ошибка в запросе)
+
+        Пробу провайдера освобождает только ее владелец: запрос, начатый до
+        перехода в полуоткрытое состояние, не должен снимать чужую пробу.
+
+        :param owner: объект, переданный в candidates при выборе провайдера
+        """
+        health = self.health[name]
+        if health.probe_owner is owner:
+            health.probe_owner = None
+
+    def release_probes(self, owner):
+        """Освобождает пробные запросы, занятые owner в candidates, но так и не отправленные"""
+        for health in self.health.values():
+            if health.probe_owner is owner:
+                health.probe_owner = None
+
+    def record(self, name, success, latency, seconds=None):
+        """:param seconds: длительность распознанного аудио, если известна"""
+        self.health[name].record(success, latency, time.monotonic(), seconds)
+        if self.state is not None:
+            self._pending.append((name, success, latency, seconds))
+
+    def _exchange(self, samples, after_id, since):
+        if samples:
+            self.state.publish(HEALTH_CHANNEL, {"worker": self._worker_id, "samples": samples})
+        return self.state.fetch(HEALTH_CHANNEL, after_id, since)
+
+    async def sync(self):
+        """Публикует результаты своих запросов и применяет результаты других процессов"""
+        if self.state is None:
+            return
+        samples, self._pending = self._pending, []
+        # При первом обмене подхватываем недавнюю историю, в том числе до перезапуска
+        since = None if self._last_event_id else time.time() - HEALTH_HISTORY_SECONDS
+        events = await asyncio.to_thread(self._exchange, samples, self._last_event_id, since)
+        now = time.monotonic()
+        for event_id, payload in events:
+            self._last_event_id = event_id
+            if payload.get("worker") == self._worker_id:
+                continue
+            # Процессы прежней версии публикуют результаты без длительности аудио
+            for name, success, latency, *seconds in payload.get("samples", []):
+                if name in self.health:
+                    self.health[name].record(success, latency, now, *seconds[:1])
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(ROUTER_SYNC_INTERVAL)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.error(f"Ошибка обмена статистикой провайдеров: {e}")
+
+    def start_sync(self):
+        """Запускает периодический обмен статистикой, если настроено общее хранилище"""
+        if self.state is not None and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop_sync(self):
+        """Останавливает обмен и публикует оставшиеся результаты"""
+        if self._sync_task is None:
+            return
+        self._sync_task.cancel()
+        await asyncio.gather(self._sync_task, return_exceptions=True)
+        self._sync_task = None
+        try:
+            await self.sync()
+        except Exception as e:
+            logging.error(f"Ошибка обмена статистикой провайдеров: {e}")
+
+    def hedge_delay(self, name, seconds=None):
+        """
+        Возвращает задержку, после которой стоит продублировать запрос другому провайдеру
+
+        Время распознавания растет с длительностью аудио, поэтому порог — p95 задержки
+        на секунду аудио, умноженный на длительность: иначе длинные фрагменты,
+        нормально идущие дольше коротких голосовых, дублировались бы почти всегда.
+
+        :param seconds: длительность аудио; если неизвестна, берется p95 задержки запроса
+        :return: задержка в секундах или None, если дублирование выключено или данных мало
+        """
+        if not ROUTER_HEDGING:
+            return None
+        health = self.health[name]
+        if seconds:
+            rate = health.latency_per_second_percentile(95)
+            if rate is None:
+                return None
+            return max(ROUTER_HEDGE_MIN_DELAY, rate * seconds)
+        successes = sum(1 for success, _, _ in health.samples if success)
+        if successes < ROUTER_HEDGE_MIN_SAMPLES:
+            return None
+        return max(ROUTER_HEDGE_MIN_DELAY, health.latency_percentile(95))
+
+    def stats(self):
+        return {name: health.stats() for name, health in self.health.items()}
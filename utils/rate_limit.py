@@ -0,0 +1,365 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+from config import (
+    RATE_LIMIT_REQUESTS_PER_MINUTE,
+    RATE_LIMIT_AUDIO_SECONDS_PER_MINUTE,
+    RATE_LIMIT_BUDGET,
+    RATE_LIMIT_RETRIES,
+    RATE_LIMIT_BACKOFF,
+    RATE_LIMIT_RECOVERY_SECONDS,
+    WEB_WORKERS,
+)
+from utils.provider_router import parse_weights
+from utils.metrics import STAGE_SECONDS, THROTTLES
+
+# Измерения лимитов: число запросов и секунды аудио в минуту
+DIMENSION_REQUESTS = "requests"
+DIMENSION_AUDIO_SECONDS = "audio_seconds"
+# Нижняя граница выученной частоты (в минуту), чтобы провайдер не «замерзал» совсем
+MIN_RATE = {DIMENSION_REQUESTS: 1.0, DIMENSION_AUDIO_SECONDS: 60.0}
+
+# После 429 допустимая частота умножается на DECREASE_FACTOR (не ниже MIN_FACTOR),
+# после каждого успешного запроса восстанавливается на RECOVERY_STEP
+DECREASE_FACTOR = 0.7
+RECOVERY_STEP = 0.05
+MIN_FACTOR = 0.1
+# Несколько 429 на одновременные запросы снижают частоту один раз
+DECREASE_INTERVAL = 1.0
+# Какую часть минутного лимита можно израсходовать разом (в секундах лимита)
+BURST_SECONDS = 10
+
+
+class ProviderThrottled(Exception):
+    """Запрос не допущен к провайдеру: ожидание лимита не укладывается в бюджет"""
+
+    def __init__(self, provider, wait):
+        super().__init__(f"Лимит запросов к {provider}: ожидание {wait:.1f} с превышает бюджет")
+        self.provider = provider
+        self.wait = wait
+
+
+def parse_retry_after(headers):
+    """
+    Разбирает заголовки retry-after-ms и Retry-After (секунды или HTTP-дата)
+
+    :return: пауза в секундах или None, если заголовка нет
+    """
+    if not headers:
+        return None
+    # Заголовки SDK бывают и словарем, и httpx.Headers: приводим имена к нижнему регистру
+    headers = {str(name).lower(): value for name, value in headers.items()}
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class TokenBucket:
+    """
+    Корзина токенов с резервированием
+
+    Запрос сразу забирает токены, даже если их не хватает (уходя в долг), и получает
+    время ожидания: так ждущие запросы выстраиваются в очередь по порядку обращения.
+    """
+
+    def __init__(self, per_minute, now):
+        self.updated = now
+        self._apply_rate(per_minute)
+        self.tokens = self.capacity
+
+    def _apply_rate(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+
+    def set_rate(self, per_minute, now):
+        self._refill(now)
+        self._apply_rate(per_minute)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """
+        Забирает amount токенов
+
+        :return: через сколько секунд можно отправить запрос
+        """
+        self._refill(now)
+        # Запрос больше корзины пропускается, когда она заполнена целиком
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount, now):
+        """Возвращает токены запроса, который так и не был отправлен"""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+    def drain(self):
+        """Обнуляет запас: после 429 следующие запросы идут только с новой частотой"""
+        self.tokens = min(self.tokens, 0.0)
+
+
+class ProviderLimiter:
+    """Лимиты одного провайдера: заданные в настройках и выученные по ответам 429"""
+
+    def __init__(self, name, limits, now):
+        self.name = name
+        # Измерение -> лимит в минуту из настроек (None — без ограничения)
+        self.limits = limits
+        # Измерение -> частота в минуту, при которой провайдер ответил 429
+        self.learned = {}
+        self.factor = 1.0
+        self.blocked_until = 0.0
+        self.last_rate_limited = None
+        # (время отправки, секунды аудио) запросов за последнюю минуту
+        self.recent = deque()
+        self.buckets = {}
+        self.counters = {"admitted": 0, "delayed": 0, "rejected": 0, "rate_limited": 0, "retries": 0}
+        self._update_buckets(now)
+
+    def ceiling(self, dimension):
+        """Наименьший из заданного и выученного лимитов или None"""
+        values = [value for value in (self.limits.get(dimension), self.learned.get(dimension)) if value]
+        return min(values) if values else None
+
+    def effective_rate(self, dimension):
+        """Текущая допустимая частота в минуту с учетом снижения после 429 или None"""
+        ceiling = self.ceiling(dimension)
+        if ceiling is None:
+            return None
+        return max(ceiling * self.factor, MIN_RATE[dimension])
+
+    def _update_buckets(self, now):
+        for dimension in (DIMENSION_REQUESTS, DIMENSION_AUDIO_SECONDS):
+            rate = self.effective_rate(dimension)
+            if rate is None:
+                self.buckets.pop(dimension, None)
+            elif dimension in self.buckets:
+                self.buckets[dimension].set_rate(rate, now)
+            else:
+                self.buckets[dimension] = TokenBucket(rate, now)
+
+    def _trim_recent(self, now):
+        while self.recent and now - self.recent[0][0] > 60:
+            self.recent.popleft()
+
+    def reserve(self, amounts, now):
+        """
+        Резервирует запрос во всех корзинах
+
+        :return: ожидание в секундах (без учета паузы после 429)
+        """
+        wait = 0.0
+        for dimension, bucket in self.buckets.items():
+            wait = max(wait, bucket.reserve(amounts[dimension], now))
+        return wait
+
+    def refund(self, amounts, now):
+        for dimension, bucket in self.buckets.items():
+            bucket.refund(amounts[dimension], now)
+
+    def sent(self, audio_seconds, now):
+        self._trim_recent(now)
+        self.recent.append((now, audio_seconds))
+
+    def observed_rate(self, now):
+        """Частота отправленных запросов в минуту по последней минуте (или меньшему окну после запуска)"""
+        self._trim_recent(now)
+        if not self.recent:
+            return 0.0
+        window = min(60.0, max(1.0, now - self.recent[0][0]))
+        return len(self.recent) * 60 / window
+
+    def rate_limited(self, pause, now):
+        """
+        Учитывает ответ 429: снижает частоту запросов
+
+        :param pause: если задано, все запросы к провайдеру приостанавливаются на pause секунд
+        """
+        self.counters["rate_limited"] += 1
+        if pause:
+            self.blocked_until = max(self.blocked_until, now + pause)
+        if self.last_rate_limited is not None and now - self.last_rate_limited < DECREASE_INTERVAL:
+            return
+        self.last_rate_limited = now
+        # Без заданного лимита запоминаем частоту, на которой провайдер начал отказывать;
+        # следующие 429 снижают уже только множитель
+        self._trim_recent(now)
+        if not self.limits.get(DIMENSION_REQUESTS) and DIMENSION_REQUESTS not in self.learned and self.recent:
+            self.learned[DIMENSION_REQUESTS] = self.observed_rate(now)
+        self.factor = max(MIN_FACTOR, self.factor * DECREASE_FACTOR)
+        self._update_buckets(now)
+        for bucket in self.buckets.values():
+            bucket.drain()
+        logging.warning(
+            f"{self.name}: ответ 429, пауза {pause or 0:.1f} с, "
+            f"допустимая частота {self.effective_rate(DIMENSION_REQUESTS) or 0:.0f} запросов/мин"
+        )
+
+    def succeeded(self, now):
+        """Постепенно возвращает частоту после успешного запроса"""
+        changed = False
+        if self.factor < 1.0:
+            self.factor = min(1.0, self.factor + RECOVERY_STEP)
+            changed = True
+        if (
+            self.learned and self.last_rate_limited is not None
+            and now - self.last_rate_limited > RATE_LIMIT_RECOVERY_SECONDS
+        ):
+            logging.info(f"{self.name}: давно не было 429, выученный лимит сброшен")
+            self.learned.clear()
+            changed = True
+        if changed:
+            self._update_buckets(now)
+
+    def stats(self, now):
+        self._trim_recent(now)
+        return dict(
+            self.counters,
+            requests_per_minute=self.effective_rate(DIMENSION_REQUESTS) or 0,
+            audio_seconds_per_minute=self.effective_rate(DIMENSION_AUDIO_SECONDS) or 0,
+            factor=round(self.factor, 3),
+            blocked_seconds=round(max(0.0, self.blocked_until - now), 3),
+            sent_last_minute=len(self.recent),
+        )
+
+
+class RateLimitGovernor:
+    """
+    Клиентский регулятор частоты запросов к провайдерам распознавания
+
+    Перед отправкой запрос ждет допуска по корзинам «запросы в минуту» и «секунды
+    аудио в минуту». Ответы 429 снижают частоту (и задают лимит, если он не был указан),
+    успешные запросы постепенно ее восстанавливают. Короткий Retry-After задерживает
+    только повтор получившего его запроса; Retry-After длиннее бюджета означает
+    исчерпанную квоту и приостанавливает все запросы к провайдеру. Если ожидание
+    не укладывается в бюджет, запрос сразу получает ProviderThrottled и уходит
+    резервному провайдеру.
+    """
+
+    def __init__(self, providers, requests_per_minute=None, audio_seconds_per_minute=None,
+                 budget=RATE_LIMIT_BUDGET, retries=RATE_LIMIT_RETRIES, backoff=RATE_LIMIT_BACKOFF,
+                 workers=WEB_WORKERS):
+        """
+        :param providers: список провайдеров
+        :param requests_per_minute: строка вида "whisper:50,elevenlabs:30" (по умолчанию из настроек)
+        :param audio_seconds_per_minute: строка того же вида для секунд аудио
+        :param budget: сколько секунд запрос может ждать лимита и повторов
+        :param retries: сколько раз повторять запрос после 429 и временных ошибок
+        :param backoff: базовая пауза между повторами в секундах
+        :param workers: число процессов, между которыми делятся лимиты
+        """
+        if requests_per_minute is None:
+            requests_per_minute = RATE_LIMIT_REQUESTS_PER_MINUTE
+        if audio_seconds_per_minute is None:
+            audio_seconds_per_minute = RATE_LIMIT_AUDIO_SECONDS_PER_MINUTE
+        configured = {
+            DIMENSION_REQUESTS: parse_weights(requests_per_minute),
+            DIMENSION_AUDIO_SECONDS: parse_weights(audio_seconds_per_minute),
+        }
+        workers = max(1, workers)
+        self.budget = budget
+        self.retries = retries
+        self.backoff = backoff
+        now = time.monotonic()
+        self.limiters = {}
+        for provider in providers:
+            limits = {
+                dimension: values[provider] / workers if values.get(provider) else None
+                for dimension, values in configured.items()
+            }
+            self.limiters[provider] = ProviderLimiter(provider, limits, now)
+            if any(limits.values()):
+                logging.info(
+                    f"Лимиты {provider} на процесс: {limits[DIMENSION_REQUESTS] or '∞'} запросов/мин, "
+                    f"{limits[DIMENSION_AUDIO_SECONDS] or '∞'} с аудио/мин"
+                )
+
+    def deadline(self):
+        """Момент (time.monotonic()), после которого запрос больше не ждет и не повторяется"""
+        return time.monotonic() + self.budget
+
+    async def admit(self, provider, audio_seconds, deadline):
+        """
+        Ждет, пока запрос к провайдеру можно отправить
+
+        :param audio_seconds: длительность отправляемого аудио
+        :param deadline: крайний момент ожидания (см. deadline())
+        :raises ProviderThrottled: если ждать пришлось бы дольше deadline
+        """
+        limiter = self.limiters[provider]
+        amounts = {DIMENSION_REQUESTS: 1, DIMENSION_AUDIO_SECONDS: audio_seconds}
+        now = time.monotonic()
+        wait = max(limiter.reserve(amounts, now), limiter.blocked_until - now)
+        if wait <= 0:
+            limiter.counters["admitted"] += 1
+            limiter.sent(audio_seconds, now)
+            return
+        try:
+            started = now
+            # Пока идет пауза после исчерпания квоты, она может продлиться новым ответом 429
+            while wait > 0:
+                if now + wait > deadline:
+                    limiter.counters["rejected"] += 1
+                    THROTTLES.inc(provider=provider, event="rejected")
+                    raise ProviderThrottled(provider, wait)
+                # Разброс, чтобы ждущие запросы не отправлялись одновременно
+                await asyncio.sleep(wait + random.uniform(0, min(wait, 1.0) * 0.2))
+                now = time.monotonic()
+                wait = limiter.blocked_until - now
+        except BaseException:
+            limiter.refund(amounts, time.monotonic())
+            raise
+        limiter.counters["delayed"] += 1
+        limiter.counters["admitted"] += 1
+        limiter.sent(audio_seconds, now)
+        THROTTLES.inc(provider=provider, event="delayed")
+        STAGE_SECONDS.observe(now - started, stage="rate_limit_wait")
+
+    def retry_delay(self, attempt, retry_after=None):
+        """
+        Пауза перед повтором: экспоненциальная со случайным разбросом ±50%,
+        но не меньше Retry-After (к нему добавляется до 20%)
+        """
+        delay = self.backoff * 2 ** attempt
+        delay = random.uniform(delay * 0.5, delay * 1.5)
+        if retry_after is not None:
+            delay = max(delay, retry_after * random.uniform(1.0, 1.2))
+        return delay
+
+    def rate_limited(self, provider, retry_after):
+        """Учитывает ответ 429; Retry-After длиннее бюджета приостанавливает провайдера целиком"""
+        THROTTLES.inc(provider=provider, event="rate_limited")
+        pause = retry_after if retry_after is not None and retry_after > self.budget else None
+        self.limiters[provider].rate_limited(pause, time.monotonic())
+
+    def retrying(self, provider):
+        THROTTLES.inc(provider=provider, event="retry")
+        self.limiters[provider].counters["retries"] += 1
+
+    def succeeded(self, provider):
+        self.limiters[provider].succeeded(time.monotonic())
+
+    def stats(self):
+        """Возвращает для каждого провайдера текущие лимиты и счетчики ожиданий, отказов и 429"""
+        now = time.monotonic()
+        return {provider: limiter.stats(now) for provider, limiter in self.limiters.items()}
@@ -0,0 +1,272 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+class SharedState(ABC):
+    """
+    Общее состояние процессов бота: отметки о полученных обновлениях, события
+    о здоровье провайдеров и дисковый уровень кэша расшифровок.
+
+    Методы синхронные и могут блокировать (диск, сеть), поэтому из асинхронного
+    кода их вызывают через asyncio.to_thread. Новое хранилище (например, Redis)
+    подключается наследником этого класса и регистрацией в BACKENDS.
+    """
+
+    # True, если состояние переживает перезапуск и видно другим процессам
+    shared = False
+
+    @abstractmethod
+    def claim(self, key, ttl):
+        """
+        Атомарно занимает ключ на ttl секунд
+
+        :return: True, если ключ был свободен (или его срок истек) и теперь занят этим вызовом
+        """
+
+    @abstractmethod
+    def publish(self, channel, payload):
+        """Добавляет событие (JSON-совместимый словарь) в канал"""
+
+    @abstractmethod
+    def fetch(self, channel, after_id=0, since=None, limit=1000):
+        """
+        Возвращает события канала после after_id
+
+        :param since: если задано, только события не старше этого времени (time.time())
+        :return: список кортежей (id события, payload) по возрастанию id
+        """
+
+    @abstractmethod
+    def transcript_get(self, key, now, max_age):
+        """
+        Ищет расшифровку и отмечает время обращения
+
+        :return: кортеж (текст, время создания) или None
+        """
+
+    @abstractmethod
+    def transcript_set(self, keys, text, now, max_age, max_entries):
+        """Сохраняет расшифровку под несколькими ключами и вытесняет старые записи"""
+
+    def close(self):
+        pass
+
+
+class MemorySharedState(SharedState):
+    """
+    Состояние в памяти одного процесса (без общего доступа и сохранения при перезапуске)
+
+    Расшифровки не хранит: память процесса уже покрывает LRU-уровень TranscriptCache.
+    """
+
+    def __init__(self):
+        self._claims = {}
+        self._events = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def claim(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            if self._claims.get(key, 0) > now:
+                return False
+            if len(self._claims) > 100000:
+                self._claims = {k: expires for k, expires in self._claims.items() if expires > now}
+            self._claims[key] = now + ttl
+            return True
+
+    def publish(self, channel, payload):
+        with self._lock:
+            self._events.append((self._next_id, channel, payload, time.time()))
+            self._next_id += 1
+            del self._events[:-10000]
+
+    def fetch(self, channel, after_id=0, since=None, limit=1000):
+        with self._lock:
+            events = [
+                (event_id, payload) for event_id, event_channel, payload, created_at in self._events
+                if event_channel == channel and event_id > after_id and (since is None or created_at >= since)
+            ]
+        return events[:limit]
+
+    def transcript_get(self, key, now, max_age):
+        return None
+
+    def transcript_set(self, keys, text, now, max_age, max_entries):
+        pass
+
+
+class SQLiteSharedState(SharedState):
+    """
+    Общее состояние в файле SQLite (режим WAL), доступное всем процессам на одной машине
+
+    Таблица transcripts совместима с файлом дискового кэша расшифровок прежних версий.
+    """
+
+    shared = True
+
+    # Сколько секунд хранить события каналов
+    EVENTS_MAX_AGE = 600
+    # Как часто (в вызовах) чистить устаревшие отметки и события
+    CLEANUP_EVERY = 500
+    # Время обращения к расшифровкам нужно только для вытеснения, поэтому оно копится
+    # в памяти и пишется одной транзакцией: при накоплении стольких записей, раз в
+    # столько секунд, перед вытеснением и при закрытии
+    ACCESS_FLUSH_SIZE = 100
+    ACCESS_FLUSH_SECONDS = 60
+
+    def __init__(self, path, busy_timeout=5.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        # key -> время последнего обращения, еще не записанное в файл
+        self._accessed = {}
+        self._accessed_flushed_at = time.time()
+        self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        # WAL позволяет процессам читать, пока другой процесс пишет
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS transcripts ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_transcripts_accessed ON transcripts (accessed_at);"
+            "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, expires_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, "
+            "payload TEXT NOT NULL, created_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_events_channel ON events (channel, id);"
+        )
+        self._db.commit()
+        logging.info(f"Общее состояние процессов: SQLite {path}")
+
+    def _maybe_cleanup(self, now):
+        self._writes += 1
+        if self._writes % self.CLEANUP_EVERY:
+            return
+        self._db.execute("DELETE FROM claims WHERE expires_at < ?", (now,))
+        self._db.execute("DELETE FROM events WHERE created_at < ?", (now - self.EVENTS_MAX_AGE,))
+
+    def _flush_accessed(self):
+        """Записывает накопленные времена обращений (вызывается под self._lock, без commit)"""
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE transcripts SET accessed_at = ? WHERE key = ? AND accessed_at < ?",
+                [(accessed_at, key, accessed_at) for key, accessed_at in self._accessed.items()],
+            )
+            self._accessed.clear()
+        self._accessed_flushed_at = time.time()
+
+    def claim(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            # Вставка проходит, если ключа нет или срок прежней отметки истек
+            cursor = self._db.execute(
+                "INSERT INTO claims (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires_at = excluded.expires_at "
+                "WHERE claims.expires_at < ?",
+                (key, now + ttl, now),
+            )
+            self._maybe_cleanup(now)
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def publish(self, channel, payload):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO events (channel, payload, created_at) VALUES (?, ?, ?)",
+                (channel, json.dumps(payload), now),
+            )
+            self._maybe_cleanup(now)
+            self._db.commit()
+
+    def fetch(self, channel, after_id=0, since=None, limit=1000):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, payload FROM events WHERE channel = ? AND id > ? AND created_at >= ? "
+                "ORDER BY id LIMIT ?",
+                (channel, after_id, since or 0, limit),
+            ).fetchall()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+
+    def transcript_get(self, key, now, max_age):
+        with self._lock:
+            row = self._db.execute("SELECT text, created_at FROM transcripts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            text, created_at = row
+            if max_age > 0 and now - created_at > max_age:
+                self._accessed.pop(key, None)
+                self._db.execute("DELETE FROM transcripts WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._accessed[key] = now
+            overdue = now - self._accessed_flushed_at >= self.ACCESS_FLUSH_SECONDS
+            if len(self._accessed) >= self.ACCESS_FLUSH_SIZE or overdue:
+                self._flush_accessed()
+                self._db.commit()
+            return text, created_at
+
+    def transcript_set(self, keys, text, now, max_age, max_entries):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO transcripts (key, text, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, text, now, now) for key in keys],
+            )
+            # Перед вытеснением по давности обращения времена обращений должны быть в файле
+            for key in keys:
+                self._accessed.pop(key, None)
+            self._flush_accessed()
+            # Вытесняем устаревшие записи и самые давно использованные сверх лимита
+            if max_age > 0:
+                self._db.execute("DELETE FROM transcripts WHERE created_at < ?", (now - max_age,))
+            self._db.execute(
+                "DELETE FROM transcripts WHERE key IN ("
+                "SELECT key FROM transcripts ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._db.commit()
+            self._db.close()
+
+
+def _sqlite_from_url(location):
+    # sqlite:///data/state.sqlite3 — относительный путь, sqlite:////var/state.sqlite3 — абсолютный
+    return SQLiteSharedState(location[1:] if location.startswith("/") else location)
+
+
+# Схема адреса -> фабрика хранилища
+BACKENDS = {
+    "memory": lambda location: MemorySharedState(),
+    "sqlite": _sqlite_from_url,
+}
+
+
+def create_shared_state(url):
+    """
+    Создает хранилище общего состояния по адресу вида "sqlite:///data/state.sqlite3" или "memory://"
+
+    При ошибке открытия хранилища бот продолжает работу с состоянием в памяти.
+    """
+    scheme, _, location = url.partition("://")
+    factory = BACKENDS.get(scheme)
+    if factory is None:
+        raise ValueError(f"Неизвестное хранилище общего состояния: {url}")
+    try:
+        return factory(location)
+    except Exception as e:
+        logging.error(f"Не удалось открыть хранилище общего состояния {url}, используем память процесса: {e}")
+        return MemorySharedState()
@@ -1,152 +1,692 @@
+import asyncio
+import enum
 import logging
 import os
-import tempfile
-import httpx
-from elevenlabs.client import ElevenLabs
-import openai
-from config import ELEVENLABS_API_KEY, OPENAI_API_KEY
+import time
+from config import (
+    ELEVENLABS_API_KEY,
+    OPENAI_API_KEY,
+    MAX_CONCURRENT_TRANSCRIPTIONS,
+    CHUNKING_ENABLED,
+    CHUNKING_MIN_BYTES,
+    CHUNK_TARGET_SECONDS,
+    CHUNK_MAX_SECONDS,
+    CHUNK_OVERLAP_SECONDS,
+    CHUNK_FANOUT,
+    CHUNK_RETRIES,
+    PREPROCESS_ENABLED,
+    PREPROCESS_MIN_BYTES,
+    PREPROCESS_COMPACT_BITRATE,
+    PREPROCESS_BITRATE,
+    OPENAI_BASE_URL,
+    ELEVENLABS_BASE_URL,
+)
+from utils.audio_buffer import AudioBuffer
+from utils.provider_router import ProviderRouter
+from utils.rate_limit import RateLimitGovernor, ProviderThrottled, parse_retry_after
+from utils.audio_processing import load_audio, trim_silence, split_audio, export_audio, remove_overlap
+from utils.metrics import STAGE_SECONDS, PROVIDER_SECONDS, IN_FLIGHT, BYTES, FALLBACKS, ERRORS, error_reason
+
+# HTTP-статусы, после которых запрос к тому же провайдеру стоит повторить
+TRANSIENT_STATUS_CODES = (408, 409, 429)
+
+# Идентификаторы провайдеров и используемые модели
+PROVIDER_WHISPER = "whisper"
+PROVIDER_ELEVENLABS = "elevenlabs"
+PROVIDER_MODELS = {
+    PROVIDER_WHISPER: "whisper-1",
+    PROVIDER_ELEVENLABS: "scribe_v1",
+}
+
+
+def _elevenlabs_endpoint(base_url):
+    """
+    Возвращает аргументы AsyncElevenLabs, направляющие запросы на base_url
+
+    В одних версиях SDK окружение — перечисление адресов, и base_url передается
+    как есть; в других это класс с адресами HTTP и WebSocket, а base_url
+    переписывается по схеме https://host, из-за чего запросы к заглушке на
+    http://127.0.0.1:port уходят мимо нее. Поэтому там адрес передается окружением.
+
+    :param base_url: адрес API или None для официального
+    """
+    if not base_url:
+        return {}
+    from elevenlabs.environment import ElevenLabsEnvironment
+    if isinstance(ElevenLabsEnvironment, enum.EnumMeta):
+        return {"base_url": base_url}
+    wss = "ws" + base_url[len("http"):] if base_url.startswith("http") else base_url
+    return {"environment": ElevenLabsEnvironment(base=base_url, wss=wss)}
+
 
 class SpeechToTextConverter:
     """Класс для преобразования аудио в текст с использованием OpenAI Whisper API и ElevenLabs API"""
     
-    def __init__(self):
-        """Инициализация клиентов API"""
-        # Логируем наличие ключей
+    def __init__(self, shared_state=None):
+        """
+        Инициализация конвертера
+        
+        Клиенты SDK и общий пул соединений создаются при первом запросе или заранее
+        в фоне (warm_up): импорт openai и elevenlabs заметно замедляет запуск бота.
+        
+        :param shared_state: хранилище общего состояния для обмена статистикой провайдеров между процессами
+        """
+        self.transport = None
+        self.openai_client = None
+        self.elevenlabs_client = None
+        self._clients_loaded = False
+        self._load_lock = asyncio.Lock()
+        # Сетевые ошибки SDK, после которых запрос повторяется (заполняется при загрузке клиентов)
+        self._transient_errors = ()
+        
+        # Выбор провайдера для каждого запроса делает маршрутизатор по весам и здоровью провайдеров
+        providers = []
+        if OPENAI_API_KEY:
+            providers.append(PROVIDER_WHISPER)
         if ELEVENLABS_API_KEY:
-            logging.info(f"Найден ключ ElevenLabs API: {ELEVENLABS_API_KEY[:5]}...{ELEVENLABS_API_KEY[-5:]}")
-            self.elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
-        else:
-            logging.warning("Ключ ElevenLabs API не найден")
-            self.elevenlabs_client = None
-            
+            providers.append(PROVIDER_ELEVENLABS)
+        if not providers:
+            logging.error("Не найдено ни одного действующего API ключа")
+            raise ValueError("Требуется хотя бы один API ключ: OPENAI_API_KEY или ELEVENLABS_API_KEY")
+        self.router = ProviderRouter(providers, state=shared_state)
+        logging.info(f"Провайдеры распознавания: {', '.join(providers)}, по умолчанию: {self.router.preferred()}")
+        
+        # Лимиты частоты запросов; повторы после 429 делает регулятор, а не SDK
+        self.governor = RateLimitGovernor(providers)
+        
+        # Ограничиваем число одновременных запросов к API, чтобы всплеск
+        # сообщений не открывал неограниченное количество соединений
+        self.max_concurrency = max(1, MAX_CONCURRENT_TRANSCRIPTIONS)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        logging.info(f"Максимум одновременных распознаваний: {self.max_concurrency}")
+        
+        # Статистика предобработки по типам файлов: байты и время до/после
+        self.preprocess_stats = {}
+    
+    def _load_clients(self):
+        """Импортирует SDK провайдеров и создает клиенты (выполняется в отдельном потоке)"""
+        import httpx
+        from utils.http_transport import HttpTransport
+        
+        # Оба клиента используют общий пул соединений
+        transport = HttpTransport()
+        transient_errors = [httpx.TransportError]
+        
+        if ELEVENLABS_API_KEY:
+            try:
+                from elevenlabs.client import AsyncElevenLabs
+                # SDK передает таймаут в httpx как есть, поэтому отдаем ему таймауты пула
+                # по фазам: иначе общий таймаут заменил бы таймаут подключения и ожидания пула
+                self.elevenlabs_client = AsyncElevenLabs(
+                    api_key=ELEVENLABS_API_KEY,
+                    httpx_client=transport.client,
+                    timeout=transport.timeout,
+                    **_elevenlabs_endpoint(ELEVENLABS_BASE_URL)
+                )
+            except Exception as e:
+                logging.error(f"Ошибка при создании клиента ElevenLabs: {e}")
+        
         if OPENAI_API_KEY:
-            logging.info(f"Найден ключ OpenAI API: {OPENAI_API_KEY[:5]}...{OPENAI_API_KEY[-5:]} (длина: {len(OPENAI_API_KEY)})")
             try:
-                self.openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+                import openai
+                # Собственные повторы SDK отключены: их выполняет регулятор лимитов
+                self.openai_client = openai.AsyncOpenAI(
+                    api_key=OPENAI_API_KEY,
+                    base_url=OPENAI_BASE_URL,
+                    http_client=transport.client,
+                    max_retries=0
+                )
+                transient_errors.append(openai.APIConnectionError)
                 logging.info("Клиент OpenAI успешно создан")
             except Exception as e:
                 logging.error(f"Ошибка при создании клиента OpenAI: {e}")
-                self.openai_client = None
-        else:
-            logging.warning("Ключ OpenAI API не найден")
-            self.openai_client = None
-        
-        # Определяем, какой API использовать по умолчанию
-        if self.openai_client:
-            logging.info("Используем OpenAI Whisper API по умолчанию")
-            self.use_whisper = True
-        elif self.elevenlabs_client:
-            logging.info("Используем ElevenLabs API по умолчанию")
-            self.use_whisper = False
-        else:
-            logging.error("Не найдено ни одного действующего API ключа")
-            raise ValueError("Требуется хотя бы один API ключ: OPENAI_API_KEY или ELEVENLABS_API_KEY")
+        
+        self._transient_errors = tuple(transient_errors)
+        self.transport = transport
     
-    async def convert_audio_to_text(self, audio_data, language="ru"):
+    async def warm_up(self):
+        """Загружает SDK провайдеров и создает клиенты, если это еще не сделано"""
+        if self._clients_loaded:
+            return
+        async with self._load_lock:
+            if self._clients_loaded:
+                return
+            started = time.monotonic()
+            # В отдельном потоке, чтобы цикл событий продолжал отвечать (проверки здоровья, вебхук)
+            await asyncio.to_thread(self._load_clients)
+            self._clients_loaded = True
+            elapsed = time.monotonic() - started
+            STAGE_SECONDS.observe(elapsed, stage="sdk_load")
+            logging.info(f"Клиенты провайдеров распознавания загружены за {elapsed:.2f} с")
+    
+    def preprocessing_stats(self):
+        """Возвращает статистику предобработки по типам файлов"""
+        return {file_type: dict(stats) for file_type, stats in self.preprocess_stats.items()}
+    
+    def start(self):
+        """Запускает фоновые задачи (обмен статистикой провайдеров между процессами)"""
+        self.router.start_sync()
+    
+    async def close(self):
+        """Останавливает фоновые задачи и закрывает общий пул HTTP-соединений"""
+        await self.router.stop_sync()
+        if self.transport is not None:
+            await self.transport.aclose()
+    
+    def router_stats(self):
+        """Возвращает состояние провайдеров: выключатели, долю ошибок и задержки"""
+        return self.router.stats()
+    
+    def rate_limit_stats(self):
+        """Возвращает текущие лимиты провайдеров и счетчики ожиданий, отказов и ответов 429"""
+        return self.governor.stats()
+    
+    def transport_stats(self):
+        """Возвращает статистику пула HTTP-соединений (пустую, пока клиенты не загружены)"""
+        if self.transport is None:
+            return {}
+        return self.transport.stats()
+    
+    def cache_scope(self, language="ru", provider=None):
+        """
+        Возвращает область кэширования (провайдер, модель, язык)
+        
+        :param language: язык аудио
+        :param provider: провайдер; по умолчанию тот, который будет использован для нового запроса
+        """
+        if provider is None:
+            provider = self.router.preferred()
+        return (provider, PROVIDER_MODELS[provider], language)
+    
+    def cache_scopes(self, language="ru"):
+        """
+        Возвращает области кэширования всех провайдеров, начиная с предпочтительного
+        
+        Расшифровка хранится под провайдером, который ее выполнил; после переключения
+        на резервного провайдера она должна находиться и при следующем запросе.
+        """
+        preferred = self.router.preferred()
+        providers = [preferred] + [name for name in self.router.health if name != preferred]
+        return [self.cache_scope(language, provider) for provider in providers]
+    
+    async def convert_audio_to_text(self, audio_data, language="ru", duration=None):
         """
         Преобразует аудио в текст
         
-        :param audio_data: байты аудио файла
+        :param audio_data: AudioBuffer или байты аудио файла
         :param language: язык аудио (по умолчанию русский)
+        :param duration: длительность аудио в секундах, если известна (из Telegram)
         :return: распознанный текст
         """
-        if self.use_whisper:
-            return await self._convert_with_whisper(audio_data, language)
-        else:
-            return await self._convert_with_elevenlabs(audio_data, language)
+        text, _ = await self.transcribe(audio_data, language, duration)
+        return text
     
-    async def _convert_with_whisper(self, audio_data, language="ru"):
-        """Использует OpenAI Whisper API для преобразования аудио в текст"""
-        if not self.openai_client:
-            logging.error("Отсутствует OpenAI API ключ")
-            if self.elevenlabs_client:
-                return await self._convert_with_elevenlabs(audio_data, language)
-            return "❌ Не настроен OpenAI API ключ. Добавьте OPENAI_API_KEY в настройки."
-            
+    async def transcribe(self, audio_data, language="ru", duration=None):
+        """
+        Преобразует аудио в текст и сообщает, какой провайдер его распознал
+        
+        :param audio_data: AudioBuffer или байты аудио файла
+        :param language: язык аудио (по умолчанию русский)
+        :param duration: длительность аудио в секундах, если известна (из Telegram)
+        :return: кортеж (текст, провайдер); провайдер равен None, если вместо текста вернулась ошибка
+        """
+        pieces = []
+        providers = set()
+        async for text, provider in self.transcribe_stream(audio_data, language, duration):
+            if text:
+                pieces.append(text)
+            providers.add(provider)
+        # Результат кэшируется, только если все фрагменты распознал один провайдер
+        provider = providers.pop() if len(providers) == 1 else None
+        return " ".join(pieces), provider
+    
+    async def transcribe_stream(self, audio_data, language="ru", duration=None):
+        """
+        Распознает аудио и отдает частичные расшифровки по мере готовности
+        
+        Короткое аудио дает одну часть, длинное — по части на каждый фрагмент
+        в порядке следования (повторы на стыках уже убраны).
+        
+        :param audio_data: AudioBuffer или байты аудио файла
+        :param language: язык аудио (по умолчанию русский)
+        :param duration: длительность аудио в секундах, если известна (из Telegram)
+        :return: асинхронный итератор кортежей (текст части, провайдер); провайдер равен None при ошибке
+        """
+        # Байты оборачиваем в буфер; буфер, переданный вызывающим кодом, он же и закрывает
+        if isinstance(audio_data, AudioBuffer):
+            async for part in self._stream_buffer(audio_data, language, duration):
+                yield part
+            return
+        with AudioBuffer.from_bytes(audio_data) as audio:
+            async for part in self._stream_buffer(audio, language, duration):
+                yield part
+    
+    async def _stream_buffer(self, audio, language, duration):
+        """
+        Распознает буфер: при необходимости обрезает тишину и перекодирует аудио
+        в компактный Opus, а длинное аудио распознает по фрагментам
+        """
+        started = time.monotonic()
+        chunking = self._needs_chunking_check(audio, duration)
+        preprocess = self._needs_preprocessing(audio, duration)
+        if not chunking and not preprocess:
+            # Учитываем и файлы без предобработки, чтобы было с чем сравнивать
+            result = await self._convert(audio, language, duration)
+            self._record_preprocessing(audio, audio.size, 0.0, time.monotonic() - started, preprocessed=False)
+            yield result
+            return
+        
         try:
-            # Создаем временный файл для аудио
-            with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
-                temp_filename = temp_file.name
-                temp_file.write(audio_data)
-            
-            # Отправляем аудио на распознавание в Whisper API
-            with open(temp_filename, "rb") as audio_file:
-                transcript = self.openai_client.audio.transcriptions.create(
-                    model="whisper-1",  # Используем модель whisper-1
-                    file=audio_file,
-                    language=language,
-                    response_format="text"
-                )
+            with STAGE_SECONDS.time(stage="decode"):
+                pcm = await asyncio.to_thread(load_audio, audio)
+        except Exception as e:
+            logging.warning(f"Не удалось декодировать аудио, отправляем как есть: {e}")
+            ERRORS.inc(stage="decode", reason=error_reason(e))
+            result = await self._convert(audio, language, duration)
+            self._record_preprocessing(audio, audio.size, 0.0, time.monotonic() - started, preprocessed=False)
+            yield result
+            return
+        
+        # Декодированный PCM лежит в буфере с переносом на диск, срезы читаются по мере надобности
+        with pcm:
+            async for part in self._stream_decoded(audio, pcm, language, preprocess, started):
+                yield part
+    
+    async def _stream_decoded(self, audio, segment, language, preprocess, started):
+        """
+        Обрезает тишину, затем распознает аудио целиком или по фрагментам
+
+        Решение о разбиении принимается по длине декодированного аудио: оценка до
+        декодирования (размер файла, длительность из Telegram) могла ошибиться.
+        """
+        if preprocess:
+            try:
+                with STAGE_SECONDS.time(stage="trim_silence"):
+                    segment = await asyncio.to_thread(trim_silence, segment)
+            except Exception as e:
+                logging.warning(f"Не удалось обрезать тишину: {e}")
+                ERRORS.inc(stage="trim_silence", reason=error_reason(e))
+        
+        seconds = len(segment) / 1000
+        if CHUNKING_ENABLED and len(segment) > CHUNK_MAX_SECONDS * 1000:
+            chunks = await self._split(segment)
+            preprocess_seconds = time.monotonic() - started
+            # Размеры фрагментов, отправленных на распознавание, для статистики предобработки
+            uploaded = []
+            async for part in self._stream_chunked(chunks, language, uploaded):
+                yield part
+            self._record_preprocessing(audio, sum(uploaded), preprocess_seconds, time.monotonic() - started)
+            return
+        if not preprocess:
+            result = await self._convert(audio, language, seconds)
+            self._record_preprocessing(audio, audio.size, 0.0, time.monotonic() - started, preprocessed=False)
+            yield result
+            return
+        
+        try:
+            with STAGE_SECONDS.time(stage="encode"):
+                normalized = await asyncio.to_thread(export_audio, segment, "audio.ogg", PREPROCESS_BITRATE)
+        except Exception as e:
+            logging.warning(f"Не удалось перекодировать аудио, отправляем как есть: {e}")
+            ERRORS.inc(stage="encode", reason=error_reason(e))
+            result = await self._convert(audio, language, seconds)
+            self._record_preprocessing(audio, audio.size, 0.0, time.monotonic() - started, preprocessed=False)
+            yield result
+            return
+        
+        with normalized:
+            # Перекодированный файл используем, только если он действительно меньше исходного
+            upload = normalized if normalized.size < audio.size else audio
+            preprocess_seconds = time.monotonic() - started
+            result = await self._convert(upload, language, seconds)
+        self._record_preprocessing(audio, upload.size, preprocess_seconds, time.monotonic() - started)
+        yield result
+    
+    def _needs_chunking_check(self, audio, duration):
+        """Определяет, может ли аудио оказаться длиннее CHUNK_MAX_SECONDS"""
+        if not CHUNKING_ENABLED:
+            return False
+        if duration is not None:
+            return duration > CHUNK_MAX_SECONDS
+        # Без известной длительности не декодируем маленькие файлы ради проверки длины
+        return audio.size >= CHUNKING_MIN_BYTES
+    
+    def _needs_preprocessing(self, audio, duration):
+        """Определяет, стоит ли перекодировать аудио перед отправкой"""
+        if not PREPROCESS_ENABLED or audio.size < PREPROCESS_MIN_BYTES:
+            return False
+        # Уже компактное аудио (например, голосовые сообщения в Opus) отправляем как есть
+        if duration:
+            return audio.size * 8 / duration > PREPROCESS_COMPACT_BITRATE
+        return True
+    
+    def _record_preprocessing(self, audio, bytes_after, preprocess_seconds, total_seconds, preprocessed=True):
+        """Сохраняет статистику загруженных байтов и задержки по типу файла"""
+        file_type = os.path.splitext(audio.filename)[1].lower().lstrip(".") or "unknown"
+        stats = self.preprocess_stats.setdefault(file_type, {
+            "files": 0,
+            "preprocessed": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+            "preprocess_seconds": 0.0,
+            "total_seconds": 0.0,
+        })
+        stats["files"] += 1
+        stats["preprocessed"] += int(preprocessed)
+        stats["bytes_before"] += audio.size
+        stats["bytes_after"] += bytes_after
+        stats["preprocess_seconds"] += preprocess_seconds
+        stats["total_seconds"] += total_seconds
+        if preprocessed:
+            logging.info(
+                f"Предобработка {file_type}: {audio.size} -> {bytes_after} байт, "
+                f"предобработка {preprocess_seconds:.2f} с, всего {total_seconds:.2f} с"
+            )
+    
+    async def _split(self, segment):
+        """Делит длинное аудио на фрагменты по паузам"""
+        with STAGE_SECONDS.time(stage="split"):
+            chunks = await asyncio.to_thread(
+                split_audio,
+                segment,
+                CHUNK_TARGET_SECONDS * 1000,
+                CHUNK_MAX_SECONDS * 1000,
+                int(CHUNK_OVERLAP_SECONDS * 1000)
+            )
+        logging.info(f"Аудио длиной {len(segment) / 1000:.0f} с разбито на {len(chunks)} фрагментов")
+        return chunks
+    
+    async def _stream_chunked(self, chunks, language, uploaded):
+        """
+        Распознает фрагменты параллельно и отдает их расшифровки по порядку
+        
+        :param uploaded: список, в который добавляются размеры отправленных фрагментов
+        """
+        # Ограничиваем число одновременно распознаваемых фрагментов одного файла
+        fanout = asyncio.Semaphore(max(1, CHUNK_FANOUT))
+        tasks = [
+            asyncio.create_task(self._transcribe_chunk(chunk, index, language, fanout, uploaded))
+            for index, (chunk, _) in enumerate(chunks)
+        ]
+        previous_text = ""
+        try:
+            for task, (_, overlapped) in zip(tasks, chunks):
+                text, provider = await task
+                if overlapped and provider is not None:
+                    text = remove_overlap(previous_text, text)
+                previous_text = text
+                yield text, provider
+        finally:
+            # Если потребитель перестал читать, оставшиеся фрагменты не распознаем
+            for task in tasks:
+                task.cancel()
+    
+    async def _transcribe_chunk(self, chunk, index, language, fanout, uploaded):
+        """Распознает один фрагмент, повторяя попытку при ошибке"""
+        async with fanout:
+            with STAGE_SECONDS.time(stage="chunk_encode"):
+                audio = await asyncio.to_thread(export_audio, chunk, f"chunk_{index}.ogg", PREPROCESS_BITRATE)
+            uploaded.append(audio.size)
+            with audio:
+                for attempt in range(CHUNK_RETRIES + 1):
+                    text, provider = await self._convert(audio, language, len(chunk) / 1000)
+                    if provider is not None:
+                        return text, provider
+                    logging.warning(f"Фрагмент {index} не распознан (попытка {attempt + 1}): {text}")
+                    if attempt < CHUNK_RETRIES:
+                        await asyncio.sleep(2 ** attempt)
+        ERRORS.inc(stage="chunk", reason="retries_exhausted")
+        return "[фрагмент не распознан]", None
+    
+    async def _convert(self, audio, language, seconds=None):
+        """
+        Отправляет буфер с аудио провайдерам в порядке, выбранном маршрутизатором
+        
+        :param seconds: длительность аудио для лимита «секунды аудио в минуту», если известна
+        :return: кортеж (текст, провайдер) или (сообщение об ошибке, None)
+        """
+        # Запросы выполняются асинхронно и не блокируют цикл событий: до
+        # MAX_CONCURRENT_TRANSCRIPTIONS запросов идут одновременно и укладываются во время
+        # самого медленного из них, остальные ждут свободного места в семафоре
+        with STAGE_SECONDS.time(stage="provider_slot_wait"):
+            await self._semaphore.acquire()
+        # Пробные запросы к восстанавливающимся провайдерам занимаются при выборе
+        probe_owner = object()
+        try:
+            candidates = self.router.candidates(probe_owner)
+            if not candidates:
+                logging.error("Все провайдеры распознавания временно отключены")
+                ERRORS.inc(stage="provider", reason="all_circuits_open")
+                return "⚠️ Сервисы распознавания временно недоступны. Попробуйте позже.", None
             
-            # Удаляем временный файл
-            os.unlink(temp_filename)
+            primary = candidates[0]
+            fallbacks = candidates[1:]
+            if fallbacks:
+                delay = self.router.hedge_delay(primary, seconds)
+                if delay is not None:
+                    return await self._convert_hedged(
+                        primary, fallbacks, audio, language, seconds, delay, probe_owner
+                    )
             
-            logging.info("Успешно распознано с помощью Whisper API")
-            return transcript
+            error_message = None
+            for provider in candidates:
+                try:
+                    has_fallback = provider != candidates[-1]
+                    return await self._call_provider(
+                        provider, audio, language, seconds, has_fallback, probe_owner
+                    ), provider
+                except Exception as e:
+                    error_message = self._error_message(provider, e)
+                    if provider != candidates[-1]:
+                        logging.info(f"Переключаемся на резервного провайдера после ошибки {provider}")
+                        FALLBACKS.inc(provider=provider, reason=error_reason(e))
+            return error_message, None
+        finally:
+            self.router.release_probes(probe_owner)
+            self._semaphore.release()
+    
+    async def _convert_hedged(self, primary, fallbacks, audio, language, seconds, delay, probe_owner=None):
+        """
+        Отправляет запрос основному провайдеру и, если он не ответил за delay секунд
+        (его p95), дублирует запрос резервному; используется первый успешный ответ
+        """
+        tasks = {
+            asyncio.create_task(self._call_provider(primary, audio, language, seconds, True, probe_owner)): primary
+        }
+        pending_fallbacks = list(fallbacks)
+        error_message = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                hedge = pending_fallbacks.pop(0)
+                logging.info(f"{primary} не ответил за {delay:.1f} с, дублируем запрос в {hedge}")
+                FALLBACKS.inc(provider=primary, reason="hedge")
+                tasks[asyncio.create_task(
+                    self._call_provider(hedge, audio, language, seconds, bool(pending_fallbacks), probe_owner)
+                )] = hedge
             
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = tasks.pop(task)
+                    if task.exception() is None:
+                        return task.result(), provider
+                    error_message = self._error_message(provider, task.exception())
+                # Все запущенные запросы завершились ошибкой: пробуем следующего резервного
+                if not tasks and pending_fallbacks:
+                    FALLBACKS.inc(provider=provider, reason=error_reason(task.exception()))
+                    provider = pending_fallbacks.pop(0)
+                    tasks[asyncio.create_task(
+                        self._call_provider(provider, audio, language, seconds, bool(pending_fallbacks), probe_owner)
+                    )] = provider
+            return error_message, None
+        finally:
+            # Проигравший запрос отменяем, он не учитывается в статистике провайдера
+            for task in tasks:
+                task.cancel()
+    
+    async def _call_provider(self, provider, audio, language, seconds=None, has_fallback=False, probe_owner=None):
+        """
+        Вызывает провайдера в пределах его лимитов
+        
+        Запрос ждет допуска регулятора и повторяется после 429 и временных ошибок,
+        пока укладывается в бюджет RATE_LIMIT_BUDGET; иначе ошибка уходит вызывающему
+        коду, который переключается на резервного провайдера.
+        
+        :param has_fallback: есть ли резервный провайдер; тогда после ошибок сервера и
+            соединения запрос не повторяется, а сразу уходит резервному: при отказе
+            провайдера повторы только добавляли бы паузы к ответу
+        :param probe_owner: владелец проб, переданный в router.candidates
+        """
+        await self.warm_up()
+        if seconds is None:
+            # Длительность неизвестна: оцениваем по размеру при битрейте голосовых сообщений (32 кбит/с)
+            seconds = audio.size / 4000
+        deadline = self.governor.deadline()
+        attempt = 0
+        while True:
+            await self.governor.admit(provider, seconds, deadline)
+            try:
+                text = await self._request(provider, audio, language, seconds, probe_owner)
+            except Exception as e:
+                status_code = self._status_code(e)
+                retry_after = None
+                if status_code == 429:
+                    retry_after = self._retry_after(e)
+                    self.governor.rate_limited(provider, retry_after)
+                elif has_fallback or not self._is_transient(e, status_code):
+                    raise
+                delay = self.governor.retry_delay(attempt, retry_after)
+                if attempt >= self.governor.retries or time.monotonic() + delay > deadline:
+                    raise
+                attempt += 1
+                self.governor.retrying(provider)
+                logging.info(f"Повтор запроса к {provider} через {delay:.1f} с (попытка {attempt + 1}): {e}")
+                await asyncio.sleep(delay)
+                continue
+            self.governor.succeeded(provider)
+            return text
+    
+    async def _request(self, provider, audio, language, seconds=None, probe_owner=None):
+        """
+        Выполняет один запрос к провайдеру и сообщает маршрутизатору задержку и результат
+
+        :param probe_owner: владелец проб; запрос без результата освобождает пробу, только если она его
+        """
+        started = time.monotonic()
+        BYTES.inc(audio.size, direction="uploaded")
+        try:
+            with IN_FLIGHT.track(kind="provider_requests"):
+                if provider == PROVIDER_WHISPER:
+                    text = await self._convert_with_whisper(audio, language)
+                else:
+                    text = await self._convert_with_elevenlabs(audio, language)
+        except asyncio.CancelledError:
+            self.router.release(provider, probe_owner)
+            PROVIDER_SECONDS.observe(time.monotonic() - started, provider=provider, outcome="cancelled")
+            raise
         except Exception as e:
-            logging.error(f"Ошибка при использовании Whisper API: {e}")
-            # Если Whisper не работает, пробуем ElevenLabs
-            if self.elevenlabs_client:
-                logging.info("Переключаемся на ElevenLabs API")
-                return await self._convert_with_elevenlabs(audio_data, language)
-            return "❌ Ошибка Whisper API: " + str(e)
+            latency = time.monotonic() - started
+            # Ошибки в самом запросе (битый файл и т.п.) и превышение лимита не говорят о здоровье провайдера
+            if self._is_client_error(e) or self._status_code(e) == 429:
+                self.router.release(provider, probe_owner)
+            else:
+                self.router.record(provider, False, latency, seconds)
+            PROVIDER_SECONDS.observe(latency, provider=provider, outcome="error")
+            ERRORS.inc(stage="provider", reason=error_reason(e))
+            raise
+        latency = time.monotonic() - started
+        self.router.record(provider, True, latency, seconds)
+        PROVIDER_SECONDS.observe(latency, provider=provider, outcome="success")
+        return text
+    
+    async def _convert_with_whisper(self, audio_data, language="ru"):
+        """Использует OpenAI Whisper API для преобразования аудио в текст"""
+        if self.openai_client is None:
+            raise RuntimeError("Клиент OpenAI не создан")
+        # Отправляем аудио на распознавание в Whisper API прямо из буфера,
+        # httpx читает его кусками и перечитывает с начала при повторе запроса
+        transcript = await self.openai_client.audio.transcriptions.create(
+            model=PROVIDER_MODELS[PROVIDER_WHISPER],  # Используем модель whisper-1
+            file=audio_data.upload_file(),
+            language=language,
+            response_format="text"
+        )
+        logging.info("Успешно распознано с помощью Whisper API")
+        return transcript
     
     async def _convert_with_elevenlabs(self, audio_data, language="ru"):
         """Использует ElevenLabs API для преобразования аудио в текст"""
-        if not self.elevenlabs_client:
-            logging.error("Отсутствует ElevenLabs API ключ")
-            if self.openai_client:
-                return await self._convert_with_whisper(audio_data, language)
-            return "❌ Не настроен ElevenLabs API ключ. Добавьте ELEVENLABS_API_KEY в настройки."
-            
+        if self.elevenlabs_client is None:
+            raise RuntimeError("Клиент ElevenLabs не создан")
+        # Отправляем аудио на распознавание
+        # Согласно документации ElevenLabs API, используем параметр 'file'
+        result = await self.elevenlabs_client.speech_to_text.convert(
+            model_id=PROVIDER_MODELS[PROVIDER_ELEVENLABS],  # Используем доступную модель scribe_v1
+            file=audio_data.upload_file(),  # Передаем буфер с аудиофайлом
+            language_code=language,  # Код языка
+            request_options={"max_retries": 0}  # Повторы выполняет регулятор лимитов
+        )
+        logging.info("Успешно распознано с помощью ElevenLabs API")
+        return result.text
+    
+    @staticmethod
+    def _status_code(error):
+        """Достает HTTP-статус из исключения SDK OpenAI, ElevenLabs или httpx"""
+        status_code = getattr(error, "status_code", None)
+        if status_code is None:
+            # httpx.HTTPStatusError хранит статус в ответе
+            status_code = getattr(getattr(error, "response", None), "status_code", None)
+        return status_code
+    
+    def _is_client_error(self, error):
+        """True для ошибок, вызванных самим аудио, а не состоянием провайдера"""
+        return self._status_code(error) in (400, 413, 415, 422)
+    
+    def _is_transient(self, error, status_code):
+        """True для ошибок, после которых запрос к тому же провайдеру стоит повторить"""
+        if status_code is not None:
+            return status_code in TRANSIENT_STATUS_CODES or status_code >= 500
+        return isinstance(error, self._transient_errors)
+    
+    @staticmethod
+    def _retry_after(error):
+        """Достает паузу из заголовков Retry-After ответа с ошибкой"""
+        headers = getattr(error, "headers", None)
+        if headers is None:
+            headers = getattr(getattr(error, "response", None), "headers", None)
         try:
-            # Отправляем аудио на распознавание
-            # Согласно документации ElevenLabs API, используем параметр 'file'
-            result = self.elevenlabs_client.speech_to_text.convert(
-                model_id="scribe_v1",  # Используем доступную модель scribe_v1
-                file=audio_data,        # Передаем байты аудиофайла
-                language_code=language  # Код языка
-            )
-            logging.info("Успешно распознано с помощью ElevenLabs API")
-            return result.text
-        
-        except Exception as e:
-            error_message = self._handle_elevenlabs_error(e)
-            logging.error(f"ElevenLabs API ошибка: {e}")
-            return error_message
-        except httpx.HTTPStatusError as e:
-            status_code = e.response.status_code
-            logging.error(f"HTTP ошибка: {status_code} - {e}")
-            
-            if status_code == 401:
-                return "❌ Ошибка авторизации в ElevenLabs API. Возможно, истек бесплатный план или API ключ недействителен."
-            elif status_code == 429:
-                return "⚠️ Превышен лимит запросов к ElevenLabs API. Попробуйте позже."
-            else:
-                return f"❌ Ошибка сервера: {status_code}. Попробуйте позже."
-        except Exception as e:
-            logging.error(f"Неизвестная ошибка при распознавании речи: {e}")
-            return "❌ Ошибка при распознавании речи. Попробуйте позже или отправьте аудио меньшего размера."
+            return parse_retry_after(headers)
+        except Exception:
+            return None
+    
+    def _error_message(self, provider, error):
+        """Логирует ошибку провайдера и возвращает сообщение для пользователя"""
+        if isinstance(error, ProviderThrottled):
+            logging.warning(str(error))
+            return "⚠️ Превышен лимит запросов к сервису распознавания. Попробуйте позже."
+        if provider == PROVIDER_WHISPER:
+            logging.error(f"Ошибка при использовании Whisper API: {error}")
+            if self._status_code(error) == 429:
+                return "⚠️ Превышен лимит запросов к Whisper API. Попробуйте позже."
+            return "❌ Ошибка Whisper API: " + str(error)
+        logging.error(f"ElevenLabs API ошибка: {error}")
+        return self._handle_elevenlabs_error(error)
     
     def _handle_elevenlabs_error(self, error):
         """Обрабатывает специфические ошибки API ElevenLabs"""
         error_str = str(error)
+        status_code = self._status_code(error)
         
         if "detected_unusual_activity" in error_str:
-            # Если бесплатный план ElevenLabs заблокирован, переключаемся на Whisper
-            self.use_whisper = True
-            logging.info("Переключение на Whisper API из-за блокировки ElevenLabs")
-            return "⚠️ ElevenLabs обнаружил необычную активность. Используем Whisper API."
+            return "⚠️ ElevenLabs обнаружил необычную активность. Попробуйте позже."
         elif "free tier" in error_str.lower():
-            self.use_whisper = True
-            logging.info("Переключение на Whisper API из-за ограничения ElevenLabs")
-            return "⚠️ Исчерпан лимит бесплатного плана ElevenLabs. Используем Whisper API."
-        elif "invalid api key" in error_str.lower():
-            self.use_whisper = True
-            logging.info("Переключение на Whisper API из-за недействительного ключа ElevenLabs")
-            return "❌ Недействительный ключ API ElevenLabs. Используем Whisper API."
+            return "⚠️ Исчерпан лимит бесплатного плана ElevenLabs."
+        elif "invalid api key" in error_str.lower() or status_code == 401:
+            return "❌ Ошибка авторизации в ElevenLabs API. Возможно, истек бесплатный план или API ключ недействителен."
+        elif status_code == 429:
+            return "⚠️ Превышен лимит запросов к ElevenLabs API. Попробуйте позже."
+        elif status_code is not None:
+            return f"❌ Ошибка сервера: {status_code}. Попробуйте позже."
         else:
-            self.use_whisper = True
-            logging.info("Переключение на Whisper API из-за ошибки ElevenLabs")
-            return "❌ Ошибка ElevenLabs API. Используем Whisper API."
+            return "❌ Ошибка при распознавании речи. Попробуйте позже или отправьте аудио меньшего размера."
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from config import STREAMING_REPLIES, STREAM_EDIT_INTERVAL, STREAM_GROUP_EDIT_INTERVAL
+from utils.metrics import STAGE_SECONDS, ERRORS, error_reason
+
+# Максимальная длина текста одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Время от получения сообщения до появления первого текста у пользователя (последние замеры)
+time_to_first_text = deque(maxlen=1000)
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+def streaming_stats():
+    """Возвращает p50/p95 времени до первого текста в секундах"""
+    return {
+        "replies": len(time_to_first_text),
+        "time_to_first_text_p50": _percentile(time_to_first_text, 50),
+        "time_to_first_text_p95": _percentile(time_to_first_text, 95),
+    }
+
+
+def split_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Делит текст на части не длиннее limit, по возможности по пробелам
+
+    Граница каждой части зависит только от текста до нее, поэтому при
+    дописывании текста уже отправленные части не меняются.
+    """
+    pages = []
+    while len(text) > limit:
+        cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        pages.append(text[:cut])
+        text = text[cut:].lstrip(" ")
+    pages.append(text)
+    return pages
+
+
+class StreamingReply:
+    """
+    Ответ с расшифровкой, который обновляется на месте по мере поступления частей.
+
+    Правки объединяются, чтобы не чаще раза в STREAM_EDIT_INTERVAL секунд
+    (в группах — STREAM_GROUP_EDIT_INTERVAL) редактировать сообщение, а при
+    TelegramRetryAfter интервал увеличивается. Текст длиннее 4096 символов
+    продолжается в следующих сообщениях.
+    """
+
+    def __init__(self, message, started_at=None):
+        """
+        :param message: сообщение пользователя, на которое отправляется ответ
+        :param started_at: время получения сообщения (time.monotonic) для замера времени до первого текста
+        """
+        self.message = message
+        self.streaming = STREAMING_REPLIES
+        self.min_interval = STREAM_EDIT_INTERVAL
+        if message.chat.type != "private":
+            self.min_interval = max(self.min_interval, STREAM_GROUP_EDIT_INTERVAL)
+        self.started_at = started_at or time.monotonic()
+        self.text = ""
+        # Отправленные сообщения и текст, который в них сейчас показан
+        self._sent = []
+        self._last_flush = 0.0
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    async def append(self, piece):
+        """Добавляет часть расшифровки и обновляет ответ с учетом ограничения частоты правок"""
+        if not piece:
+            return
+        await self.update(f"{self.text} {piece}" if self.text else piece)
+
+    async def update(self, text):
+        """Заменяет текст ответа целиком и обновляет его с учетом ограничения частоты правок"""
+        if text == self.text:
+            return
+        self.text = text
+        if not self.streaming or self._flush_task is not None:
+            return
+        delay = self._last_flush + self.min_interval - time.monotonic()
+        if delay <= 0:
+            await self._flush()
+        else:
+            # Объединяем части, пришедшие за время интервала, в одну правку
+            self._flush_task = asyncio.create_task(self._delayed_flush(delay))
+
+    async def _delayed_flush(self, delay):
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        # Ошибку промежуточной правки некому получить: пишем в лог, итоговый текст покажет finish
+        try:
+            await self._flush()
+        except Exception as e:
+            ERRORS.inc(stage="reply_send", reason=error_reason(e))
+            logging.warning(f"Не удалось обновить ответ с расшифровкой: {e}")
+
+    async def finish(self, empty_text="🔇 Речь не распознана"):
+        """Показывает итоговый текст целиком"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if not self.text:
+            self.text = empty_text
+        await self._flush()
+
+    async def _flush(self):
+        async with self._lock:
+            pages = split_message(self.text)
+            for index, page in enumerate(pages):
+                if index < len(self._sent):
+                    sent_message, shown = self._sent[index]
+                    if shown != page:
+                        await self._call(sent_message.edit_text, page)
+                        self._sent[index] = (sent_message, page)
+                else:
+                    sent_message = await self._call(self.message.reply, page)
+                    self._sent.append((sent_message, page))
+                    if index == 0:
+                        elapsed = time.monotonic() - self.started_at
+                        time_to_first_text.append(elapsed)
+                        STAGE_SECONDS.observe(elapsed, stage="time_to_first_text")
+            # Итоговый текст может занять меньше сообщений, чем уже отправлено
+            while len(self._sent) > len(pages):
+                sent_message, _ = self._sent.pop()
+                try:
+                    await self._call_delete(sent_message)
+                except Exception as e:
+                    logging.warning(f"Не удалось удалить лишнее сообщение ответа: {e}")
+            self._last_flush = time.monotonic()
+
+    async def _call_delete(self, sent_message):
+        """Удаляет отправленное сообщение, выжидая при флуд-контроле"""
+        while True:
+            try:
+                return await sent_message.delete()
+            except TelegramRetryAfter as e:
+                ERRORS.inc(stage="reply_send", reason="retry_after")
+                await asyncio.sleep(e.retry_after)
+
+    async def _call(self, method, text):
+        """Вызывает метод Telegram, выжидая и увеличивая интервал правок при флуд-контроле"""
+        while True:
+            try:
+                with STAGE_SECONDS.time(stage="reply_send"):
+                    return await method(text)
+            except TelegramRetryAfter as e:
+                ERRORS.inc(stage="reply_send", reason="retry_after")
+                self.min_interval = min(self.min_interval * 2, 30.0)
+                logging.warning(f"Флуд-контроль Telegram: ждем {e.retry_after} с, интервал правок {self.min_interval} с")
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                # Текст не изменился с прошлой правки
+                if "message is not modified" in str(e):
+                    return None
+                raise
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from config import (
+    TRANSCRIPT_CACHE_PATH,
+    TRANSCRIPT_CACHE_MEMORY_ENTRIES,
+    TRANSCRIPT_CACHE_DISK_ENTRIES,
+    TRANSCRIPT_CACHE_MAX_AGE,
+)
+from utils.shared_state import SQLiteSharedState
+
+
+def make_cache_key(kind, value, scope):
+    """
+    Формирует ключ кэша
+
+    :param kind: тип ключа: "file" (file_unique_id из Telegram) или "sha256" (хэш аудио)
+    :param value: значение ключа
+    :param scope: кортеж (провайдер, модель, язык): расшифровка хранится под
+                  провайдером и моделью, которые ее сделали, и смена модели или
+                  языка не отдает прежний результат
+    """
+    provider, model, language = scope
+    return f"{kind}:{value}:{provider}:{model}:{language}"
+
+
+def hash_audio(audio_buffer):
+    """Считает SHA-256 содержимого AudioBuffer, читая его кусками"""
+    digest = hashlib.sha256()
+    for chunk in audio_buffer.iter_chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    Двухуровневый кэш расшифровок: LRU в памяти и общее хранилище (SQLite на диске).
+
+    Записи старше TRANSCRIPT_CACHE_MAX_AGE секунд считаются устаревшими,
+    при превышении лимитов вытесняются давно не использованные записи.
+    Общее хранилище видят все процессы бота, поэтому расшифровка, сделанная
+    одним процессом, находится и другими.
+    """
+
+    def __init__(
+        self,
+        path=TRANSCRIPT_CACHE_PATH,
+        memory_entries=TRANSCRIPT_CACHE_MEMORY_ENTRIES,
+        disk_entries=TRANSCRIPT_CACHE_DISK_ENTRIES,
+        max_age=TRANSCRIPT_CACHE_MAX_AGE,
+        store=None,
+    ):
+        """
+        :param path: файл SQLite для дискового уровня, если store не передан
+        :param store: хранилище общего состояния (SharedState) для второго уровня
+        """
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.max_age = max_age
+        # ключ -> (текст, время создания)
+        self._memory = OrderedDict()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._owns_store = False
+        if store is None and path:
+            try:
+                store = SQLiteSharedState(path)
+                self._owns_store = True
+            except Exception as e:
+                logging.error(f"Не удалось открыть дисковый кэш расшифровок {path}: {e}")
+        # Хранилище только в памяти процесса ничего не добавляет к LRU-уровню
+        self._store = store if store is not None and store.shared else None
+
+    def _is_expired(self, created_at, now):
+        return self.max_age > 0 and now - created_at > self.max_age
+
+    def _memory_get(self, key, now):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        text, created_at = entry
+        if self._is_expired(created_at, now):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return text
+
+    def _memory_set(self, key, text, created_at):
+        self._memory[key] = (text, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key):
+        """
+        Ищет расшифровку сначала в памяти, затем в общем хранилище
+
+        :return: текст или None при промахе
+        """
+        text, _ = await self.get_any([key])
+        return text
+
+    async def get_any(self, keys):
+        """
+        Ищет расшифровку под любым из ключей: сначала все ключи в памяти, затем в общем хранилище
+
+        Нужен, когда расшифровка могла быть сохранена под разными областями (например,
+        ответил резервный провайдер); ключи проверяются по порядку предпочтения.
+        Поиск считается одним попаданием или промахом.
+
+        :return: кортеж (текст, найденный ключ) или (None, None) при промахе
+        """
+        now = time.time()
+        for key in keys:
+            text = self._memory_get(key, now)
+            if text is not None:
+                self.memory_hits += 1
+                return text, key
+
+        if self._store is not None:
+            for key in keys:
+                try:
+                    row = await asyncio.to_thread(self._store.transcript_get, key, now, self.max_age)
+                except Exception as e:
+                    logging.error(f"Ошибка чтения дискового кэша: {e}")
+                    break
+                if row is not None:
+                    text, created_at = row
+                    self._memory_set(key, text, created_at)
+                    self.disk_hits += 1
+                    return text, key
+
+        self.misses += 1
+        return None, None
+
+    async def set(self, keys, text):
+        """Сохраняет расшифровку под несколькими ключами (file_unique_id и хэш аудио)"""
+        now = time.time()
+        for key in keys:
+            self._memory_set(key, text, now)
+        if self._store is not None:
+            try:
+                await asyncio.to_thread(
+                    self._store.transcript_set, keys, text, now, self.max_age, self.disk_entries
+                )
+            except Exception as e:
+                logging.error(f"Ошибка записи в дисковый кэш: {e}")
+
+    def stats(self):
+        """Возвращает счетчики попаданий и промахов"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """Закрывает хранилище, если кэш открывал его сам"""
+        if self._store is not None and self._owns_store:
+            self._store.close()
+        self._store = None
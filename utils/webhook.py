@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+import aiohttp
+from aiohttp import web
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from config import WEBHOOK_DEDUP_TTL, WEBHOOK_DEDUP_MAX_SIZE, WEBHOOK_DRAIN_TIMEOUT
+
+
+class UpdateDeduplicator:
+    """
+    Ограниченное по размеру и времени жизни множество уже принятых update_id
+
+    С общим хранилищем (state) повтор отбрасывается, даже если Telegram доставил
+    его другому процессу или процессу после перезапуска.
+    """
+
+    def __init__(self, ttl=WEBHOOK_DEDUP_TTL, max_size=WEBHOOK_DEDUP_MAX_SIZE, state=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.state = state if state is not None and state.shared else None
+        # update_id -> время получения, в порядке получения
+        self._seen = OrderedDict()
+        self.duplicates = 0
+
+    def _expire(self, now):
+        """Удаляет устаревшие id и самые старые сверх max_size"""
+        while self._seen:
+            update_id, received_at = next(iter(self._seen.items()))
+            if now - received_at <= self.ttl and len(self._seen) <= self.max_size:
+                break
+            self._seen.popitem(last=False)
+
+    async def seen(self, update_id):
+        """
+        Отмечает update_id как полученный
+
+        :return: True, если этот update_id уже был получен за последние ttl секунд
+        """
+        if update_id is None:
+            return False
+        now = time.monotonic()
+        self._expire(now)
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+        self._seen[update_id] = now
+        # Вытесняем после вставки, чтобы во множестве оставалось не больше max_size id
+        self._expire(now)
+        if self.state is not None:
+            try:
+                claimed = await asyncio.to_thread(self.state.claim, f"update:{update_id}", self.ttl)
+            except Exception as e:
+                # Лучше обработать обновление дважды, чем потерять его
+                logging.error(f"Ошибка общего хранилища при проверке повтора {update_id}: {e}")
+                claimed = True
+            if not claimed:
+                self.duplicates += 1
+                return True
+        return False
+
+    def __len__(self):
+        return len(self._seen)
+
+
+def update_chat_id(update):
+    """
+    Возвращает идентификатор чата, к которому относится обновление
+
+    :param update: обновление Telegram в виде словаря
+    :return: chat_id или, если чата нет (например, inline-запрос), id пользователя; None, если нет и его
+    """
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        for source in (value, value.get("message")):
+            if isinstance(source, dict) and isinstance(source.get("chat"), dict):
+                return source["chat"].get("id")
+        if isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return None
+
+
+class UpdateRouter:
+    """
+    Направляет обновления одного чата в один и тот же процесс-обработчик
+
+    Ядро раздает соединения вебхука процессам случайно, а объединение пересланных
+    пачек и лимиты заданий на чат работают в памяти процесса. Процесс, принявший
+    обновление чужого чата, пересылает его процессу-владельцу по локальному адресу.
+    """
+
+    def __init__(self, worker_index, workers, base_port, path, timeout=5.0):
+        self.worker_index = worker_index
+        self.workers = workers
+        self.base_port = base_port
+        self.path = path
+        self.timeout = timeout
+        self.forwarded = 0
+        self.forward_errors = 0
+        self._session = None
+
+    def owner(self, update):
+        """Номер процесса, который обрабатывает чат обновления"""
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            return self.worker_index
+        return chat_id % self.workers
+
+    def address(self, index):
+        return f"http://127.0.0.1:{self.base_port + index}{self.path}"
+
+    async def forward(self, index, update):
+        """
+        Передает обновление процессу index
+
+        :return: True, если процесс принял обновление
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        try:
+            async with self._session.post(self.address(index), json=update) as response:
+                accepted = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"Не удалось передать обновление {update.get('update_id')} процессу {index}: {e}")
+            accepted = False
+        if accepted:
+            self.forwarded += 1
+        else:
+            self.forward_errors += 1
+        return accepted
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class FastAckRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука, который сразу отвечает Telegram и обрабатывает обновление в фоне.
+
+    Повторно доставленные обновления (Telegram повторяет запрос, если не дождался
+    ответа) отбрасываются по update_id. При остановке новые обновления не
+    принимаются, а уже начатые задания дорабатывают до WEBHOOK_DRAIN_TIMEOUT.
+    С router обновления чужих чатов передаются процессу-владельцу (см. UpdateRouter).
+    """
+
+    def __init__(self, dispatcher, bot, deduplicator=None, drain_timeout=WEBHOOK_DRAIN_TIMEOUT, router=None, **data):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **data)
+        self.deduplicator = deduplicator or UpdateDeduplicator()
+        self.router = router
+        self.drain_timeout = drain_timeout
+        self._tasks = set()
+        self._closing = False
+
+    @property
+    def in_flight(self):
+        """Число обновлений, которые сейчас обрабатываются в фоне"""
+        return len(self._tasks)
+
+    async def handle(self, request):
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+        if self._closing:
+            # Telegram повторит доставку, и обновление обработает следующий экземпляр
+            return web.Response(status=503)
+
+        update = await request.json(loads=bot.session.json_loads)
+        if await self.deduplicator.seen(update.get("update_id")):
+            logging.info(f"Повторная доставка обновления {update.get('update_id')} пропущена")
+            return web.json_response({}, dumps=bot.session.json_dumps)
+
+        self._start(self._route_update(bot, update))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def handle_forwarded(self, request):
+        """Принимает обновление, переданное другим процессом; повторы уже отброшены им"""
+        if self._closing:
+            # Передавший процесс обработает обновление сам
+            return web.Response(status=503)
+        update = await request.json()
+        self._start(self._process_update(self.bot, update))
+        return web.Response(text="OK")
+
+    def _start(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _route_update(self, bot, update):
+        if self.router is not None:
+            owner = self.router.owner(update)
+            # Если владелец недоступен (например, перезапускается), лучше обработать здесь, чем потерять
+            if owner != self.router.worker_index and await self.router.forward(owner, update):
+                return
+        await self._process_update(bot, update)
+
+    async def _process_update(self, bot, update):
+        try:
+            result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+            if isinstance(result, TelegramMethod):
+                await self.dispatcher.silent_call_request(bot=bot, result=result)
+        except Exception as e:
+            logging.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
+
+    async def drain(self):
+        """Перестает принимать обновления и ждет завершения начатых"""
+        self._closing = True
+        if not self._tasks:
+            return
+        logging.info(f"Ожидаем завершения {len(self._tasks)} обновлений (до {self.drain_timeout} с)")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+        if pending:
+            logging.warning(f"Не дождались {len(pending)} обновлений, прерываем")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def close(self):
+        await self.drain()
+        if self.router is not None:
+            await self.router.close()